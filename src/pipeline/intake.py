@@ -0,0 +1,671 @@
+"""Flujo anonimización → conversión sin interfaz gráfica.
+
+``IntakePipeline`` contiene la lógica que usa ``UnifiedWorker`` en la
+aplicación Qt; aquí informa a través de un :class:`IntakeReporter`. Como
+script ejecuta la ingesta completa en un servidor sin ventana y escribe el
+progreso como JSON por líneas::
+
+    DICOM_SALT_SECRET=... python src/pipeline/intake.py /datos/MAMA \\
+        --workers 8 --stage-workers 2,4 --scratch-dir /mnt/nvme/tmp \\
+        --max-buffer-mb 2048 --progress intake.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+_PREPROCESSING_DIR = str(Path(__file__).resolve().parent.parent / "preprocessing")
+if _PREPROCESSING_DIR not in sys.path:
+    sys.path.insert(0, _PREPROCESSING_DIR)
+
+from anon_pipeline import PipelineConfig, resolve_stage_workers, run_stages
+from conversion_manifest import ConversionManifest
+from dicom_processor import (
+    anonymize_jobs,
+    anonymize_uid,
+    close_uid_stores,
+    collect_jobs,
+    is_patient_container_dir,
+    open_journal,
+    resolve_uid_store_path,
+    resolve_workers,
+)
+from dicom_triage import TriageManifest, triage_folder
+from file_discovery import list_dir
+from fused_converter import FusedConverter, resolve_fused
+from nifti_converter import SmartMedicalConverter, resolve_jobs
+from phi_audit import AuditReport, audit_tree, resolve_phi_audit
+
+EXCLUDED_DIRS = ("ANONYMIZED", "NIFTI_CONVERTED", "PROCESSED_DATA", "_temp_anon")
+
+
+def anonymize_patients(
+    patients: list,
+    journal_root: Path,
+    salt: str,
+    max_workers: int,
+    resume: bool = True,
+    uid_store_path: Path | None = None,
+    pipeline: PipelineConfig | None = None,
+    log=print,
+    should_stop=None,
+    files: dict | None = None,
+):
+    """Anonimiza varios pacientes con un único pool de procesos.
+
+    ``patients`` es una lista de ``(src, dst, pid)``; ``files`` puede dar,
+    por paciente, la lista de archivos ya triados. Con ``resume`` los
+    archivos que el journal de ``journal_root`` ya registra se omiten.
+    Informa de los errores por archivo con ``log`` y produce ``(pid,
+    count)`` cada vez que un paciente termina (``count`` = archivos
+    anonimizados, incluidos los omitidos por estar al día).
+    """
+    jobs = []
+    for src, dst, pid in patients:
+        dst.mkdir(parents=True, exist_ok=True)
+        jobs.extend(collect_jobs(src, dst, pid, (files or {}).get(pid)))
+
+    journal = open_journal(journal_root, salt, resume)
+    try:
+        counts = Counter()
+        if journal is not None:
+            jobs, skipped = journal.partition(jobs)
+            counts.update(job.patient_id for job in skipped)
+            if skipped:
+                log(f"Omitidos {len(skipped)} archivos ya anonimizados")
+
+        remaining = Counter(job.patient_id for job in jobs)
+        for _, _, pid in patients:
+            if remaining[pid] == 0:
+                yield pid, counts[pid]
+
+        for job, error in anonymize_jobs(
+            jobs,
+            salt,
+            max_workers,
+            should_stop=should_stop,
+            journal=journal,
+            uid_store_path=uid_store_path,
+            pipeline=pipeline,
+        ):
+            if error:
+                log(f"    Error en {job.src.name}: {error}")
+            else:
+                counts[job.patient_id] += 1
+            remaining[job.patient_id] -= 1
+            if remaining[job.patient_id] == 0:
+                yield job.patient_id, counts[job.patient_id]
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def patient_folders(input_path: Path) -> list:
+    return [d for d in list_dir(input_path)[0] if d.name not in EXCLUDED_DIRS and not d.name.startswith("ANON")]
+
+
+@dataclass
+class _AnonymizedPatient:
+    """Resultado de la etapa de anonimización del flujo en dos fases."""
+
+    jobs: list
+    modality: str
+    settings: dict
+    count: int = 0
+    report: AuditReport | None = None
+    triage: TriageManifest | None = None
+    up_to_date: bool = False
+
+
+class IntakeReporter:
+    """Destino de los eventos de :class:`IntakePipeline`; por defecto no hace nada."""
+
+    def log(self, message: str) -> None: ...
+    def phase(self, message: str) -> None: ...
+    def progress(self, done: int, total: int) -> None: ...
+    def stage_progress(self, stage: str, done: int, total: int) -> None: ...
+    def patient(self, patient_id: str, success: bool, modality: str, reason: str) -> None: ...
+    def plan(self, patient_id: str, modality: str, series: int, files: int, size: int, quarantined: int) -> None: ...
+    def done(self, ok: bool, message: str) -> None: ...
+
+
+class JsonLinesReporter(IntakeReporter):
+    """Un objeto JSON por línea y evento, con marca de tiempo, en ``stream``."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def _emit(self, event: str, **fields) -> None:
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self._emit("log", message=message)
+
+    def phase(self, message):
+        self._emit("phase", message=message)
+
+    def progress(self, done, total):
+        self._emit("progress", done=done, total=total)
+
+    def stage_progress(self, stage, done, total):
+        self._emit("stage", stage=stage, done=done, total=total)
+
+    def patient(self, patient_id, success, modality, reason):
+        self._emit("patient", patient=patient_id, success=success, modality=modality, reason=reason)
+
+    def plan(self, patient_id, modality, series, files, size, quarantined):
+        self._emit(
+            "plan", patient=patient_id, modality=modality, series=series, files=files, bytes=size,
+            quarantined=quarantined,
+        )
+
+    def done(self, ok, message):
+        self._emit("done", ok=ok, message=message)
+
+
+class IntakePipeline:
+    """Anonimiza y convierte en una sola pasada.
+
+    Anonimización y conversión son dos etapas solapadas: mientras un
+    paciente (o serie) se convierte, el siguiente se anonimiza. Cada etapa
+    usa ``stage_workers`` hilos; ``progress`` avanza por paciente
+    convertido y ``stage_progress`` informa de cada etapa por separado.
+
+    Por defecto se anonimiza a ``_temp_anon`` dentro de la carpeta de
+    entrada y se convierte desde ahí a ``PROCESSED_DATA/``. La carpeta
+    se borra al terminar; con ``resume`` se conserva si la ejecución se
+    cancela o falla. El journal vive en ``PROCESSED_DATA/`` y no en la
+    carpeta temporal: retoma la anonimización interrumpida y, con
+    ``resume``, omite los pacientes ya convertidos cuyos archivos, salt
+    y ajustes de conversión no cambiaron y cuyas salidas siguen ahí.
+
+    Con ``fused`` (o ``DICOM_FUSED=1``, ver :class:`FusedConverter`) no se
+    escribe ``_temp_anon``: los DX van a imagen desde memoria y las series
+    volumétricas pasan por ``scratch_dir`` una a una. Ese modo no tiene
+    journal ni auditoría PHI.
+
+    ``converter_options`` se pasan a :class:`SmartMedicalConverter`
+    (``engine``, ``zarr_mode``, ``mammo_format``, ...). Con ``dry_run`` solo
+    se informa del plan (pacientes, series, archivos y bytes) sin escribir.
+
+    Cada paciente pasa antes por el triaje (:func:`triage_folder`): solo
+    sus archivos válidos llegan a las etapas siguientes, sin volver a
+    recorrer la carpeta. Con ``triage_dir`` el resultado se guarda ahí
+    como ``<paciente>.triage.json``.
+
+    En el flujo en dos fases, con ``phi_audit`` (por defecto, ver
+    ``DICOM_PHI_AUDIT``) cada paciente anonimizado pasa por
+    :func:`audit_tree` antes de convertirse; si quedan datos
+    identificativos no se convierte y cuenta como error.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        salt: str,
+        max_workers: int | None = None,
+        resume: bool = True,
+        uid_store_path: str | None = None,
+        pipeline: PipelineConfig | None = None,
+        fused: bool | None = None,
+        scratch_dir: str | None = None,
+        stage_workers: tuple[int, int] | None = None,
+        dcm2niix_jobs: int | None = None,
+        converter_options: dict | None = None,
+        dry_run: bool = False,
+        triage_dir: str | None = None,
+        phi_audit: bool | None = None,
+        reporter: IntakeReporter | None = None,
+        should_stop=None,
+    ):
+        self.input_path = Path(input_dir)
+        self.salt = salt
+        self.max_workers = resolve_workers(max_workers)
+        self.resume = resume
+        self.uid_store_path = resolve_uid_store_path(uid_store_path)
+        self.pipeline = pipeline or PipelineConfig.from_env()
+        self.fused = resolve_fused(fused)
+        self.scratch_dir = scratch_dir
+        self.stage_workers = resolve_stage_workers(stage_workers)
+        self.dcm2niix_jobs = dcm2niix_jobs
+        self.converter_options = converter_options or {}
+        self.dry_run = dry_run
+        self.triage_dir = Path(triage_dir) if triage_dir else None
+        self.phi_audit = resolve_phi_audit(phi_audit)
+        self.reporter = reporter or IntakeReporter()
+        self.should_stop = should_stop or (lambda: False)
+
+    def run(self) -> bool:
+        """Ejecuta la ingesta; ``True`` si terminó sin cancelarse ni fallar."""
+        tmp = self.input_path / "_temp_anon"
+        completed = False
+        converter = fused = None
+        try:
+            patients = self._patients()
+            if patients is None:
+                return False
+            try:
+                converter = SmartMedicalConverter(
+                    str(tmp),
+                    output_dir=str(self.input_path / "PROCESSED_DATA"),
+                    max_jobs=max(self.stage_workers[1], resolve_jobs(self.dcm2niix_jobs)),
+                    should_stop=self.should_stop,
+                    scratch_dir=self.scratch_dir,
+                    **self.converter_options,
+                )
+            except (RuntimeError, ValueError) as exc:
+                self.reporter.done(False, str(exc))
+                return False
+
+            if self.fused or self.dry_run:
+                fused = FusedConverter(
+                    converter,
+                    self.salt,
+                    scratch_dir=self.scratch_dir,
+                    max_workers=self.max_workers,
+                    uid_store_path=self.uid_store_path,
+                    pipeline=self.pipeline,
+                    log=self.reporter.log,
+                )
+            if self.dry_run:
+                return self._plan(patients, fused)
+
+            self.reporter.phase("Anonimizando y convirtiendo a NIfTI / PNG…")
+            anon_threads, convert_threads = self.stage_workers
+            self.reporter.log(
+                f"Pacientes encontrados: {len(patients)}  (workers={self.max_workers}, "
+                f"etapas={anon_threads}+{convert_threads}, dcm2niix={converter.pool.max_jobs})\n"
+            )
+            if self.fused:
+                completed = self._run_fused(patients, converter, fused)
+            else:
+                completed = self._run_two_phase(patients, converter, tmp)
+            return completed
+
+        except Exception as exc:
+            self.reporter.done(False, f"Error inesperado: {exc}")
+            return False
+        finally:
+            if fused is not None:
+                fused.close()
+            close_uid_stores()
+            if converter is not None:
+                converter.close()
+                shutil.rmtree(converter.temp_dir, ignore_errors=True)
+            if not self.dry_run and tmp.exists() and (completed or not self.resume):
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def _patients(self) -> list | None:
+        """``(src, pid)`` a procesar; informa ``done`` y devuelve ``None`` si no hay."""
+        if not is_patient_container_dir(self.input_path):
+            return [(self.input_path, self.input_path.name)]
+        patients = [(d, d.name) for d in patient_folders(self.input_path)]
+        if not patients:
+            self.reporter.done(False, "No se encontraron carpetas de pacientes.")
+            return None
+        return patients
+
+    def _triage(self, src: Path, pid: str) -> TriageManifest:
+        triage = triage_folder(src, exclude=EXCLUDED_DIRS)
+        self.reporter.log(f"  Triaje {pid}: {triage.summary()}")
+        for record in triage.quarantined:
+            self.reporter.log(f"    Cuarentena {record.path.relative_to(src)}: {record.reason}")
+        if self.triage_dir is not None:
+            triage.save(self.triage_dir / f"{pid}.triage.json")
+        return triage
+
+    def _plan(self, patients: list, fused: FusedConverter) -> bool:
+        totals = Counter()
+        for src, pid in patients:
+            if self.should_stop():
+                break
+            triage = self._triage(src, pid)
+            units = fused.plan_patient(src, pid, triage)
+            files, size, quarantined = len(triage.valid), triage.total_bytes(), len(triage.quarantined)
+            series = len(units) if files and fused.converter.is_volumetric_modality(units[0].modality) else 0
+            self.reporter.plan(pid, units[0].modality, series, files, size, quarantined)
+            totals.update(patients=1, series=series, files=files, bytes=size, quarantined=quarantined)
+        self.reporter.done(
+            True,
+            f"Simulación: {totals['patients']} pacientes, {totals['series']} series, "
+            f"{totals['files']} archivos ({totals['bytes'] / 1024 ** 3:.2f} GiB), "
+            f"{totals['quarantined']} en cuarentena. No se escribió nada.",
+        )
+        return True
+
+    def _stages(self, anonymize, convert) -> list:
+        anon_threads, convert_threads = self.stage_workers
+        return [(anonymize, anon_threads), (convert, convert_threads)]
+
+    def _report_patient(self, pid: str, result: tuple, converted: int, total: int) -> None:
+        success, modality, reason = result
+        mark = "✓" if success else "✗"
+        self.reporter.log(f"  {mark} [{modality}] ANON{pid} — {reason}")
+        self.reporter.patient(pid, success, modality, reason)
+        self.reporter.progress(converted, total)
+        self.reporter.stage_progress("Conversión", converted, total)
+
+    def _finish(self, stats: Counter, total: int, converter: SmartMedicalConverter) -> bool:
+        if self.should_stop():
+            self.reporter.done(False, f"Cancelado. {stats['success']} OK, {stats['failed']} errores.")
+            return False
+        if stats["success"] + stats["failed"] == 0:
+            self.reporter.done(False, "No se encontraron archivos DICOM.")
+            return False
+        self.reporter.done(
+            True,
+            f"Completado: {stats['success']} OK, {stats['failed']} errores de {total} pacientes.\n"
+            f"Archivos guardados en: {converter.output_path}",
+        )
+        return True
+
+    def _run_two_phase(self, patients: list, converter: SmartMedicalConverter, tmp: Path) -> bool:
+        """Anonimiza a ``_temp_anon`` y convierte cada paciente en cuanto
+        termina, mientras el siguiente se anonimiza."""
+        tmp.mkdir(parents=True, exist_ok=True)
+        converter.output_path.mkdir(parents=True, exist_ok=True)
+        total = len(patients)
+
+        def anonymize(patient):
+            src, pid = patient
+            dst = tmp / f"ANON{pid}"
+            triage = self._triage(src, pid)
+            modality = triage.modality()
+            state = _AnonymizedPatient(
+                collect_jobs(src, dst, pid, triage.files()),
+                modality,
+                converter.conversion_settings("2D" if modality == "DX" else "3D"),
+            )
+            if self.resume and state.jobs and self._is_converted(converter, pid, state):
+                self.reporter.log(f"  = {pid} — sin cambios desde la última conversión")
+                state.up_to_date = True
+                return state
+            state.count = self._anonymize_folder(src, dst, pid, triage.files(), converter.output_path)
+            if state.count == 0:
+                self.reporter.log(f"  ✗ {pid} — sin archivos DICOM")
+                return state
+            self.reporter.log(f"  ✓ {pid} — {state.count} archivos anonimizados")
+            state.triage = self._anonymized_triage(triage, src, dst, pid)
+            if self.phi_audit:
+                state.report = audit_tree(
+                    dst, self.max_workers, expected=self._expected_uids(state.triage), uid_store=self._audit_store()
+                )
+                if not state.report.passed():
+                    self.reporter.log(state.report.summary())
+            return state
+
+        def convert(patient, state):
+            if state.up_to_date:
+                return (True, state.modality, f"Up to date: {len(state.jobs)} files unchanged")
+            if state.count == 0:
+                return None
+            report = state.report
+            if report is not None and not report.passed():
+                return (False, "UNKNOWN", f"Auditoría PHI: {len(report.errors)} errores, "
+                        f"{len(report.unreadable)} ilegibles; no se convierte")
+            result = converter.convert_patient(tmp / f"ANON{patient[1]}", state.triage)
+            if result[0] and state.count == len(state.jobs) and not self.should_stop():
+                self._mark_converted(converter, patient[1], state)
+            return result
+
+        stats = Counter()
+        anonymized = converted = 0
+        for stage, (_, pid), error, result in run_stages(
+            patients,
+            self._stages(anonymize, convert),
+            queue_size=self.stage_workers[1],
+            should_stop=self.should_stop,
+        ):
+            if stage == 0 or error is not None:
+                anonymized += 1
+                self.reporter.stage_progress("Anonimización", anonymized, total)
+            if stage == 0 and error is None:
+                continue
+            converted += 1
+            if error is not None:
+                result = (False, "UNKNOWN", error)
+            if result is None:
+                self.reporter.progress(converted, total)
+                self.reporter.stage_progress("Conversión", converted, total)
+                continue
+            stats["success" if result[0] else "failed"] += 1
+            self._report_patient(pid, result, converted, total)
+
+        return self._finish(stats, stats["success"] + stats["failed"], converter)
+
+    def _run_fused(self, patients: list, converter: SmartMedicalConverter, fused: FusedConverter) -> bool:
+        """Solapa por serie: mientras dcm2niix convierte una, la siguiente
+        (del mismo paciente o del siguiente) se anonimiza en scratch."""
+        total = len(patients)
+        units = (
+            unit
+            for src, pid in patients
+            for unit in fused.check_manifest(fused.plan_patient(src, pid, self._triage(src, pid)))
+        )
+
+        def anonymize(unit):
+            return fused.anonymize_unit(unit, self.should_stop)
+
+        progress: dict = {}
+        stats = Counter()
+        anonymized = converted = 0
+        for stage, unit, error, result in run_stages(
+            units,
+            self._stages(anonymize, fused.convert_unit),
+            queue_size=self.stage_workers[1],
+            should_stop=self.should_stop,
+        ):
+            state = progress.setdefault(
+                unit.patient_id, {"anonymized": 0, "converted": 0, "count": 0, "error": "", "up_to_date": 0}
+            )
+            if stage == 0 or error is not None:
+                state["anonymized"] += 1
+                if state["anonymized"] == unit.series_count:
+                    anonymized += 1
+                    self.reporter.stage_progress("Anonimización", anonymized, total)
+            if stage == 0 and error is None:
+                continue
+
+            count, message = result if error is None else (0, error)
+            state["count"] += count
+            state["error"] = state["error"] or message
+            state["converted"] += 1
+            state["up_to_date"] += unit.up_to_date
+            if state["converted"] < unit.series_count:
+                continue
+
+            converted += 1
+            outcome = fused.summarize(unit, state["count"], state["error"], state["up_to_date"])
+            stats["success" if outcome[0] else "failed"] += 1
+            self._report_patient(unit.patient_id, outcome, converted, total)
+
+        return self._finish(stats, total, converter)
+
+    def _anonymized_triage(self, triage: TriageManifest, src: Path, dst: Path, pid: str) -> TriageManifest:
+        """El triaje de ``src`` trasladado a su copia anonimizada en ``dst``:
+        misma modalidad y sintaxis, con los UIDs que pone el anonimizador,
+        para que la conversión no vuelva a abrir cada cabecera."""
+        def anon(uid):
+            return anonymize_uid(uid, self.salt) if uid else ""
+
+        records = []
+        for job in collect_jobs(src, dst, pid, triage.files()):
+            record = triage.get(job.src)
+            if record is not None and job.dst.exists():
+                records.append(replace(
+                    record,
+                    path=job.dst,
+                    series_uid=anon(record.series_uid),
+                    study_uid=anon(record.study_uid),
+                    instance_uid=anon(record.instance_uid),
+                ))
+        return TriageManifest(records, dst)
+
+    @staticmethod
+    def _expected_uids(triage: TriageManifest) -> dict:
+        """UIDs que debe tener cada copia anonimizada, para que la auditoría
+        los compare exactamente y no solo por prefijo."""
+        expected = {}
+        for record in triage.valid:
+            uids = {
+                "StudyInstanceUID": record.study_uid,
+                "SeriesInstanceUID": record.series_uid,
+                "SOPInstanceUID": record.instance_uid,
+            }
+            expected[str(record.path)] = {k: v for k, v in uids.items() if v}
+        return expected
+
+    def _audit_store(self) -> tuple | None:
+        """``(ruta, salt)`` del índice de UIDs para la auditoría, si hay uno."""
+        return (str(self.uid_store_path), self.salt) if self.uid_store_path else None
+
+    @staticmethod
+    def _series_keys(state: _AnonymizedPatient) -> set:
+        """Claves de ``.conversion.json`` que debe tener el paciente convertido."""
+        if state.modality == "DX":
+            return {"2D"}
+        return {r.series_uid for r in state.triage.valid} if state.triage is not None else set()
+
+    def _is_converted(self, converter: SmartMedicalConverter, pid: str, state: _AnonymizedPatient) -> bool:
+        manifest = ConversionManifest(converter.output_path / f"ANON{pid}")
+        if not manifest.outputs_exist():
+            return False
+        with open_journal(converter.output_path, self.salt, True) as journal:
+            return journal.is_converted(pid, state.jobs, state.settings)
+
+    def _mark_converted(self, converter: SmartMedicalConverter, pid: str, state: _AnonymizedPatient) -> None:
+        """Registra el paciente como convertido si ``.conversion.json`` tiene
+        todas sus series; una serie fallida hace que se reintente."""
+        manifest = ConversionManifest(converter.output_path / f"ANON{pid}")
+        keys = self._series_keys(state)
+        if not keys or not keys <= set(manifest.entries):
+            return
+        with open_journal(converter.output_path, self.salt, True) as journal:
+            journal.mark_converted(pid, state.jobs, state.settings)
+
+    def _anonymize_folder(self, src: Path, dst: Path, pid: str, files: list | None = None,
+                          journal_root: Path | None = None) -> int:
+        count = 0
+        for _, n in anonymize_patients(
+            [(src, dst, pid)],
+            journal_root or dst.parent,
+            self.salt,
+            self.max_workers,
+            resume=self.resume,
+            uid_store_path=self.uid_store_path,
+            pipeline=self.pipeline,
+            log=self.reporter.log,
+            should_stop=self.should_stop,
+            files={pid: files} if files is not None else None,
+        ):
+            count = n
+        return count
+
+
+def _pair(value: str) -> tuple:
+    return tuple(int(p) for p in value.split(",") if p.strip())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Anonimiza y convierte DICOM a NIfTI / imágenes 2D sin interfaz gráfica. "
+        "El salt se lee de DICOM_SALT_SECRET (entorno o .env).",
+    )
+    parser.add_argument("input_dir", help="Carpeta con las carpetas de pacientes (o un solo paciente)")
+    parser.add_argument("--workers", type=int, help="Procesos de anonimización (DICOM_WORKERS)")
+    parser.add_argument("--stage-workers", type=_pair, metavar="A,C",
+                        help="Hilos de las etapas anonimización,conversión (DICOM_STAGE_WORKERS)")
+    parser.add_argument("--dcm2niix-jobs", type=int, help="Procesos dcm2niix simultáneos; 0 = núcleos (DCM2NIIX_JOBS)")
+    parser.add_argument("--scratch-dir", help="Directorio temporal rápido (DICOM_SCRATCH_DIR)")
+    parser.add_argument("--pipeline", type=_pair, metavar="R,T,W",
+                        help="Lectores,transformadores,escritores del pipeline de E/S (DICOM_PIPELINE)")
+    parser.add_argument("--max-buffer-mb", type=int,
+                        help="Memoria máxima de datos leídos y aún no escritos; activa el pipeline de E/S")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--fused", action="store_true",
+                      help="Anonimizar y convertir sin _temp_anon; sin journal ni auditoría PHI (DICOM_FUSED=1)")
+    mode.add_argument("--two-phase", action="store_true",
+                      help="Anonimizar a _temp_anon y convertir desde ahí (por defecto)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignorar el journal: volver a anonimizar todos los archivos y pacientes")
+    parser.add_argument("--no-phi-audit", action="store_true",
+                        help="No auditar la salida anonimizada antes de convertir (DICOM_PHI_AUDIT=0)")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar el plan; no escribe nada")
+    parser.add_argument("--triage-dir", help="Guardar aquí el triaje de cada paciente (<paciente>.triage.json)")
+    parser.add_argument("--engine", choices=("dcm2niix", "native"), help="Motor NIfTI (NIFTI_ENGINE)")
+    parser.add_argument("--zarr", choices=("off", "alongside", "only"), help="Copia Zarr de los volúmenes (NIFTI_ZARR)")
+    parser.add_argument("--mammo-format", help="png, png:1, tiff, tiff:6 o npy (MAMMO_FORMAT)")
+    parser.add_argument("--mammo-workers", type=int, help="Hilos de exportación de mamografías; 0 = núcleos (MAMMO_WORKERS)")
+    parser.add_argument("--progress", default="-", help="Archivo de progreso JSON por líneas ('-' = stdout)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    salt = os.getenv("DICOM_SALT_SECRET", "").strip()
+    if not salt and not args.dry_run:
+        print("DICOM_SALT_SECRET no está definido.", file=sys.stderr)
+        return 2
+
+    pipeline = None
+    if args.pipeline or args.max_buffer_mb:
+        fields = dict(zip(("readers", "transformers", "writers"), args.pipeline or ()))
+        if args.max_buffer_mb:
+            fields["max_buffer_mb"] = args.max_buffer_mb
+        pipeline = replace(PipelineConfig.from_env() or PipelineConfig(), **fields)
+
+    converter_options = {
+        key: value for key, value in (
+            ("engine", args.engine),
+            ("zarr_mode", args.zarr),
+            ("mammo_format", args.mammo_format),
+            ("mammo_workers", args.mammo_workers),
+        ) if value is not None
+    }
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    stream = sys.stdout if args.progress == "-" else open(args.progress, "a", encoding="utf-8")
+    try:
+        ok = IntakePipeline(
+            args.input_dir,
+            salt,
+            max_workers=args.workers,
+            resume=not args.no_resume,
+            pipeline=pipeline,
+            fused=True if args.fused else False if args.two_phase else None,
+            scratch_dir=args.scratch_dir,
+            stage_workers=args.stage_workers,
+            dcm2niix_jobs=args.dcm2niix_jobs,
+            converter_options=converter_options,
+            dry_run=args.dry_run,
+            triage_dir=args.triage_dir,
+            phi_audit=False if args.no_phi_audit else None,
+            reporter=JsonLinesReporter(stream),
+            should_stop=stop.is_set,
+        ).run()
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    if stop.is_set():
+        return 130
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
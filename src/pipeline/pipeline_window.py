@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import os
 import sys
+from datetime import datetime
 from pathlib import Path
 
 os.environ.setdefault("QT_API", "pyside6")
 
-from PySide6.QtCore import QSize
+from PySide6.QtCore import QSize, QTimer
 from PySide6.QtGui import QFont
 from PySide6.QtWidgets import (
     QApplication,
@@ -16,14 +17,28 @@ from PySide6.QtWidgets import (
     QLabel,
     QLineEdit,
     QMainWindow,
+    QPlainTextEdit,
     QProgressBar,
     QPushButton,
-    QTextEdit,
     QVBoxLayout,
     QWidget,
 )
 
 from pipeline_workers import UnifiedWorker
+from file_discovery import first_file, list_dir
+from intake import EXCLUDED_DIRS
+
+LOG_FLUSH_MS = 250
+LOG_MAX_LINES = 5000
+DEFAULT_LOG_DIR = Path(__file__).resolve().parents[2] / "data" / "logs"
+
+
+def _log_path() -> Path:
+    """Archivo con el log completo de una ejecución, en PIPELINE_LOG_DIR
+    (o ``data/logs`` del proyecto). Nombra carpetas de pacientes sin
+    anonimizar: :class:`LogChannel` lo crea solo legible por el usuario."""
+    folder = Path(os.getenv("PIPELINE_LOG_DIR") or DEFAULT_LOG_DIR)
+    return folder / f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.log"
 
 
 def _monospace_font() -> QFont:
@@ -42,7 +57,11 @@ class _PipelinePanel(QWidget):
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent)
         self._worker: UnifiedWorker | None = None
+        self._stage_counts: dict[str, tuple[int, int]] = {}
         self._salt = os.getenv("DICOM_SALT_SECRET", "").strip()
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(LOG_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush)
         self._init_ui()
 
     def _init_ui(self):
@@ -90,8 +109,9 @@ class _PipelinePanel(QWidget):
         self._progress.setVisible(False)
         layout.addWidget(self._progress)
 
-        self._log = QTextEdit()
+        self._log = QPlainTextEdit()
         self._log.setReadOnly(True)
+        self._log.setMaximumBlockCount(LOG_MAX_LINES)
         self._log.setFont(_monospace_font())
         layout.addWidget(self._log, stretch=1)
 
@@ -115,17 +135,8 @@ class _PipelinePanel(QWidget):
         self._input_edit.setText(folder)
 
         p = Path(folder)
-        subdirs = [
-            d for d in p.iterdir()
-            if d.is_dir()
-            and not d.name.startswith(".")
-            and d.name not in ("ANONYMIZED", "NIFTI_CONVERTED", "PROCESSED_DATA")
-        ]
-        has_direct_dcm = bool(list(p.rglob("*.dcm"))[:1])
-        has_sub_dcm = (
-            any(list(d.rglob("*.dcm"))[:1] for d in subdirs[:5])
-            if subdirs else False
-        )
+        subdirs = [d for d in list_dir(p)[0] if d.name not in EXCLUDED_DIRS]
+        has_sub_dcm = any(first_file(d) for d in subdirs[:5])
 
         if has_sub_dcm and len(subdirs) > 1:
             self._mode_label.setText(
@@ -133,7 +144,7 @@ class _PipelinePanel(QWidget):
             )
             self._mode_label.setStyleSheet("color:#1565c0; font-weight:bold;")
             self._btn_start.setEnabled(bool(self._salt))
-        elif has_direct_dcm:
+        elif has_sub_dcm or first_file(p):
             self._mode_label.setText("Modo INDIVIDUAL — 1 paciente")
             self._mode_label.setStyleSheet("color:#2e7d32; font-weight:bold;")
             self._btn_start.setEnabled(bool(self._salt))
@@ -149,44 +160,62 @@ class _PipelinePanel(QWidget):
         self._progress.setValue(0)
         self._btn_start.setEnabled(False)
         self._btn_cancel.setEnabled(True)
+        self._stage_counts = {}
 
-        self._worker = UnifiedWorker(self._input_edit.text(), self._salt)
-        self._worker.progress.connect(self._on_progress)
-        self._worker.log.connect(self._on_log)
+        self._worker = UnifiedWorker(self._input_edit.text(), self._salt, log_path=str(_log_path()))
         self._worker.phase.connect(self._on_phase)
         self._worker.done.connect(self._on_done)
+        self._worker.finished.connect(self._on_worker_finished)
         self._worker.start()
+        self._flush_timer.start()
 
     def _on_cancel(self):
         if self._worker and self._worker.isRunning():
             self._worker.requestInterruption()
-            self._on_log("Cancelando… por favor espera.")
+            self._worker.log.emit("Cancelando… por favor espera.")
+
+    def _flush(self):
+        """Vuelca al panel lo que el worker acumuló desde la última vez."""
+        if self._worker is None:
+            return
+        lines = self._worker.log.drain()
+        if lines:
+            self._log.appendPlainText("\n".join(lines))
+        for cur, total in self._worker.progress.drain():
+            self._on_progress(cur, total)
+        for stage, cur, total in self._worker.stage_progress.drain():
+            self._on_stage_progress(stage, cur, total)
 
     def _on_phase(self, msg: str):
+        self._flush()
         self._phase_label.setText(msg)
-        self._log.append(f"\n▶ {msg}")
 
     def _on_progress(self, cur: int, total: int):
         self._progress.setMaximum(total)
         self._progress.setValue(cur)
 
-    def _on_log(self, msg: str):
-        self._log.append(msg)
+    def _on_stage_progress(self, stage: str, cur: int, total: int):
+        self._stage_counts[stage] = (cur, total)
+        self._phase_label.setText(
+            " · ".join(f"{name} {n}/{t}" for name, (n, t) in self._stage_counts.items())
+        )
 
     def _on_done(self, ok: bool, msg: str):
+        self._flush()
+        if self._worker.log.log_path is not None:
+            self._log.appendPlainText(f"Log completo: {self._worker.log.log_path}")
         self._btn_start.setEnabled(bool(self._salt))
         self._btn_cancel.setEnabled(False)
         self._phase_label.setText("✓ Finalizado" if ok else "✗ Error")
         self._phase_label.setStyleSheet(
             "font-weight:bold; color:#2e7d32;" if ok else "font-weight:bold; color:#c62828;"
         )
-        self._log.append(f"\n{'=' * 50}")
-        self._log.append(msg)
-        if self._worker is not None:
-            self._worker.finished.connect(self._on_worker_finished)
 
     def _on_worker_finished(self):
+        self._flush_timer.stop()
         if self._worker is not None:
+            self._flush()
+            self._worker.log.close()
             self._worker.deleteLater()
             self._worker = None
 
@@ -1,35 +1,111 @@
 from __future__ import annotations
 
+import os
 import shutil
 import sys
+import threading
 from pathlib import Path
 
 _PREPROCESSING_DIR = str(Path(__file__).resolve().parent.parent / "preprocessing")
 if _PREPROCESSING_DIR not in sys.path:
     sys.path.insert(0, _PREPROCESSING_DIR)
 
-import pydicom
 from PySide6.QtCore import QThread, Signal
 
-from dicom_processor import anonymize_dicom_ps315, is_patient_container_dir
+from anon_pipeline import PipelineConfig
+from dicom_processor import close_uid_stores, is_patient_container_dir, resolve_uid_store_path, resolve_workers
+from intake import IntakePipeline, IntakeReporter, anonymize_patients, patient_folders
 from nifti_converter import SmartMedicalConverter
+from phi_audit import audit_tree, resolve_phi_audit
+
+
+class LogChannel:
+    """Mensajes del worker para la ventana, sin una señal Qt por línea.
+
+    El worker llama a :meth:`emit` desde su hilo; la ventana recoge lo
+    acumulado con :meth:`drain` unas cuantas veces por segundo. Con
+    ``log_path`` cada mensaje se copia además a ese archivo, que conserva
+    el log completo aunque la ventana solo muestre las últimas líneas. Como
+    contiene nombres originales de carpetas, la carpeta se deja en 0700 y
+    el archivo se crea en 0600.
+    """
+
+    def __init__(self, log_path: str | Path | None = None):
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        self.log_path = Path(log_path) if log_path else None
+        self._file = None
+        if self.log_path is not None:
+            self.log_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            os.chmod(self.log_path.parent, 0o700)
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            self._file = os.fdopen(fd, "a", encoding="utf-8")
+
+    def emit(self, message: str) -> None:
+        with self._lock:
+            self._pending.append(message)
+            if self._file is not None:
+                self._file.write(message + "\n")
+
+    def drain(self) -> list[str]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._file is not None:
+                self._file.flush()
+        return pending
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ProgressChannel:
+    """Último progreso emitido; los valores intermedios que la ventana no
+    llegó a recoger se descartan. Con ``keyed`` se guarda el último por
+    etapa (primer argumento)."""
+
+    def __init__(self, keyed: bool = False):
+        self._keyed = keyed
+        self._latest: dict = {}
+        self._lock = threading.Lock()
+
+    def emit(self, *values) -> None:
+        with self._lock:
+            self._latest[values[0] if self._keyed else None] = values
+
+    def drain(self) -> list[tuple]:
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return list(latest.values())
+
 
 class AnonymizeWorker(QThread):
-    progress = Signal(int, int)          
-    log      = Signal(str)               
-    done     = Signal(bool, str)         
+    done = Signal(bool, str)
 
     def __init__(
         self,
         input_dir: str,
         salt: str,
         output_dir: str | None = None,
+        max_workers: int | None = None,
+        resume: bool = True,
+        uid_store_path: str | None = None,
+        pipeline: PipelineConfig | None = None,
+        log_path: str | None = None,
         parent=None,
     ):
         super().__init__(parent)
+        self.log = LogChannel(log_path)
+        self.progress = ProgressChannel()
         self.input_path = Path(input_dir)
         self.salt = salt
         self._output_dir = output_dir
+        self.max_workers = resolve_workers(max_workers)
+        self.resume = resume
+        self.uid_store_path = resolve_uid_store_path(uid_store_path)
+        self.pipeline = pipeline or PipelineConfig.from_env()
 
     def run(self):
         try:
@@ -39,6 +115,8 @@ class AnonymizeWorker(QThread):
                 self._run_single(self.input_path)
         except Exception as exc:
             self.done.emit(False, f"Error inesperado: {exc}")
+        finally:
+            close_uid_stores()
 
     
     def _output_base(self) -> Path:
@@ -49,44 +127,45 @@ class AnonymizeWorker(QThread):
     def _run_batch(self):
         self.log.emit(f"Modo BATCH detectado en: {self.input_path}")
 
-        patient_folders = sorted(
-            d
-            for d in self.input_path.iterdir()
-            if d.is_dir()
-            and not d.name.startswith(".")
-            and d.name not in ("ANONYMIZED", "NIFTI_CONVERTED", "PROCESSED_DATA")
-            and not d.name.startswith("ANON")
-        )
+        folders = patient_folders(self.input_path)
 
-        if not patient_folders:
+        if not folders:
             self.done.emit(False, "No se encontraron carpetas de pacientes.")
             return
 
         out_base = self._output_base()
         out_base.mkdir(parents=True, exist_ok=True)
 
-        total = len(patient_folders)
+        total = len(folders)
         self.log.emit(f"Pacientes encontrados: {total}")
-        self.log.emit(f"Salida: {out_base}\n")
+        self.log.emit(f"Salida: {out_base}")
+        self.log.emit(f"Workers: {self.max_workers}\n")
 
-        ok = 0
-        for idx, folder in enumerate(patient_folders):
-            if self.isInterruptionRequested():
-                self.done.emit(False, f"Cancelado. Procesados: {ok}/{total}")
-                return
-
-            pid = folder.name
-            out = out_base / f"ANON{pid}"
-            self.log.emit(f"[{idx + 1}/{total}] {pid}")
+        patients = [(d, out_base / f"ANON{d.name}", d.name) for d in folders]
 
-            count = self._anonymize_folder(folder, out, pid)
+        ok = 0
+        finished = 0
+        for pid, count in self._anonymize(patients, out_base):
+            finished += 1
             if count > 0:
                 ok += 1
-                self.log.emit(f"  ✓ {count} archivos anonimizados")
+                self.log.emit(f"[{finished}/{total}] {pid}  ✓ {count} archivos anonimizados")
             else:
-                self.log.emit(f"  ✗ Sin archivos DICOM")
+                self.log.emit(f"[{finished}/{total}] {pid}  ✗ Sin archivos DICOM")
+
+            self.progress.emit(finished, total)
 
-            self.progress.emit(idx + 1, total)
+        if self.isInterruptionRequested():
+            self.done.emit(False, f"Cancelado. Procesados: {ok}/{total}")
+            return
+
+        if resolve_phi_audit():
+            uid_store = (str(self.uid_store_path), self.salt) if self.uid_store_path else None
+            report = audit_tree(out_base, self.max_workers, uid_store=uid_store)
+            self.log.emit(report.summary())
+            if not report.passed():
+                self.done.emit(False, f"Completado: {ok}/{total} pacientes, pero la auditoría PHI falló.")
+                return
 
         self.done.emit(True, f"Completado: {ok}/{total} pacientes procesados.")
 
@@ -105,43 +184,40 @@ class AnonymizeWorker(QThread):
             self.done.emit(False, "No se encontraron archivos DICOM.")
 
     def _anonymize_folder(self, src: Path, dst: Path, pid: str) -> int:
-        dst.mkdir(parents=True, exist_ok=True)
-
-        dcm_files = [f for f in src.rglob("*.dcm") if not f.name.startswith(".")]
-        if not dcm_files:
-            return 0
-
         count = 0
-        for dcm_file in dcm_files:
-            if self.isInterruptionRequested():
-                return count
-            try:
-                ds = pydicom.dcmread(dcm_file)
-                ds_anon = anonymize_dicom_ps315(ds, self.salt, pid)
-
-                rel = dcm_file.relative_to(src)
-                save = dst / rel
-                save.parent.mkdir(parents=True, exist_ok=True)
-                ds_anon.save_as(save)
-                count += 1
-            except Exception as exc:
-                self.log.emit(f"    Error en {dcm_file.name}: {exc}")
-
+        for _, n in self._anonymize([(src, dst, pid)], dst.parent):
+            count = n
         return count
 
+    def _anonymize(self, patients: list, journal_root: Path):
+        return anonymize_patients(
+            patients,
+            journal_root,
+            self.salt,
+            self.max_workers,
+            resume=self.resume,
+            uid_store_path=self.uid_store_path,
+            pipeline=self.pipeline,
+            log=self.log.emit,
+            should_stop=self.isInterruptionRequested,
+        )
+
 class ConvertWorker(QThread):
-    progress = Signal(int, int)
-    log      = Signal(str)
-    done     = Signal(bool, str)
+    done = Signal(bool, str)
 
-    def __init__(self, input_dir: str, parent=None):
+    def __init__(self, input_dir: str, max_jobs: int | None = None, log_path: str | None = None, parent=None):
         super().__init__(parent)
+        self.log = LogChannel(log_path)
+        self.progress = ProgressChannel()
         self.input_dir = input_dir
+        self.max_jobs = max_jobs
 
     def run(self):
         try:
-            converter = SmartMedicalConverter(self.input_dir)
-        except RuntimeError as exc:
+            converter = SmartMedicalConverter(
+                self.input_dir, max_jobs=self.max_jobs, should_stop=self.isInterruptionRequested
+            )
+        except (RuntimeError, ValueError) as exc:
             self.done.emit(False, str(exc))
             return
 
@@ -157,25 +233,19 @@ class ConvertWorker(QThread):
             converter.output_path.mkdir(parents=True, exist_ok=True)
 
             total = len(folders)
-            self.log.emit(f"Pacientes encontrados: {total}")
+            self.log.emit(f"Pacientes encontrados: {total}  (dcm2niix en paralelo: {converter.pool.max_jobs})")
             self.log.emit(f"Entrada: {converter.input_path}")
             self.log.emit(f"Salida:  {converter.output_path}\n")
 
-            stats = {"success": 0, "failed": 0}
-
-            for idx, folder in enumerate(folders):
-                if self.isInterruptionRequested():
-                    self.done.emit(
-                        False,
-                        f"Cancelado. {stats['success']} OK, {stats['failed']} errores.",
-                    )
-                    return
+            stats = {"success": 0, "failed": 0, "up_to_date": 0}
 
+            for idx, (folder, (success, modality, reason)) in enumerate(
+                converter.convert_patients(folders, self.isInterruptionRequested)
+            ):
                 self.log.emit(f"[{idx + 1}/{total}] {folder.name}")
-                success, modality, reason = converter.convert_patient(folder)
-
                 if success:
                     stats["success"] += 1
+                    stats["up_to_date"] += reason.startswith("Up to date")
                     self.log.emit(f"  ✓ [{modality}] {reason}")
                 else:
                     stats["failed"] += 1
@@ -183,168 +253,94 @@ class ConvertWorker(QThread):
 
                 self.progress.emit(idx + 1, total)
 
-            
+            if self.isInterruptionRequested():
+                shutil.rmtree(converter.temp_dir, ignore_errors=True)
+                self.done.emit(
+                    False,
+                    f"Cancelado. {stats['success']} OK, {stats['failed']} errores.",
+                )
+                return
+
             if converter.temp_dir.exists():
                 shutil.rmtree(converter.temp_dir, ignore_errors=True)
 
             self.done.emit(
                 True,
-                f"Completado: {stats['success']} OK, {stats['failed']} errores "
-                f"de {total} pacientes.",
+                f"Completado: {stats['success']} OK ({stats['up_to_date']} ya al día), "
+                f"{stats['failed']} errores de {total} pacientes.",
             )
 
         except Exception as exc:
             self.done.emit(False, f"Error inesperado: {exc}")
+        finally:
+            converter.close()
 
 
-class UnifiedWorker(QThread):
-    """Anonimiza y convierte en una sola pasada.
-
-    Flujo interno:
-    1. Anonimiza los DICOMs a una carpeta temporal ``_temp_anon`` dentro de
-       la carpeta de entrada.
-    2. Convierte los DICOMs anonimizados a NIfTI/PNG en ``PROCESSED_DATA/``.
-    3. Borra la carpeta temporal (siempre, incluso si hubo error en fase 2).
-
-    El usuario solo ve una barra de progreso unificada y jamás necesita
-    conocer la existencia de la carpeta temporal.
-    """
-
-    progress = Signal(int, int)
-    log      = Signal(str)
-    phase    = Signal(str)
-    done     = Signal(bool, str)
-
-    def __init__(self, input_dir: str, salt: str, parent=None):
-        super().__init__(parent)
-        self.input_path = Path(input_dir)
-        self.salt = salt
+class _WorkerReporter(IntakeReporter):
+    """Reenvía los eventos de :class:`IntakePipeline` a los canales y
+    señales del worker."""
 
-    def run(self):
-        tmp = self.input_path / "_temp_anon"
-        try:
-            self.phase.emit("Fase 1/2 — Anonimizando DICOMs…")
-            ok, n_patients = self._run_anonymize(tmp)
-            if not ok:
-                return        
+    def __init__(self, worker: "UnifiedWorker"):
+        self.worker = worker
 
-            if self.isInterruptionRequested():
-                self.done.emit(False, "Cancelado durante la anonimización.")
-                return
-            
-            self.phase.emit("Fase 2/2 — Convirtiendo a NIfTI / PNG…")
-            self._run_convert(tmp, n_patients)
+    def log(self, message):
+        self.worker.log.emit(message)
 
-        except Exception as exc:
-            self.done.emit(False, f"Error inesperado: {exc}")
-        finally:
-            if tmp.exists():
-                shutil.rmtree(tmp, ignore_errors=True)
-
-    def _run_anonymize(self, tmp: Path) -> tuple[bool, int]:
-        from pydicom import dcmread
-        from dicom_processor import anonymize_dicom_ps315, is_patient_container_dir
-
-        tmp.mkdir(parents=True, exist_ok=True)
-
-        if is_patient_container_dir(self.input_path):
-            patient_folders = sorted(
-                d for d in self.input_path.iterdir()
-                if d.is_dir()
-                and not d.name.startswith(".")
-                and d.name not in ("ANONYMIZED", "NIFTI_CONVERTED", "PROCESSED_DATA", "_temp_anon")
-                and not d.name.startswith("ANON")
-            )
-            if not patient_folders:
-                self.done.emit(False, "No se encontraron carpetas de pacientes.")
-                return False, 0
-
-            total = len(patient_folders)
-            self.log.emit(f"Pacientes encontrados: {total}\n")
-            ok = 0
-            for idx, folder in enumerate(patient_folders):
-                if self.isInterruptionRequested():
-                    self.done.emit(False, f"Cancelado. Procesados: {ok}/{total}")
-                    return False, 0
-                pid = folder.name
-                out = tmp / f"ANON{pid}"
-                count = self._anonymize_folder(folder, out, pid, dcmread, anonymize_dicom_ps315)
-                if count > 0:
-                    ok += 1
-                    self.log.emit(f"  ✓ [{idx+1}/{total}] {pid} — {count} archivos")
-                else:
-                    self.log.emit(f"  ✗ [{idx+1}/{total}] {pid} — sin archivos DICOM")
-        
-                self.progress.emit(idx + 1, total * 2)
-            return True, total
-        else:
-            pid = self.input_path.name
-            out = tmp / f"ANON{pid}"
-            count = self._anonymize_folder(self.input_path, out, pid, dcmread, anonymize_dicom_ps315)
-            self.progress.emit(1, 2)
-            if count > 0:
-                self.log.emit(f"  ✓ {pid} — {count} archivos anonimizados")
-                return True, 1
-            else:
-                self.done.emit(False, "No se encontraron archivos DICOM.")
-                return False, 0
+    def phase(self, message):
+        self.worker.log.emit(f"\n▶ {message}")
+        self.worker.phase.emit(message)
 
-    def _anonymize_folder(self, src, dst, pid, dcmread, anonymize_fn) -> int:
-        dst.mkdir(parents=True, exist_ok=True)
-        dcm_files = [f for f in src.rglob("*.dcm") if not f.name.startswith(".")]
-        count = 0
-        for dcm_file in dcm_files:
-            if self.isInterruptionRequested():
-                return count
-            try:
-                ds = dcmread(dcm_file)
-                ds_anon = anonymize_fn(ds, self.salt, pid)
-                rel = dcm_file.relative_to(src)
-                save = dst / rel
-                save.parent.mkdir(parents=True, exist_ok=True)
-                ds_anon.save_as(save)
-                count += 1
-            except Exception as exc:
-                self.log.emit(f"    Error en {dcm_file.name}: {exc}")
-        return count
+    def progress(self, done, total):
+        self.worker.progress.emit(done, total)
 
-    def _run_convert(self, tmp: Path, n_patients: int):
-        try:
-            converter = SmartMedicalConverter(str(tmp))
-        except RuntimeError as exc:
-            self.done.emit(False, str(exc))
-            return
-
-        folders = converter.get_patient_folders()
-        if not folders:
-            self.done.emit(False, "No se pudieron leer los pacientes anonimizados.")
-            return
-
-        converter.output_path.mkdir(parents=True, exist_ok=True)
-        total = len(folders)
-        stats = {"success": 0, "failed": 0}
+    def stage_progress(self, stage, done, total):
+        self.worker.stage_progress.emit(stage, done, total)
 
-        for idx, folder in enumerate(folders):
-            if self.isInterruptionRequested():
-                self.done.emit(False, f"Cancelado. {stats['success']} OK, {stats['failed']} errores.")
-                return
+    def done(self, ok, message):
+        self.worker.log.emit(f"\n{'=' * 50}\n{message}")
+        self.worker.done.emit(ok, message)
 
-            success, modality, reason = converter.convert_patient(folder)
-            if success:
-                stats["success"] += 1
-                self.log.emit(f"  ✓ [{modality}] {folder.name} — {reason}")
-            else:
-                stats["failed"] += 1
-                self.log.emit(f"  ✗ [{modality}] {folder.name} — {reason}")
 
-    
-            self.progress.emit(n_patients + idx + 1, n_patients * 2)
+class UnifiedWorker(QThread):
+    """Ejecuta :class:`IntakePipeline` (anonimización y conversión
+    solapadas) en un hilo. ``phase`` y ``done`` son señales Qt; el log y
+    el progreso, que pueden llegar por miles, van por canales que la
+    ventana recoge por lotes."""
 
-        if converter.temp_dir.exists():
-            shutil.rmtree(converter.temp_dir, ignore_errors=True)
+    phase = Signal(str)
+    done  = Signal(bool, str)
 
-        self.done.emit(
-            True,
-            f"Completado: {stats['success']} OK, {stats['failed']} errores de {total} pacientes.\n"
-            f"Archivos guardados en: {converter.output_path}",
+    def __init__(
+        self,
+        input_dir: str,
+        salt: str,
+        max_workers: int | None = None,
+        resume: bool = True,
+        uid_store_path: str | None = None,
+        pipeline: PipelineConfig | None = None,
+        fused: bool | None = None,
+        scratch_dir: str | None = None,
+        stage_workers: tuple[int, int] | None = None,
+        log_path: str | None = None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.log = LogChannel(log_path)
+        self.progress = ProgressChannel()
+        self.stage_progress = ProgressChannel(keyed=True)
+        self.intake = IntakePipeline(
+            input_dir,
+            salt,
+            max_workers=max_workers,
+            resume=resume,
+            uid_store_path=uid_store_path,
+            pipeline=pipeline,
+            fused=fused,
+            scratch_dir=scratch_dir,
+            stage_workers=stage_workers,
+            reporter=_WorkerReporter(self),
+            should_stop=self.isInterruptionRequested,
         )
+
+    def run(self):
+        self.intake.run()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+JOURNAL_FILENAME = ".anon_journal.sqlite"
+_COMMIT_EVERY = 64
+_DIGEST_BUFFER = 1024 * 1024
+
+def content_hasher():
+    """Hash de :func:`file_digest`, para quien ya recorre el contenido."""
+    return hashlib.blake2b(digest_size=20)
+
+def bytes_digest(data: bytes) -> str:
+    """Igual que :func:`file_digest` para un contenido ya leído en memoria."""
+    h = content_hasher()
+    h.update(data)
+    return h.hexdigest()
+
+def file_digest(path: Path) -> str:
+    h = content_hasher()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_DIGEST_BUFFER), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def salt_fingerprint(salt: str) -> str:
+    """Identifica el salt sin guardarlo: el journal vive junto a los datos."""
+    return hashlib.sha256(f"anon-journal:{salt}".encode()).hexdigest()[:16]
+
+class AnonymizationJournal:
+    """Registro SQLite de archivos ya anonimizados en una raíz de salida.
+
+    Cada fila se identifica por la ruta de origen y guarda tamaño, mtime y
+    digest del contenido, junto con la huella del salt y la versión del
+    perfil con que se anonimizó. Un archivo se omite si esos datos
+    coinciden y su salida sigue existiendo; si solo cambió el mtime se
+    compara el digest antes de decidir.
+
+    La tabla ``patients`` guarda además qué pacientes se convirtieron por
+    completo y a partir de qué archivos (:meth:`mark_converted`), para que
+    una ejecución posterior los omita aunque su copia anonimizada
+    intermedia ya no exista.
+    """
+
+    def __init__(self, output_root: Path, salt: str, profile_version: str):
+        self.output_root = Path(output_root)
+        self.output_root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.output_root / JOURNAL_FILENAME
+        self.salt_id = salt_fingerprint(salt)
+        self.profile_version = profile_version
+        self._uncommitted = 0
+
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                src        TEXT PRIMARY KEY,
+                dst        TEXT NOT NULL,
+                size       INTEGER NOT NULL,
+                mtime_ns   INTEGER NOT NULL,
+                digest     TEXT NOT NULL,
+                salt_id    TEXT NOT NULL,
+                profile    TEXT NOT NULL,
+                done_at    TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS patients (
+                patient    TEXT PRIMARY KEY,
+                files      INTEGER NOT NULL,
+                sources    TEXT NOT NULL,
+                salt_id    TEXT NOT NULL,
+                profile    TEXT NOT NULL,
+                done_at    TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, src: Path):
+        return self._conn.execute(
+            "SELECT size, mtime_ns, digest, salt_id, profile FROM files WHERE src = ?",
+            (str(src),),
+        ).fetchone()
+
+    def is_done(self, job) -> bool:
+        return job.dst.exists() and self.is_unchanged(job)
+
+    def is_unchanged(self, job) -> bool:
+        """El origen de ``job`` es el que se anonimizó con este salt y
+        perfil, exista o no todavía su salida."""
+        row = self._lookup(job.src)
+        if row is None:
+            return False
+        size, mtime_ns, digest, salt_id, profile = row
+        if salt_id != self.salt_id or profile != self.profile_version:
+            return False
+
+        st = job.src.stat()
+        if st.st_size != size:
+            return False
+        if st.st_mtime_ns == mtime_ns:
+            return True
+
+        if file_digest(job.src) != digest:
+            return False
+        self._conn.execute(
+            "UPDATE files SET mtime_ns = ? WHERE src = ?", (st.st_mtime_ns, str(job.src))
+        )
+        self._maybe_commit()
+        return True
+
+    def partition(self, jobs: list) -> tuple:
+        """Separa ``jobs`` en ``(pendientes, omitidos)``."""
+        pending, skipped = [], []
+        for job in jobs:
+            (skipped if self.is_done(job) else pending).append(job)
+        return pending, skipped
+
+    def record(self, job, digest: str) -> None:
+        st = job.src.stat()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(job.src),
+                str(job.dst),
+                st.st_size,
+                st.st_mtime_ns,
+                digest,
+                self.salt_id,
+                self.profile_version,
+                datetime.now(timezone.utc).isoformat(),
+            ),
+        )
+        self._maybe_commit()
+
+    @staticmethod
+    def _sources_id(jobs: list, settings: dict) -> str:
+        payload = json.dumps({"sources": sorted(str(job.src) for job in jobs), "settings": settings}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def mark_converted(self, patient_id: str, jobs: list, settings: dict) -> None:
+        """Registra que ``patient_id`` se convirtió entero a partir de
+        ``jobs`` con ``settings`` (los de ``SmartMedicalConverter.conversion_settings``)."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                patient_id,
+                len(jobs),
+                self._sources_id(jobs, settings),
+                self.salt_id,
+                self.profile_version,
+                datetime.now(timezone.utc).isoformat(),
+            ),
+        )
+        self._conn.commit()
+
+    def is_converted(self, patient_id: str, jobs: list, settings: dict) -> bool:
+        """``patient_id`` se convirtió con los mismos archivos y ajustes, y
+        los archivos no cambiaron desde que se anonimizaron (ver
+        :meth:`is_unchanged`)."""
+        row = self._conn.execute(
+            "SELECT files, sources, salt_id, profile FROM patients WHERE patient = ?", (patient_id,)
+        ).fetchone()
+        if row != (len(jobs), self._sources_id(jobs, settings), self.salt_id, self.profile_version):
+            return False
+        return all(self.is_unchanged(job) for job in jobs)
+
+    def _maybe_commit(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+
+_DONE = object()
+_POLL_SECONDS = 0.2
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Concurrencia por etapa y límites de memoria del pipeline de E/S."""
+
+    readers: int = 2
+    transformers: int = 1
+    writers: int = 2
+    queue_size: int = 16
+    max_buffer_mb: int = 512
+
+    @classmethod
+    def from_env(cls) -> Optional["PipelineConfig"]:
+        """Lee ``DICOM_PIPELINE="lectores,transformadores,escritores[,MB]"``.
+        Devuelve ``None`` si no está definida o no es válida (modo archivo
+        a archivo)."""
+        value = os.getenv("DICOM_PIPELINE", "").strip()
+        if not value:
+            return None
+        try:
+            parts = [int(p) for p in value.split(",") if p.strip()]
+        except ValueError:
+            return None
+        names = ("readers", "transformers", "writers", "max_buffer_mb")
+        return cls(**dict(zip(names, parts)))
+
+class _ByteBudget:
+    """Semáforo por bytes: limita cuántos datos leídos y aún no escritos
+    hay en memoria. Un archivo mayor que el límite pasa si va solo."""
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n: int, stop: threading.Event) -> bool:
+        with self._cond:
+            while self._used > 0 and self._used + n > self._limit:
+                if stop.is_set():
+                    return False
+                self._cond.wait(_POLL_SECONDS)
+            self._used += n
+            return True
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self._used -= n
+            self._cond.notify_all()
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while True:
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+def resolve_stage_workers(stage_workers: Optional[tuple] = None) -> tuple:
+    """Hilos por etapa ``(anonimización, conversión)`` del flujo unificado:
+    argumento, luego ``DICOM_STAGE_WORKERS="a,c"`` y por defecto ``(1, 1)``."""
+    if stage_workers is None:
+        value = os.getenv("DICOM_STAGE_WORKERS", "").strip()
+        try:
+            stage_workers = tuple(int(p) for p in value.split(",") if p.strip()) if value else ()
+        except ValueError:
+            stage_workers = ()
+    anon, convert = (tuple(stage_workers) + (1, 1))[:2]
+    return max(1, anon), max(1, convert)
+
+def run_stages(
+    items: Iterable,
+    stages: list,
+    queue_size: int = 16,
+    should_stop: Optional[Callable[[], bool]] = None,
+    item_size: Optional[Callable] = None,
+    max_buffer_bytes: Optional[int] = None,
+) -> Iterator[tuple]:
+    """Encadena ``stages`` (lista de ``(fn, hilos)``) con colas acotadas.
+
+    La primera etapa recibe ``fn(item)`` y las siguientes
+    ``fn(item, resultado_anterior)``. Produce ``(etapa, item, error,
+    resultado)`` cada vez que un elemento termina una etapa; el resultado
+    solo se entrega en la última, y un error retira el elemento del resto.
+    Con ``max_buffer_bytes`` cada elemento, medido con
+    ``item_size(item, resultado_primera_etapa)``, ocupa presupuesto desde
+    que sale de la primera etapa hasta que sale de la última; la primera
+    etapa espera a que haya sitio antes de pasarlo a la siguiente. Al
+    activarse ``should_stop`` no entran más elementos y se descartan los
+    pendientes.
+    """
+    should_stop = should_stop or (lambda: False)
+    stop = threading.Event()
+    budget = _ByteBudget(max_buffer_bytes) if max_buffer_bytes else None
+    source = iter(items)
+    source_lock = threading.Lock()
+    last = len(stages) - 1
+    inboxes = [None] + [queue.Queue(queue_size) for _ in stages[1:]]
+    events: queue.Queue = queue.Queue()
+
+    def release(size):
+        if budget is not None:
+            budget.release(size)
+
+    def forward(index, item, size, out):
+        if index == last:
+            release(size)
+            events.put((index, item, None, out))
+            return
+        events.put((index, item, None, None))
+        if not _put(inboxes[index + 1], (item, size, out), stop):
+            release(size)
+
+    def fail(index, item, size, error):
+        release(size)
+        events.put((index, item, str(error), None))
+
+    def first_stage():
+        fn = stages[0][0]
+        while not stop.is_set():
+            with source_lock:
+                item = next(source, _DONE)
+            if item is _DONE:
+                return
+            try:
+                out = fn(item)
+                size = item_size(item, out) if budget is not None and item_size else 0
+            except Exception as e:
+                fail(0, item, 0, e)
+                continue
+            if budget is not None and not budget.acquire(size, stop):
+                return
+            forward(0, item, size, out)
+
+    def later_stage(index):
+        fn = stages[index][0]
+        while True:
+            entry = inboxes[index].get()
+            if entry is _DONE:
+                return
+            item, size, payload = entry
+            if stop.is_set():
+                release(size)
+                continue
+            try:
+                out = fn(item, payload)
+            except Exception as e:
+                fail(index, item, size, e)
+                continue
+            del payload
+            forward(index, item, size, out)
+
+    def start(index):
+        target = first_stage if index == 0 else (lambda: later_stage(index))
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(max(1, stages[index][1]))]
+        for t in threads:
+            t.start()
+        return threads
+
+    def close_after(threads, q, n):
+        for t in threads:
+            t.join()
+        for _ in range(n):
+            q.put(_DONE)
+
+    workers = [start(index) for index in range(len(stages))]
+    closers = [
+        threading.Thread(target=close_after, args=(workers[i], inboxes[i + 1], len(workers[i + 1])), daemon=True)
+        for i in range(last)
+    ]
+    closers.append(threading.Thread(target=close_after, args=(workers[last], events, 1), daemon=True))
+    for t in closers:
+        t.start()
+
+    try:
+        while True:
+            if should_stop():
+                stop.set()
+            try:
+                entry = events.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                return
+            yield entry
+    finally:
+        stop.set()
+        for t in closers:
+            t.join()
+
+def run_pipeline(
+    items: Iterable,
+    read: Callable,
+    transform: Callable,
+    write: Callable,
+    config: PipelineConfig,
+    should_stop: Optional[Callable[[], bool]] = None,
+    item_size: Optional[Callable] = None,
+) -> Iterator[tuple]:
+    """Procesa ``items`` con tres etapas de hilos unidas por colas acotadas.
+
+    ``read(item) -> payload``, ``transform(item, payload) -> out`` y
+    ``write(item, out) -> result``. Produce ``(item, error, result)`` en
+    orden de finalización; un fallo en cualquier etapa se reporta como
+    ``error`` sin detener el resto. Las colas de ``queue_size`` y el
+    presupuesto de ``max_buffer_mb`` (medido con ``item_size(item,
+    payload)``) frenan a los lectores cuando escritura o transformación
+    van por detrás.
+    Al activarse ``should_stop`` no se leen más elementos y se descartan
+    los que aún no se escribieron.
+    """
+    stages = [(read, config.readers), (transform, config.transformers), (write, config.writers)]
+    for stage, item, error, result in run_stages(
+        items,
+        stages,
+        queue_size=config.queue_size,
+        should_stop=should_stop,
+        item_size=item_size,
+        max_buffer_bytes=config.max_buffer_mb * 1024 * 1024,
+    ):
+        if error is not None or stage == len(stages) - 1:
+            yield item, error, result
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+MANIFEST_FILENAME = ".conversion.json"
+MANIFEST_VERSION = 1
+# Companions written next to an output: stats sidecar, viewer gzip seek index.
+_DERIVED_SUFFIXES = (".stats.json", ".gzidx")
+
+def input_fingerprint(files: list, instance_uids: list, settings: dict) -> str:
+    """Hash of a series' inputs and of the settings that shape its outputs.
+
+    Instances are identified by SOPInstanceUID and file size rather than
+    path or mtime, so re-anonymizing the same data into a fresh temporary
+    folder still matches, while added, removed or rewritten instances do not.
+    """
+    instances = sorted(
+        (uid or Path(f).name, Path(f).stat().st_size) for f, uid in zip(files, instance_uids or [""] * len(files))
+    )
+    payload = json.dumps({"settings": settings, "instances": instances}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def outputs_by_series(folder: Path, names: set) -> dict:
+    """Maps SeriesInstanceUID -> output names among ``names``, using the
+    BIDS sidecar every converted volume gets (dcm2niix and the assembler
+    both record SeriesInstanceUID). Files sharing the sidecar's stem
+    (``.nii.gz``, ``.zarr``, ``.bval``, ...) belong to the same series."""
+    result = {}
+    for name in names:
+        if not name.endswith(".json") or name.endswith(_DERIVED_SUFFIXES):
+            continue
+        try:
+            uid = json.loads((folder / name).read_text()).get("SeriesInstanceUID")
+        except (OSError, ValueError):
+            continue
+        stem = name[: -len(".json")]
+        result.setdefault(uid, []).extend(n for n in names if n.startswith(stem + "."))
+    return result
+
+class ConversionManifest:
+    """Per-patient record of what was converted from which inputs.
+
+    Stored as ``PROCESSED_DATA/<patient>/.conversion.json``: for each key (a
+    SeriesInstanceUID, or ``2D`` for mammography) the input fingerprint,
+    the output names and when they were written. A key is current when the
+    fingerprint matches and every recorded output still exists.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_FILENAME
+        self.entries = {}
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("series", {})
+        except (OSError, ValueError):
+            pass
+
+    def is_current(self, key: str, fingerprint: str) -> bool:
+        entry = self.entries.get(key)
+        return bool(
+            entry
+            and entry.get("fingerprint") == fingerprint
+            and entry.get("outputs")
+            and all((self.folder / name).exists() for name in entry["outputs"])
+        )
+
+    def outputs_exist(self) -> bool:
+        """True when something was recorded and every recorded output is still there."""
+        return bool(self.entries) and all(
+            (self.folder / name).exists() for entry in self.entries.values() for name in entry.get("outputs", [])
+        )
+
+    def discard(self, key: str) -> None:
+        """Deletes the outputs recorded for ``key`` (and their stats/Zarr
+        companions) before it is converted again."""
+        entry = self.entries.pop(key, None)
+        for name in (entry or {}).get("outputs", []):
+            target = self.folder / name
+            companions = [target.with_name(name + suffix) for suffix in _DERIVED_SUFFIXES]
+            if name.endswith((".nii.gz", ".nii")):
+                companions.append(target.with_name(name.removesuffix(".gz").removesuffix(".nii") + ".zarr"))
+            for path in [target] + companions:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+
+    def record(self, key: str, fingerprint: str, outputs: list) -> None:
+        self.entries[key] = {
+            "fingerprint": fingerprint,
+            "outputs": sorted(Path(o).name for o in outputs),
+            "converted_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def save(self) -> None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(json.dumps({"version": MANIFEST_VERSION, "series": self.entries}, indent=1))
+        os.replace(partial, self.path)
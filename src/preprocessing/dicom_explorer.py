@@ -3,33 +3,60 @@ from pathlib import Path
 from dotenv import load_dotenv
 import os
 
+from file_discovery import DICOM_SUFFIX, has_suffix, list_dir
+from header_index import HeaderIndex
+
 load_dotenv()
 
 class DicomExplorer:
-    def __init__(self, base_dir=None):
+    """Consultas sobre un archivo DICOM. Las cabeceras se leen una vez y se
+    guardan en :class:`HeaderIndex`; :meth:`refresh` lo pone al día entero
+    (solo archivos nuevos o modificados).
+    """
+
+    def __init__(self, base_dir=None, index_path=None, max_workers=None):
         if base_dir is None:
             base_dir = os.getenv("DICOM_INPUT_DIR")
         self.base_dir = Path(base_dir)
-    
+        self.index = HeaderIndex(self.base_dir, index_path)
+        self.max_workers = max_workers
+        self._fresh = False
+
+    def refresh(self):
+        stats = self.index.refresh(self.max_workers)
+        self._fresh = True
+        return stats
+
+    def _series_folders(self):
+        """``(carpeta, .dcm de esa carpeta)`` por subcarpeta de ``base_dir``,
+        sin abrir ningún archivo."""
+        return [
+            (folder, [f for f in list_dir(folder)[1] if has_suffix(f.name, DICOM_SUFFIX)])
+            for folder in list_dir(self.base_dir)[0]
+        ]
+
+    def _header(self, filepath):
+        """Fila del índice para ``filepath``; lo indexa si aún no lo está."""
+        record = self.index.get(filepath)
+        if record is None:
+            self.index.refresh(files=[filepath])
+            record = self.index.get(filepath)
+        if record is None:
+            raise FileNotFoundError(filepath)
+        if record["error"]:
+            raise ValueError(record["error"])
+        return record
+
     def explore_structure(self):
         print(f"\n{'='*70}")
         print(f"Directorio base: {self.base_dir}")
         print(f"{'='*70}\n")
         
-        series_info = []
-        total_files = 0
-        
-        for serie_folder in sorted(self.base_dir.iterdir()):
-            if serie_folder.is_dir():
-                dcm_files = list(serie_folder.glob('*.dcm'))
-                num_files = len(dcm_files)
-                total_files += num_files
-                
-                series_info.append({
-                    'folder': serie_folder.name,
-                    'num_files': num_files,
-                    'first_file': dcm_files[0] if dcm_files else None
-                })
+        series_info = [
+            {'folder': folder.name, 'num_files': len(dcm_files), 'first_file': dcm_files[0] if dcm_files else None}
+            for folder, dcm_files in self._series_folders()
+        ]
+        total_files = sum(info['num_files'] for info in series_info)
         
         print(f"Total de series encontradas: {len(series_info)}")
         print(f"Total de archivos DICOM: {total_files}\n")
@@ -44,7 +71,7 @@ class DicomExplorer:
     
     def explore_dicom_file(self, filepath):
         try:
-            ds = pydicom.dcmread(filepath)
+            record = self._header(filepath)
             
             print(f"\n{'='*70}")
             print(f"INFORMACIÓN DETALLADA DEL ARCHIVO")
@@ -63,12 +90,11 @@ class DicomExplorer:
             ]
             
             for tag in basic_tags:
-                if hasattr(ds, tag):
-                    value = getattr(ds, tag)
-                    print(f"  {tag:<25}: {value}")
+                if record.get(tag) is not None:
+                    print(f"  {tag:<25}: {record[tag]}")
             
             print(f"\n{'='*70}\n")
-            return ds
+            return pydicom.dcmread(filepath, defer_size="1 KB")
             
         except Exception as e:
             print(f"Error al leer {filepath}: {e}")
@@ -76,15 +102,15 @@ class DicomExplorer:
     
     def explore_all_tags(self, filepath):
         try:
-            ds = pydicom.dcmread(filepath)
+            record = self._header(filepath)
             
             print(f"\n{'='*70}")
             print(f"TODOS LOS TAGS DICOM")
             print(f"Archivo: {Path(filepath).name}")
             print(f"{'='*70}\n")
             
-            for elem in ds:
-                print(f"{str(elem.tag):<15} | {elem.keyword:<35} | {str(elem.value)[:60]}")
+            for tag, keyword, value in record["tags"]:
+                print(f"{tag:<15} | {keyword:<35} | {str(value)[:60]}")
             
             print(f"\n{'='*70}\n")
             
@@ -96,24 +122,22 @@ class DicomExplorer:
         print(f"COMPARANDO DIFERENTES SERIES")
         print(f"{'='*70}\n")
         
-        series_folders = sorted([f for f in self.base_dir.iterdir() if f.is_dir()])[:num_samples]
-        
-        for serie_folder in series_folders:
-            dcm_files = list(serie_folder.glob('*.dcm'))
-            if dcm_files:
-                ds = pydicom.dcmread(dcm_files[0])
-                print(f"\n{serie_folder.name}:")
-                print(f"  Modalidad: {ds.Modality if hasattr(ds, 'Modality') else 'N/A'}")
-                print(f"  Descripción: {ds.SeriesDescription if hasattr(ds, 'SeriesDescription') else 'N/A'}")
-                print(f"  Número de serie: {ds.SeriesNumber if hasattr(ds, 'SeriesNumber') else 'N/A'}")
-                print(f"  Dimensiones: {ds.Rows if hasattr(ds, 'Rows') else '?'} x {ds.Columns if hasattr(ds, 'Columns') else '?'}")
-                print(f"  Archivos en serie: {len(dcm_files)}")
+        for folder, dcm_files in self._series_folders()[:num_samples]:
+            if not dcm_files:
+                continue
+            record = self._header(dcm_files[0])
+            print(f"\n{folder.name}:")
+            print(f"  Modalidad: {record['Modality'] or 'N/A'}")
+            print(f"  Descripción: {record['SeriesDescription'] or 'N/A'}")
+            print(f"  Número de serie: {record['SeriesNumber'] if record['SeriesNumber'] is not None else 'N/A'}")
+            print(f"  Dimensiones: {record['Rows'] or '?'} x {record['Columns'] or '?'}")
+            print(f"  Archivos en serie: {len(dcm_files)}")
         
         print(f"\n{'='*70}\n")
     
     def find_sensitive_data(self, filepath):
         try:
-            ds = pydicom.dcmread(filepath)
+            record = self._header(filepath)
             
             print(f"\n{'='*70}")
             print(f"DATOS SENSIBLES ENCONTRADOS")
@@ -128,11 +152,11 @@ class DicomExplorer:
             ]
             
             found_sensitive = []
+            present = {keyword for _, keyword, _ in record["tags"]}
             
             for tag in sensitive_tags:
-                if hasattr(ds, tag):
-                    value = getattr(ds, tag)
-                    print(f"  ⚠️  {tag:<30}: {value}")
+                if tag in present:
+                    print(f"  ⚠️  {tag:<30}: {record[tag] if record[tag] is not None else ''}")
                     found_sensitive.append(tag)
             
             print(f"\n  Total de campos sensibles encontrados: {len(found_sensitive)}")
@@ -165,4 +189,4 @@ if __name__ == "__main__":
     
     explorer.compare_series(num_samples=5)
     
-    print("\nCompletado==================================\n")
\ No newline at end of file
+    print("\nCompletado==================================\n")
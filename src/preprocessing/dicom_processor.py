@@ -1,96 +1,626 @@
 import hashlib
+import multiprocessing
+import shutil
+import threading
+from io import BytesIO
 import pydicom
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.uid import DeflatedExplicitVRLittleEndian
 from pathlib import Path
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import util as mp_util
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
 import os
 from dotenv import load_dotenv
 
+from anon_journal import AnonymizationJournal, bytes_digest, content_hasher
+from anon_pipeline import PipelineConfig, run_pipeline
+from dicom_triage import pixel_data_end
+from file_discovery import DICOM_SUFFIX, has_suffix, iter_files, list_dir
+from uid_store import UID_STORE_FILENAME, UIDMapStore
+
 load_dotenv()
 
+PROFILE_VERSION = "PS3.15-basic/2"
+
+UID_ROOT = "1.2.840.113619.2."
+
+@lru_cache(maxsize=65536)
 def get_consistent_numeric_id(original_id: str, salt: str) -> str:
     hash_obj = hashlib.sha256(f"{original_id}{salt}".encode())
     return str(int(hash_obj.hexdigest(), 16))[:30]
 
-def anonymize_dicom_ps315(ds: pydicom.dataset.Dataset, salt: str, pacient_id: str) -> pydicom.dataset.Dataset:
-    raw_patient_id = str(ds.get('PatientID', 'UNKNOWN'))
-    
-    ds.PatientID = f"ANON{pacient_id}"
-    ds.PatientName = "ANONYMIZED"
-    ds.PatientBirthDate = ""
-    ds.PatientSex = ds.get('PatientSex', 'O')
-    
-    hash_val = int(hashlib.md5(raw_patient_id.encode()).hexdigest(), 16)
-    offset_days = hash_val % 1000
-    
-    date_tags = ['StudyDate', 'SeriesDate', 'ContentDate', 'AcquisitionDate']
-    for tag in date_tags:
-        if tag in ds and ds.data_element(tag).value:
+def anonymize_uid(original_uid: str, salt: str) -> str:
+    return f"{UID_ROOT}{get_consistent_numeric_id(str(original_uid), salt)}"
+
+def open_uid_store(db_path: Path, salt: str) -> UIDMapStore:
+    return UIDMapStore(db_path, salt, derive=lambda uid: anonymize_uid(uid, salt))
+
+_WORKER_UID_STORES: dict = {}
+_WORKER_UID_STORES_LOCK = threading.Lock()
+_uid_stores_finalizer = None
+
+def shared_uid_store(db_path: Optional[Path], salt: str) -> Optional[UIDMapStore]:
+    """Un ``UIDMapStore`` por proceso y archivo, reutilizado entre bloques.
+    Se vacían y cierran con :func:`close_uid_stores`, que además se ejecuta
+    al salir el proceso (también en los workers de ``ProcessPoolExecutor``,
+    que no pasan por ``atexit``)."""
+    global _uid_stores_finalizer
+    if db_path is None:
+        return None
+    key = (str(db_path), salt)
+    with _WORKER_UID_STORES_LOCK:
+        store = _WORKER_UID_STORES.get(key)
+        if store is None:
+            store = _WORKER_UID_STORES[key] = open_uid_store(db_path, salt)
+            if _uid_stores_finalizer is None or not _uid_stores_finalizer.still_active():
+                _uid_stores_finalizer = mp_util.Finalize(None, close_uid_stores, exitpriority=10)
+    return store
+
+def close_uid_stores() -> None:
+    with _WORKER_UID_STORES_LOCK:
+        stores = list(_WORKER_UID_STORES.values())
+        _WORKER_UID_STORES.clear()
+    for store in stores:
+        store.close()
+
+def _forget_parent_uid_stores() -> None:
+    """Un proceso hijo no reutiliza las conexiones SQLite del padre."""
+    global _WORKER_UID_STORES_LOCK, _uid_stores_finalizer
+    _WORKER_UID_STORES.clear()
+    _WORKER_UID_STORES_LOCK = threading.Lock()
+    _uid_stores_finalizer = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_parent_uid_stores)
+
+def resolve_uid_store_path(uid_store_path: Optional[str] = None) -> Optional[Path]:
+    """Ruta del índice de UIDs: argumento > DICOM_UID_STORE > ninguno.
+    Si apunta a un directorio se usa ``.uid_map.sqlite`` dentro de él."""
+    uid_store_path = uid_store_path or os.getenv("DICOM_UID_STORE")
+    if not uid_store_path:
+        return None
+    path = Path(uid_store_path)
+    return path / UID_STORE_FILENAME if path.is_dir() else path
+
+_DATE_TAGS = ('StudyDate', 'SeriesDate', 'ContentDate', 'AcquisitionDate')
+
+# Valores fijos que escribe el perfil (además de PatientID y los UIDs).
+PS315_FIXED_VALUES = {
+    'PatientName': "ANONYMIZED",
+    'PatientBirthDate': "",
+    'InstitutionName': "",
+    'InstitutionAddress': "",
+    'ReferringPhysicianName': "",
+    'PerformingPhysicianName': "",
+    'OperatorsName': "",
+    'AccessionNumber': "",
+    'StudyID': "ANON_STUDY",
+    'PatientIdentityRemoved': "YES",
+    'DeidentificationMethod': "DICOM PS3.15 Basic Profile",
+}
+# UIDs que el perfil sustituye por ``anonymize_uid`` (prefijo UID_ROOT).
+PS315_MAPPED_UIDS = ('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID')
+# Atributos que el perfil elimina (acción X): repiten identificadores del paciente.
+PS315_REMOVED_KEYWORDS = ('OtherPatientIDs', 'OtherPatientNames', 'OtherPatientIDsSequence')
+_PLAN_CACHE_SIZE = 256
+_PLAN_CACHE: OrderedDict = OrderedDict()
+_PLAN_CACHE_LOCK = threading.Lock()
+
+def _remove_private_tags(ds: pydicom.dataset.Dataset) -> None:
+    """Equivalente a ``Dataset.remove_private_tags`` que no convierte los
+    elementos en bruto: solo decodifica los que pueden ser secuencias."""
+    for tag in list(ds.keys()):
+        if tag.is_private:
+            del ds[tag]
+            continue
+        vr = ds.get_item(tag).VR
+        if vr is None:
             try:
-                dt = datetime.strptime(ds.data_element(tag).value, '%Y%m%d')
-                ds.data_element(tag).value = (dt - timedelta(days=offset_days)).strftime('%Y%m%d')
+                vr = dictionary_VR(tag)
+            except KeyError:
+                vr = None
+        if vr in (None, 'SQ', 'UN'):
+            elem = ds[tag]
+            if elem.VR == 'SQ':
+                for item in elem.value:
+                    _remove_private_tags(item)
+
+class AnonymizationPlan:
+    """Sustituciones de nivel paciente/estudio/serie, calculadas una vez con
+    la primera instancia de una serie y aplicadas a las siguientes como un
+    parche tag → valor precompilado. Las fechas desplazadas se memorizan por
+    valor original; solo el SOPInstanceUID se calcula por archivo."""
+
+    def __init__(self, ds: pydicom.dataset.Dataset, pacient_id: str, map_uid: Callable):
+        raw_patient_id = str(ds.get('PatientID', 'UNKNOWN'))
+        hash_val = int(hashlib.md5(raw_patient_id.encode()).hexdigest(), 16)
+        self.offset_days = hash_val % 1000
+        self._shifted_dates: dict = {}
+
+        values = {
+            'PatientID': f"ANON{pacient_id}",
+            'PatientName': PS315_FIXED_VALUES['PatientName'],
+            'PatientBirthDate': PS315_FIXED_VALUES['PatientBirthDate'],
+        }
+        if 'StudyInstanceUID' in ds:
+            values['StudyInstanceUID'] = map_uid(ds.StudyInstanceUID, "study")
+        if 'SeriesInstanceUID' in ds:
+            values['SeriesInstanceUID'] = map_uid(ds.SeriesInstanceUID, "series")
+        values.update({k: v for k, v in PS315_FIXED_VALUES.items() if k not in values})
+        self.patch = [
+            (tag_for_keyword(keyword), dictionary_VR(tag_for_keyword(keyword)), value)
+            for keyword, value in values.items()
+        ]
+
+    def shift_date(self, value: str) -> Optional[str]:
+        if value not in self._shifted_dates:
+            try:
+                dt = datetime.strptime(value, '%Y%m%d')
+                self._shifted_dates[value] = (dt - timedelta(days=self.offset_days)).strftime('%Y%m%d')
             except:
-                continue
-
-    if 'StudyInstanceUID' in ds:
-        ds.StudyInstanceUID = f"1.2.840.113619.2.{get_consistent_numeric_id(ds.StudyInstanceUID, salt)}"
-    if 'SeriesInstanceUID' in ds:
-        ds.SeriesInstanceUID = f"1.2.840.113619.2.{get_consistent_numeric_id(ds.SeriesInstanceUID, salt)}"
-    if 'SOPInstanceUID' in ds:
-        ds.SOPInstanceUID = f"1.2.840.113619.2.{get_consistent_numeric_id(ds.SOPInstanceUID, salt)}"
-
-    ds.InstitutionName = ""
-    ds.InstitutionAddress = ""
-    ds.ReferringPhysicianName = ""
-    ds.PerformingPhysicianName = ""
-    ds.OperatorsName = ""
-    ds.AccessionNumber = ""
-    ds.StudyID = "ANON_STUDY"
-
-    ds.PatientIdentityRemoved = "YES"
-    ds.DeidentificationMethod = "DICOM PS3.15 Basic Profile"
-    
-    ds.remove_private_tags()
+                self._shifted_dates[value] = None
+        return self._shifted_dates[value]
+
+    def apply(self, ds: pydicom.dataset.Dataset, map_uid: Callable) -> pydicom.dataset.Dataset:
+        for tag, vr, value in self.patch:
+            existing = ds.get_item(tag)
+            if existing is not None and existing.VR:
+                vr = existing.VR
+            ds.add_new(tag, vr, value)
+        ds.PatientSex = ds.get('PatientSex', 'O')
+
+        for keyword in _DATE_TAGS:
+            if keyword in ds and ds.data_element(keyword).value:
+                shifted = self.shift_date(ds.data_element(keyword).value)
+                if shifted is not None:
+                    ds.data_element(keyword).value = shifted
+
+        if 'SOPInstanceUID' in ds:
+            ds.SOPInstanceUID = map_uid(ds.SOPInstanceUID, "instance")
+            if 'MediaStorageSOPInstanceUID' in getattr(ds, 'file_meta', ()):
+                ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+
+        for keyword in PS315_REMOVED_KEYWORDS:
+            if keyword in ds:
+                delattr(ds, keyword)
+
+        _remove_private_tags(ds)
+        return ds
+
+def _plan_for(ds: pydicom.dataset.Dataset, salt: str, pacient_id: str, map_uid: Callable, store_key) -> AnonymizationPlan:
+    key = (
+        salt,
+        pacient_id,
+        store_key,
+        str(ds.get('PatientID', 'UNKNOWN')),
+        str(ds.get('StudyInstanceUID')),
+        str(ds.get('SeriesInstanceUID')),
+    )
+    with _PLAN_CACHE_LOCK:
+        plan = _PLAN_CACHE.get(key)
+        if plan is not None:
+            _PLAN_CACHE.move_to_end(key)
+            return plan
+        plan = _PLAN_CACHE[key] = AnonymizationPlan(ds, pacient_id, map_uid)
+        if len(_PLAN_CACHE) > _PLAN_CACHE_SIZE:
+            _PLAN_CACHE.popitem(last=False)
+        return plan
+
+def anonymize_dicom_ps315(
+    ds: pydicom.dataset.Dataset,
+    salt: str,
+    pacient_id: str,
+    uid_store: Optional[UIDMapStore] = None,
+) -> pydicom.dataset.Dataset:
+    if uid_store is not None and uid_store.salt != salt:
+        raise ValueError("El índice de UIDs pertenece a otro salt")
+    if uid_store is not None:
+        map_uid = uid_store.map_uid
+        store_key = str(uid_store.db_path)
+    else:
+        map_uid = lambda uid, level: anonymize_uid(uid, salt)
+        store_key = None
+
+    plan = _plan_for(ds, salt, pacient_id, map_uid, store_key)
+    return plan.apply(ds, map_uid)
+
+@dataclass(frozen=True)
+class AnonymizeJob:
+    src: Path
+    dst: Path
+    patient_id: str
+
+def resolve_workers(max_workers: Optional[int] = None) -> int:
+    """Número de procesos: argumento > DICOM_WORKERS > 1. ``0`` = todos los núcleos."""
+    if max_workers is None:
+        try:
+            max_workers = int(os.getenv("DICOM_WORKERS", "1"))
+        except ValueError:
+            max_workers = 1
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    return max_workers
+
+def collect_jobs(src: Path, dst: Path, pacient_id: str, files: Optional[list] = None) -> list:
+    """Un trabajo por archivo. ``files`` (p. ej. los válidos del triaje)
+    sustituye al recorrido de los ``.dcm``; los que no tienen extensión salen
+    con ``.dcm`` para que la conversión los encuentre."""
+    if files is None:
+        files = sorted(iter_files(src, DICOM_SUFFIX))
+    jobs = []
+    for f in files:
+        dst_file = dst / f.relative_to(src)
+        if dst_file.suffix.lower() != ".dcm":
+            dst_file = dst_file.with_name(dst_file.name + ".dcm")
+        jobs.append(AnonymizeJob(f, dst_file, pacient_id))
+    return jobs
+
+_COPY_BUFFER = 1024 * 1024
+
+def _read_header(fp, file_size: int):
+    """Lee solo la cabecera de ``fp``. Devuelve ``(ds, offset)`` con el
+    offset donde empiezan los píxeles, o ``None`` cuando el archivo no
+    admite el paso directo: sintaxis *deflated* o elementos después de los
+    píxeles, que podrían contener tags privados que no se quieren copiar a
+    ciegas."""
+    ds = pydicom.dcmread(fp, stop_before_pixels=True)
+    transfer_syntax = ds.file_meta.get("TransferSyntaxUID") if hasattr(ds, "file_meta") else None
+    if transfer_syntax is None or transfer_syntax == DeflatedExplicitVRLittleEndian:
+        return None
+
+    pixel_start = fp.tell()
+    pixel_end = pixel_start
+    if pixel_start < file_size:
+        implicit_vr, little_endian = ds.original_encoding
+        pixel_end = pixel_data_end(fp, little_endian, implicit_vr)
+    if pixel_end != file_size:
+        return None
+    return ds, pixel_start
 
-    return ds
+def _copy_pixels(src_fp, dst_fp, pixel_start: int, hasher=None) -> None:
+    """Copia desde ``pixel_start`` hasta el final en bloques de
+    ``_COPY_BUFFER``. Con ``hasher`` este recibe el archivo de origen
+    completo en orden: la cabecera (ya en la caché del sistema) y después
+    cada bloque copiado, sin segunda lectura."""
+    if hasher is None:
+        src_fp.seek(pixel_start)
+        shutil.copyfileobj(src_fp, dst_fp, _COPY_BUFFER)
+        return
+    src_fp.seek(0)
+    hasher.update(src_fp.read(pixel_start))
+    for block in iter(lambda: src_fp.read(_COPY_BUFFER), b""):
+        hasher.update(block)
+        dst_fp.write(block)
+
+def anonymize_file_passthrough(
+    job: AnonymizeJob,
+    salt: str,
+    uid_store: Optional[UIDMapStore] = None,
+    hasher=None,
+) -> bool:
+    """Anonimiza leyendo solo la cabecera y copia el elemento de píxeles
+    byte a byte desde el origen, sin decodificarlo ni cargarlo en memoria.
+    Devuelve ``False`` (sin escribir nada) si el archivo no admite este
+    camino (ver :func:`_read_header`). ``hasher`` (ver
+    :func:`anon_journal.content_hasher`) acumula el origen mientras se copia."""
+    with open(job.src, "rb") as src_fp:
+        split = _read_header(src_fp, os.fstat(src_fp.fileno()).st_size)
+        if split is None:
+            return False
+
+        ds, pixel_start = split
+        ds_anon = anonymize_dicom_ps315(ds, salt, job.patient_id, uid_store)
+        job.dst.parent.mkdir(parents=True, exist_ok=True)
+        with open(job.dst, "wb") as dst_fp:
+            ds_anon.save_as(dst_fp)
+            _copy_pixels(src_fp, dst_fp, pixel_start, hasher)
+    return True
+
+def anonymize_file(
+    job: AnonymizeJob,
+    salt: str,
+    passthrough: bool = True,
+    uid_store: Optional[UIDMapStore] = None,
+    with_digest: bool = False,
+) -> Optional[str]:
+    """Anonimiza ``job``. Con ``with_digest`` devuelve el digest del origen
+    (el de :func:`anon_journal.file_digest`) calculado sobre los mismos
+    bytes que se leen para anonimizar."""
+    hasher = content_hasher() if with_digest else None
+    if passthrough and anonymize_file_passthrough(job, salt, uid_store, hasher):
+        return hasher.hexdigest() if hasher is not None else None
+    return _anonymize_whole(job, salt, uid_store, with_digest)
+
+def _anonymize_whole(job: AnonymizeJob, salt: str, uid_store: Optional[UIDMapStore], with_digest: bool) -> Optional[str]:
+    """Camino sin paso directo: decodifica el archivo entero."""
+    if with_digest:
+        raw = job.src.read_bytes()
+        digest, ds = bytes_digest(raw), pydicom.dcmread(BytesIO(raw))
+    else:
+        digest, ds = None, pydicom.dcmread(job.src)
+    ds_anon = anonymize_dicom_ps315(ds, salt, job.patient_id, uid_store)
+    job.dst.parent.mkdir(parents=True, exist_ok=True)
+    ds_anon.save_as(job.dst)
+    return digest
+
+@dataclass
+class _StreamedHeader:
+    """Lo que el lector del pipeline deja en cola para un archivo: su
+    cabecera (``ds``, ``None`` si no admite el paso directo) y, en el
+    transformador, la cabecera anonimizada ya serializada."""
+
+    ds: Optional[pydicom.dataset.Dataset]
+    pixel_start: int = 0
+    file_size: int = 0
+    hasher: object = None
+    header: Optional[memoryview] = None
+
+def _pipeline_jobs(
+    jobs: list,
+    salt: str,
+    passthrough: bool,
+    with_digest: bool,
+    uid_store: Optional[UIDMapStore],
+    pipeline: PipelineConfig,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> Iterator[tuple]:
+    """Anonimiza con lectura, transformación y escritura solapadas
+    (:func:`anon_pipeline.run_pipeline`). Produce ``(job, error, digest)``.
+
+    El lector solo lee cabeceras y el escritor copia los píxeles del origen
+    por bloques, de modo que en cola hay cabeceras y no archivos enteros:
+    cada archivo ocupa del presupuesto su cabecera más un bloque de copia.
+    Los que no admiten el paso directo se leen enteros en el transformador
+    y ocupan su tamaño completo."""
+    def _read(job):
+        with open(job.src, "rb") as fp:
+            file_size = os.fstat(fp.fileno()).st_size
+            split = _read_header(fp, file_size) if passthrough else None
+            if split is None:
+                return _StreamedHeader(None, file_size=file_size)
+            ds, pixel_start = split
+            hasher = None
+            if with_digest:
+                fp.seek(0)
+                hasher = content_hasher()
+                hasher.update(fp.read(pixel_start))
+        return _StreamedHeader(ds, pixel_start, file_size, hasher)
+
+    def _transform(job, read):
+        if read.ds is None:
+            return _anonymize_whole(job, salt, uid_store, with_digest)
+        out = BytesIO()
+        anonymize_dicom_ps315(read.ds, salt, job.patient_id, uid_store).save_as(out)
+        read.ds, read.header = None, out.getbuffer()
+        return read
+
+    def _write(job, out):
+        if not isinstance(out, _StreamedHeader):
+            return out
+        job.dst.parent.mkdir(parents=True, exist_ok=True)
+        with open(job.src, "rb") as src_fp, open(job.dst, "wb") as dst_fp:
+            dst_fp.write(out.header)
+            src_fp.seek(out.pixel_start)
+            for block in iter(lambda: src_fp.read(_COPY_BUFFER), b""):
+                if out.hasher is not None:
+                    out.hasher.update(block)
+                dst_fp.write(block)
+        return out.hasher.hexdigest() if out.hasher is not None else None
+
+    def _size(job, read):
+        if read.ds is None:
+            return read.file_size
+        return read.pixel_start + min(_COPY_BUFFER, read.file_size - read.pixel_start)
+
+    for job, error, digest in run_pipeline(
+        jobs, _read, _transform, _write, pipeline, should_stop=should_stop, item_size=_size
+    ):
+        yield job, error, digest
+
+def _anonymize_chunk(
+    chunk: list,
+    salt: str,
+    passthrough: bool = True,
+    with_digest: bool = False,
+    uid_store_path: Optional[Path] = None,
+    pipeline: Optional[PipelineConfig] = None,
+) -> list:
+    uid_store = shared_uid_store(uid_store_path, salt)
+    if pipeline is not None:
+        by_job = {
+            job: (error, digest)
+            for job, error, digest in _pipeline_jobs(chunk, salt, passthrough, with_digest, uid_store, pipeline)
+        }
+        results = [by_job.get(job, ("No procesado", None)) for job in chunk]
+    else:
+        results = []
+        for job in chunk:
+            try:
+                results.append((None, anonymize_file(job, salt, passthrough, uid_store, with_digest)))
+            except Exception as e:
+                results.append((str(e), None))
+    if uid_store is not None:
+        uid_store.flush()
+    return results
+
+def shard_jobs(jobs: list, chunk_size: int = 32) -> list:
+    """Agrupa por paciente y serie (carpeta de origen) y parte cada grupo en
+    bloques de ``chunk_size`` para que la cancelación y el progreso sigan
+    siendo granulares aunque una serie tenga cientos de cortes."""
+    groups: dict = {}
+    for job in jobs:
+        groups.setdefault((job.patient_id, job.src.parent), []).append(job)
+
+    chunks = []
+    for key in sorted(groups, key=lambda k: (k[0], str(k[1]))):
+        group = groups[key]
+        for start in range(0, len(group), chunk_size):
+            chunks.append(group[start:start + chunk_size])
+    return chunks
+
+def anonymize_jobs(
+    jobs: list,
+    salt: str,
+    max_workers: int = 1,
+    should_stop: Optional[Callable[[], bool]] = None,
+    chunk_size: int = 32,
+    passthrough: bool = True,
+    journal: Optional[AnonymizationJournal] = None,
+    uid_store_path: Optional[Path] = None,
+    pipeline: Optional[PipelineConfig] = None,
+) -> Iterator[tuple]:
+    """Anonimiza ``jobs`` y produce ``(job, error)`` por archivo (``error`` es
+    ``None`` si tuvo éxito).
+
+    Con ``max_workers > 1`` los bloques de :func:`shard_jobs` se reparten en
+    un ``ProcessPoolExecutor`` de procesos lanzados con ``spawn``: quien
+    llama suele ser un ``QThread`` y un ``fork`` copiaría cerrojos tomados
+    por otros hilos. El resultado no depende del reparto porque
+    ``anonymize_dicom_ps315`` es determinista dado (dataset, salt, paciente).
+    ``should_stop`` se consulta entre archivos (serie) o entre bloques
+    (paralelo); al activarse se descartan los bloques pendientes.
+    Con ``passthrough`` los píxeles se copian sin decodificar
+    (ver :func:`anonymize_file_passthrough`). Si se pasa ``journal`` cada
+    archivo correcto queda registrado en cuanto termina, de modo que una
+    ejecución interrumpida se reanuda desde ahí (filtrar antes con
+    :meth:`AnonymizationJournal.partition`). Con ``uid_store_path`` cada
+    proceso registra sus UIDs en ese :class:`UIDMapStore` compartido.
+    Con ``pipeline`` cada proceso (o el propio hilo si ``max_workers <= 1``)
+    solapa lecturas, anonimización y escrituras con colas acotadas; el
+    digest para el journal se calcula sobre los bytes ya leídos.
+    """
+    should_stop = should_stop or (lambda: False)
+    with_digest = journal is not None
+
+    def _report(job, error, digest):
+        if journal is not None and error is None:
+            journal.record(job, digest)
+        return job, error
+
+    if max_workers <= 1 and pipeline is not None:
+        uid_store = shared_uid_store(uid_store_path, salt)
+        try:
+            for job, error, digest in _pipeline_jobs(
+                jobs, salt, passthrough, with_digest, uid_store, pipeline, should_stop
+            ):
+                yield _report(job, error, digest)
+        finally:
+            if uid_store is not None:
+                uid_store.flush()
+        return
+
+    if max_workers <= 1:
+        for job in jobs:
+            if should_stop():
+                return
+            yield _report(job, *_anonymize_chunk([job], salt, passthrough, with_digest, uid_store_path)[0])
+        return
+
+    pending_chunks = shard_jobs(jobs, chunk_size)
+    pending_chunks.reverse()
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    in_flight: dict = {}
+    try:
+        while pending_chunks or in_flight:
+            while pending_chunks and len(in_flight) < max_workers * 2 and not should_stop():
+                chunk = pending_chunks.pop()
+                future = executor.submit(
+                    _anonymize_chunk, chunk, salt, passthrough, with_digest, uid_store_path, pipeline
+                )
+                in_flight[future] = chunk
+
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [(str(e), None)] * len(chunk)
+                for job, (error, digest) in zip(chunk, results):
+                    yield _report(job, error, digest)
+
+            if should_stop():
+                pending_chunks.clear()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def open_journal(output_root: Path, salt: str, resume: bool) -> Optional[AnonymizationJournal]:
+    if not resume:
+        return None
+    return AnonymizationJournal(output_root, salt, PROFILE_VERSION)
 
 class DicomProcessor:
-    def __init__(self, input_dir: str, output_dir: str, salt: str):
+    def __init__(
+        self,
+        input_dir: str,
+        output_dir: str,
+        salt: str,
+        max_workers: Optional[int] = None,
+        resume: bool = True,
+        uid_store_path: Optional[str] = None,
+        pipeline: Optional[PipelineConfig] = None,
+    ):
         self.input_path = Path(input_dir)
         self.output_path = Path(output_dir)
         self.salt = salt
         self.patient_id = self.input_path.parts[-1]
+        self.max_workers = resolve_workers(max_workers)
+        self.resume = resume
+        self.uid_store_path = resolve_uid_store_path(uid_store_path)
+        self.pipeline = pipeline or PipelineConfig.from_env()
 
     def run(self) -> None:
         if not self.output_path.exists():
             self.output_path.mkdir(parents=True)
 
-        all_found = list(self.input_path.rglob("*.dcm"))
-        dcm_files = [f for f in all_found if not f.name.startswith('.')]
-        print(f"Procesando {len(dcm_files)} archivos...")
+        jobs = collect_jobs(self.input_path, self.output_path, self.patient_id)
+        journal = open_journal(self.output_path, self.salt, self.resume)
+        try:
+            if journal is not None:
+                jobs, skipped = journal.partition(jobs)
+                if skipped:
+                    print(f"Omitidos {len(skipped)} archivos ya anonimizados")
+            print(f"Procesando {len(jobs)} archivos (workers={self.max_workers})...")
 
-        for file_path in dcm_files:
-            try:
-                ds = pydicom.dcmread(file_path)
-                ds_anon = anonymize_dicom_ps315(ds, self.salt, self.patient_id)
-                
-                relative_path = file_path.relative_to(self.input_path)
-                save_path = self.output_path / relative_path
-                
-                save_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                ds_anon.save_as(save_path)
-            except Exception as e:
-                print(f"Error en {file_path}: {e}")
+            for job, error in anonymize_jobs(
+                jobs, self.salt, self.max_workers, journal=journal,
+                uid_store_path=self.uid_store_path, pipeline=self.pipeline,
+            ):
+                if error:
+                    print(f"Error en {job.src}: {error}")
+        finally:
+            if journal is not None:
+                journal.close()
 
 class BatchDicomProcessor:
-    def __init__(self, base_dir: str, salt: str):
+    def __init__(
+        self,
+        base_dir: str,
+        salt: str,
+        max_workers: Optional[int] = None,
+        resume: bool = True,
+        uid_store_path: Optional[str] = None,
+        pipeline: Optional[PipelineConfig] = None,
+    ):
         self.base_path = Path(base_dir)
         self.salt = salt
         self.anonymized_folder = self.base_path / "ANONYMIZED"
+        self.max_workers = resolve_workers(max_workers)
+        self.resume = resume
+        self.uid_store_path = resolve_uid_store_path(uid_store_path)
+        self.pipeline = pipeline or PipelineConfig.from_env()
     
     def is_already_anonymized(self, patient_folder: Path) -> bool:
         folder_name = patient_folder.name
-        return folder_name == "ANONYMIZED" or folder_name.startswith('ANON') or folder_name == "NIFTI_CONVERTED"
+        return folder_name in ("ANONYMIZED", "NIFTI_CONVERTED", "_temp_anon") or folder_name.startswith('ANON')
     
     def get_patient_folders(self) -> list:
         patient_folders = []
@@ -115,42 +645,60 @@ class BatchDicomProcessor:
         print(f"Directorio base: {self.base_path}")
         print(f"Directorio salida: {self.anonymized_folder}")
         print(f"Pacientes encontrados: {len(patient_folders)}")
+        print(f"Workers: {self.max_workers}")
         print(f"{'='*70}\n")
         
+        jobs = []
         for idx, patient_folder in enumerate(patient_folders, 1):
             patient_id = patient_folder.name
             output_folder = self.anonymized_folder / f"ANON{patient_id}"
+            patient_jobs = collect_jobs(patient_folder, output_folder, patient_id)
+            jobs.extend(patient_jobs)
             
-            print(f"\n[{idx}/{len(patient_folders)}] Procesando: {patient_id}")
+            print(f"[{idx}/{len(patient_folders)}] {patient_id}: {len(patient_jobs)} archivos")
             print(f"  Entrada:  {patient_folder}")
             print(f"  Salida:   {output_folder}")
-            
-            processor = DicomProcessor(
-                input_dir=str(patient_folder),
-                output_dir=str(output_folder),
-                salt=self.salt
-            )
-            processor.run()
+        
+        failed = 0
+        skipped = []
+        journal = open_journal(self.anonymized_folder, self.salt, self.resume)
+        try:
+            if journal is not None:
+                jobs, skipped = journal.partition(jobs)
+                print(f"\nOmitidos {len(skipped)} archivos ya anonimizados; pendientes: {len(jobs)}")
+            for job, error in anonymize_jobs(
+                jobs, self.salt, self.max_workers, journal=journal,
+                uid_store_path=self.uid_store_path, pipeline=self.pipeline,
+            ):
+                if error:
+                    failed += 1
+                    print(f"Error en {job.src}: {error}")
+        finally:
+            if journal is not None:
+                journal.close()
         
         print(f"\n{'='*70}")
         print(f"PROCESAMIENTO COMPLETADO")
         print(f"Total de pacientes procesados: {len(patient_folders)}")
+        print(f"Archivos: {len(jobs) - failed} OK, {failed} errores, {len(skipped)} omitidos")
         print(f"Carpeta de salida: {self.anonymized_folder}")
         print(f"{'='*70}\n")
 
+def _has_dcm(files: list) -> bool:
+    return any(has_suffix(f.name, DICOM_SUFFIX) for f in files)
+
 def is_patient_container_dir(path: Path) -> bool:
-    subdirs = [d for d in path.iterdir() if d.is_dir() and not d.name.startswith('.')]
+    subdirs, root_files = list_dir(path)
     
     if not subdirs:
         return False
     
-    dcm_in_root = list(path.glob("*.dcm"))
-    if dcm_in_root:
+    if _has_dcm(root_files):
         return False
     
     for subdir in subdirs[:3]:
-        dcm_files = list(subdir.glob("*.dcm"))
-        deeper_subdirs = [d for d in subdir.iterdir() if d.is_dir() and not d.name.startswith('.')]
+        deeper_subdirs, files = list_dir(subdir)
+        dcm_files = _has_dcm(files)
         
         if dcm_files and not deeper_subdirs:
             return False
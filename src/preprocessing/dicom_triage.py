@@ -0,0 +1,234 @@
+import json
+import os
+import struct
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pydicom
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+from file_discovery import walk_files
+
+VALID = "valid"
+INVALID = "invalid"
+QUARANTINED = "quarantined"
+
+TRIAGE_VERSION = 1
+TRIAGE_TAGS = [
+    "SOPClassUID",
+    "SOPInstanceUID",
+    "Modality",
+    "SeriesInstanceUID",
+    "StudyInstanceUID",
+    "Rows",
+    "Columns",
+    "SamplesPerPixel",
+    "BitsAllocated",
+    "NumberOfFrames",
+]
+_MEDIA_STORAGE_DIRECTORY = "1.2.840.10008.1.3.10"
+_PREAMBLE = 128
+_ITEM_TAG = 0xFFFEE000
+_SEQ_DELIMITER_TAG = 0xFFFEE0DD
+
+@dataclass(frozen=True)
+class TriageRecord:
+    """Resultado del triaje de un archivo. ``status`` es ``valid`` (DICOM
+    legible), ``invalid`` (no es DICOM o no es una imagen, p. ej. DICOMDIR)
+    o ``quarantined`` (parece DICOM pero está dañado o truncado)."""
+
+    path: Path
+    status: str
+    size: int = 0
+    modality: str = ""
+    series_uid: str = ""
+    study_uid: str = ""
+    instance_uid: str = ""
+    transfer_syntax: str = ""
+    rows: int = 0
+    columns: int = 0
+    reason: str = ""
+
+def resolve_triage_workers(max_workers: Optional[int] = None) -> int:
+    """Hilos de triaje: argumento > DICOM_TRIAGE_WORKERS > 8. Solo se leen
+    cabeceras, así que el límite es la E/S y no los núcleos."""
+    if max_workers is None:
+        try:
+            max_workers = int(os.getenv("DICOM_TRIAGE_WORKERS", "8"))
+        except ValueError:
+            max_workers = 8
+    return max(1, max_workers)
+
+def pixel_data_end(fp, little_endian: bool, implicit_vr: bool) -> int:
+    """Devuelve el offset donde termina el elemento de píxeles que empieza en
+    la posición actual de ``fp``. Solo lee cabeceras de elemento/ítem: los
+    fragmentos encapsulados se saltan con ``seek``."""
+    endian = "<" if little_endian else ">"
+    start = fp.tell()
+    if implicit_vr:
+        header = fp.read(8)
+        length = struct.unpack(f"{endian}L", header[4:8])[0]
+    else:
+        header = fp.read(12)
+        length = struct.unpack(f"{endian}L", header[8:12])[0]
+
+    if length != 0xFFFFFFFF:
+        return fp.tell() + length
+
+    while True:
+        item = fp.read(8)
+        if len(item) < 8:
+            raise ValueError(f"PixelData encapsulado truncado (offset {start})")
+        group, elem, item_length = struct.unpack(f"{endian}HHL", item)
+        tag = (group << 16) | elem
+        if tag == _SEQ_DELIMITER_TAG:
+            return fp.tell()
+        if tag != _ITEM_TAG:
+            raise ValueError(f"Ítem inesperado {tag:08X} en PixelData encapsulado")
+        fp.seek(item_length, os.SEEK_CUR)
+
+def has_dicom_magic(path: Path) -> bool:
+    """Preámbulo de 128 bytes seguido de ``DICM`` (PS3.10)."""
+    try:
+        with open(path, "rb") as fp:
+            head = fp.read(_PREAMBLE + 4)
+    except OSError:
+        return False
+    return len(head) == _PREAMBLE + 4 and head[_PREAMBLE:] == b"DICM"
+
+def sniff(path: Path) -> TriageRecord:
+    """Clasifica ``path`` leyendo solo el preámbulo, la cabecera meta y las
+    etiquetas de :data:`TRIAGE_TAGS`. Comprueba además que los píxeles no
+    estén truncados recorriendo sus cabeceras de elemento, sin leerlos."""
+    path = Path(path)
+    try:
+        size = path.stat().st_size
+    except OSError as e:
+        return TriageRecord(path, QUARANTINED, reason=str(e))
+    if not has_dicom_magic(path):
+        if path.suffix.lower() == ".dcm":
+            return TriageRecord(path, QUARANTINED, size, reason="sin preámbulo DICM")
+        return TriageRecord(path, INVALID, size, reason="no es DICOM")
+    try:
+        with open(path, "rb") as fp:
+            ds = pydicom.dcmread(fp, stop_before_pixels=True, specific_tags=TRIAGE_TAGS)
+            syntax = ds.file_meta.get("TransferSyntaxUID") if hasattr(ds, "file_meta") else None
+            pixels_start = pixels_end = fp.tell()
+            if syntax is not None and syntax != DeflatedExplicitVRLittleEndian and fp.tell() < size:
+                implicit_vr, little_endian = ds.original_encoding
+                pixels_end = pixel_data_end(fp, little_endian, implicit_vr)
+    except Exception as e:
+        return TriageRecord(path, QUARANTINED, size, reason=str(e) or type(e).__name__)
+
+    record = TriageRecord(
+        path,
+        VALID,
+        size,
+        modality=str(ds.get("Modality", "") or ""),
+        series_uid=str(ds.get("SeriesInstanceUID", "") or ""),
+        study_uid=str(ds.get("StudyInstanceUID", "") or ""),
+        instance_uid=str(ds.get("SOPInstanceUID", "") or ""),
+        transfer_syntax=str(syntax or ""),
+        rows=int(ds.get("Rows", 0) or 0),
+        columns=int(ds.get("Columns", 0) or 0),
+    )
+    if syntax is None:
+        return _with(record, QUARANTINED, "sin TransferSyntaxUID")
+    if str(ds.file_meta.get("MediaStorageSOPClassUID", "")) == _MEDIA_STORAGE_DIRECTORY:
+        return _with(record, INVALID, "DICOMDIR")
+    if not record.instance_uid:
+        return _with(record, QUARANTINED, "cabecera incompleta (sin SOPInstanceUID)")
+    if record.rows and pixels_start >= size:
+        return _with(record, QUARANTINED, "sin PixelData")
+    if pixels_end > size:
+        return _with(record, QUARANTINED, f"truncado: faltan {pixels_end - size} bytes de píxeles")
+    return record
+
+def _with(record: TriageRecord, status: str, reason: str) -> TriageRecord:
+    return TriageRecord(**{**asdict(record), "status": status, "reason": reason})
+
+class TriageManifest:
+    """Triaje de una carpeta: un :class:`TriageRecord` por archivo.
+
+    Las etapas siguientes toman de aquí la lista de archivos válidos, la
+    modalidad y la agrupación por serie, en lugar de volver a recorrer la
+    carpeta y abrir cada archivo.
+    """
+
+    def __init__(self, records: Iterable[TriageRecord], root: Optional[Path] = None):
+        self.root = Path(root) if root is not None else None
+        self.records = sorted(records, key=lambda r: r.path)
+        self._by_path = {r.path: r for r in self.records}
+
+    def by_status(self, status: str) -> list:
+        return [r for r in self.records if r.status == status]
+
+    @property
+    def valid(self) -> list:
+        return self.by_status(VALID)
+
+    @property
+    def invalid(self) -> list:
+        return self.by_status(INVALID)
+
+    @property
+    def quarantined(self) -> list:
+        return self.by_status(QUARANTINED)
+
+    def files(self) -> list:
+        return [r.path for r in self.valid]
+
+    def get(self, path: Path) -> Optional[TriageRecord]:
+        return self._by_path.get(Path(path))
+
+    def modality(self) -> str:
+        """Modalidad del primer archivo válido, como la de
+        ``SmartMedicalConverter.detect_modality``."""
+        return next((r.modality for r in self.valid if r.modality), "UNKNOWN")
+
+    def total_bytes(self) -> int:
+        return sum(r.size for r in self.valid)
+
+    def summary(self) -> str:
+        counts = Counter(r.status for r in self.records)
+        return (
+            f"{counts[VALID]} válidos, {counts[INVALID]} no DICOM, "
+            f"{counts[QUARANTINED]} en cuarentena"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "version": TRIAGE_VERSION,
+            "root": str(self.root) if self.root else None,
+            "files": [{**asdict(r), "path": str(r.path)} for r in self.records],
+        }
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".tmp")
+        partial.write_text(json.dumps(self.to_dict(), indent=1, ensure_ascii=False))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "TriageManifest":
+        data = json.loads(Path(path).read_text())
+        if data.get("version") != TRIAGE_VERSION:
+            raise ValueError(f"Versión de triaje no soportada: {data.get('version')}")
+        records = [TriageRecord(**{**r, "path": Path(r["path"])}) for r in data["files"]]
+        return cls(records, data.get("root"))
+
+def triage_files(files: Iterable[Path], max_workers: Optional[int] = None, root: Optional[Path] = None) -> TriageManifest:
+    files = list(files)
+    workers = min(resolve_triage_workers(max_workers), len(files) or 1)
+    if workers <= 1:
+        return TriageManifest(map(sniff, files), root)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return TriageManifest(executor.map(sniff, files), root)
+
+def triage_folder(folder: Path, max_workers: Optional[int] = None, exclude: Iterable[str] = ()) -> TriageManifest:
+    """Recorre ``folder`` una vez y clasifica cada archivo en paralelo."""
+    return triage_files(walk_files(folder, exclude), max_workers, root=folder)
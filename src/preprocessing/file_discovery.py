@@ -0,0 +1,106 @@
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+DICOM_SUFFIX = ".dcm"
+
+def has_suffix(name: str, suffix: str) -> bool:
+    """``name`` acaba en ``suffix`` sin distinguir mayúsculas (``.DCM``)."""
+    return name.lower().endswith(suffix.lower())
+
+def iter_files(folder: Path, suffix: Optional[str] = None, exclude: Iterable[str] = ()) -> Iterator[Path]:
+    """Archivos de ``folder`` (los que acaban en ``suffix``, sin distinguir
+    mayúsculas, si se indica), con ``os.scandir`` y de forma perezosa: se recorre cada carpeta antes de
+    bajar a sus subcarpetas, y quien solo necesita el primero deja de
+    recorrer en cuanto lo tiene. Omite ocultos y las carpetas de ``exclude``."""
+    exclude = set(exclude)
+    stack = [os.fspath(folder)]
+    while stack:
+        subdirs = []
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or entry.name in exclude:
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if suffix is None or has_suffix(entry.name, suffix):
+                        yield Path(entry.path)
+        except OSError:
+            pass
+        stack.extend(reversed(subdirs))
+
+def walk_files(folder: Path, exclude: Iterable[str] = ()) -> list:
+    """Todos los archivos de ``folder`` (sin importar la extensión), ordenados."""
+    return sorted(iter_files(folder, exclude=exclude))
+
+def first_file(folder: Path, suffix: str = DICOM_SUFFIX) -> Optional[Path]:
+    """El primer archivo con ``suffix`` que aparezca, sin recorrer el resto."""
+    return next(iter_files(folder, suffix), None)
+
+def list_dir(folder: Path) -> tuple:
+    """``(subcarpetas, archivos)`` visibles de ``folder``, ordenados, con una
+    sola llamada a ``os.scandir``."""
+    dirs, files = [], []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir():
+                        dirs.append(Path(entry.path))
+                    elif entry.is_file():
+                        files.append(Path(entry.path))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return sorted(dirs), sorted(files)
+
+class DiscoveryCache:
+    """Listados de ``.dcm`` por carpeta compartidos por las etapas de una
+    ejecución: la detección de modalidad, la reparación, la agrupación por
+    serie y la exportación 2D reutilizan el mismo recorrido.
+
+    Solo es válido mientras las carpetas no cambian; cada ejecución usa
+    uno nuevo (o llama a :meth:`forget` tras escribir en una carpeta).
+    """
+
+    def __init__(self, suffix: str = DICOM_SUFFIX):
+        self.suffix = suffix
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def files(self, folder: Path) -> list:
+        key = os.path.abspath(folder)
+        with self._lock:
+            cached = self._files.get(key)
+        if cached is None:
+            cached = sorted(iter_files(folder, self.suffix))
+            with self._lock:
+                self._files[key] = cached
+        return list(cached)
+
+    def first(self, folder: Path) -> Optional[Path]:
+        """Como :func:`first_file`, respondiendo desde la caché si la carpeta
+        ya se listó entera."""
+        with self._lock:
+            cached = self._files.get(os.path.abspath(folder))
+        if cached is not None:
+            return cached[0] if cached else None
+        return first_file(folder, self.suffix)
+
+    def forget(self, folder: Optional[Path] = None) -> None:
+        with self._lock:
+            if folder is None:
+                self._files.clear()
+            else:
+                self._files.pop(os.path.abspath(folder), None)
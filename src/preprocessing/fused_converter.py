@@ -0,0 +1,345 @@
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+import pydicom
+
+from anon_pipeline import PipelineConfig
+from conversion_manifest import ConversionManifest, input_fingerprint
+from dicom_processor import AnonymizeJob, anonymize_dicom_ps315, anonymize_jobs, anonymize_uid, shared_uid_store
+from dicom_triage import TriageManifest
+from nifti_assembler import assemble_series, write_volume
+from nifti_converter import SmartMedicalConverter, resolve_scratch_dir, unique_output_name
+
+def resolve_fused(fused: Optional[bool] = None) -> bool:
+    """Argumento o ``DICOM_FUSED`` (desactivado salvo ``DICOM_FUSED=1``).
+
+    El flujo en dos fases es el predeterminado porque es el único con
+    journal de reanudación y auditoría PHI de la salida anonimizada."""
+    if fused is not None:
+        return fused
+    return os.getenv("DICOM_FUSED", "0").strip() == "1"
+
+@dataclass
+class ConversionUnit:
+    """Trabajo mínimo del flujo fusionado: una serie o un paciente DX.
+    ``series_uid`` e ``instance_uids`` son los originales;
+    :meth:`FusedConverter.check_manifest` rellena ``key``, ``fingerprint``
+    y ``up_to_date``."""
+
+    patient_id: str
+    modality: str
+    files: list
+    series_index: int = 0
+    series_count: int = 1
+    needs_decompression: bool = False
+    series_uid: str = ""
+    instance_uids: list = field(default_factory=list)
+    key: str = ""
+    fingerprint: str = ""
+    up_to_date: bool = False
+
+    @property
+    def anon_id(self) -> str:
+        return f"ANON{self.patient_id}"
+
+class FusedConverter:
+    """Anonimiza y convierte paciente a paciente sin carpeta ``_temp_anon``.
+
+    Las mamografías (DX) se anonimizan en memoria y pasan directamente al
+    escritor PNG. Las series volumétricas se anonimizan a ``scratch_dir``
+    (SSD local o tmpfs) una serie cada vez, y esa copia se borra en cuanto
+    dcm2niix termina con ella: el espacio temporal está acotado por las
+    series en vuelo, no por el lote. Con el motor ``native`` la serie
+    anonimizada no toca el disco: los datasets pasan en memoria al
+    ensamblador, y solo las series que este rechaza se escriben a scratch
+    para dcm2niix. :meth:`anonymize_unit` y
+    :meth:`convert_unit` son las dos etapas que ``UnifiedWorker`` solapa.
+    La salida es la misma que la del flujo en dos fases, en
+    ``converter.output_path / ANON<paciente>``, pero sin journal de
+    anonimización ni auditoría PHI (ver :func:`resolve_fused`). Sí lee y
+    escribe el ``.conversion.json`` de cada paciente, con las mismas claves
+    que el flujo en dos fases (:meth:`check_manifest`).
+    """
+
+    def __init__(
+        self,
+        converter: SmartMedicalConverter,
+        salt: str,
+        scratch_dir: Optional[str] = None,
+        max_workers: int = 1,
+        uid_store_path: Optional[Path] = None,
+        pipeline: Optional[PipelineConfig] = None,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.converter = converter
+        self.salt = salt
+        self.scratch_dir = resolve_scratch_dir(scratch_dir)
+        self.max_workers = max_workers
+        self.uid_store_path = uid_store_path
+        self.pipeline = pipeline
+        self.log = log or print
+        self._work_dir: Optional[Path] = None
+        self._taken: dict = {}
+        self._manifests: dict = {}
+        self._lock = threading.Lock()
+
+    def list_dicom_files(self, folder: Path) -> list:
+        return self.converter.patient_files(folder)
+
+    @staticmethod
+    def detect_modality(files: list) -> str:
+        try:
+            return pydicom.dcmread(files[0], stop_before_pixels=True).get("Modality", "UNKNOWN")
+        except Exception:
+            return "UNKNOWN"
+
+    def plan_patient(self, src: Path, patient_id: str, triage: Optional[TriageManifest] = None) -> list:
+        """Divide un paciente en :class:`ConversionUnit`: una por serie
+        volumétrica, o una sola para DX y modalidades no soportadas. Con
+        ``triage`` se usan sus archivos válidos, su modalidad y sus series
+        sin volver a abrir los archivos."""
+        if triage is None:
+            files = self.list_dicom_files(src)
+            modality = self.detect_modality(files) if files else "UNKNOWN"
+        else:
+            files, modality = triage.files(), triage.modality()
+        if not files:
+            return [ConversionUnit(patient_id, "UNKNOWN", [])]
+        if modality == "DX":
+            groups = self.converter.group_series(files, triage)
+            return [ConversionUnit(
+                patient_id, modality, [f for g in groups for f in g.files],
+                instance_uids=[uid for g in groups for uid in g.instance_uids],
+            )]
+        if not self.converter.is_volumetric_modality(modality):
+            return [ConversionUnit(patient_id, modality, files)]
+        groups = self.converter.group_series(files, triage)
+        return [
+            ConversionUnit(
+                patient_id, modality, group.files, index, len(groups), group.needs_decompression,
+                series_uid=group.uid, instance_uids=group.instance_uids,
+            )
+            for index, group in enumerate(groups)
+        ]
+
+    def _manifest(self, patient_id: str) -> ConversionManifest:
+        manifest = self._manifests.get(patient_id)
+        if manifest is None:
+            manifest = self._manifests[patient_id] = ConversionManifest(
+                self.converter.output_path / f"ANON{patient_id}"
+            )
+        return manifest
+
+    def check_manifest(self, units: list) -> list:
+        """Marca ``up_to_date`` las unidades que ``.conversion.json`` ya
+        registra con la misma huella y borra las salidas anteriores de las
+        demás antes de convertirlas. La clave es el SeriesInstanceUID
+        anonimizado (``2D`` para DX), como en el flujo en dos fases; la
+        huella se calcula sobre los archivos de origen con los UIDs de
+        instancia ya anonimizados."""
+        for unit in units:
+            volumetric = self.converter.is_volumetric_modality(unit.modality)
+            if not unit.files or (unit.modality != "DX" and not volumetric):
+                continue
+            kind = "2D" if unit.modality == "DX" else "3D"
+            unit.key = "2D" if kind == "2D" else anonymize_uid(unit.series_uid, self.salt)
+            unit.fingerprint = input_fingerprint(
+                unit.files,
+                [anonymize_uid(uid, self.salt) if uid else "" for uid in unit.instance_uids],
+                {**self.converter.conversion_settings(kind), "input": "source"},
+            )
+            with self._lock:
+                manifest = self._manifest(unit.patient_id)
+                if manifest.is_current(unit.key, unit.fingerprint):
+                    unit.up_to_date = True
+                    self._taken.setdefault(unit.patient_id, set()).update(manifest.entries[unit.key]["outputs"])
+                else:
+                    manifest.discard(unit.key)
+        return units
+
+    def _record(self, unit: "ConversionUnit", outputs: list) -> None:
+        names = sorted({Path(p).name for p in outputs if Path(p).exists()})
+        if not unit.key or not names:
+            return
+        with self._lock:
+            manifest = self._manifest(unit.patient_id)
+            manifest.record(unit.key, unit.fingerprint, names)
+            manifest.save()
+
+    def anonymize_unit(self, unit: "ConversionUnit", should_stop: Optional[Callable[[], bool]] = None):
+        """Primera etapa. Los DX se escriben ya como PNG (devuelve cuántos);
+        una serie volumétrica se anonimiza a su propia carpeta de scratch
+        (devuelve la carpeta), o a memoria con el motor ``native`` (devuelve
+        la lista de datasets)."""
+        should_stop = should_stop or (lambda: False)
+        if not unit.files or unit.up_to_date:
+            return None
+        output_folder = self.converter.output_path / unit.anon_id
+        output_folder.mkdir(parents=True, exist_ok=True)
+        if unit.modality == "DX":
+            return self._process_mammo_2d(unit, output_folder, should_stop)
+        if not self.converter.is_volumetric_modality(unit.modality):
+            return None
+        if self.converter.engine == "native":
+            return self._anonymize_in_memory(unit, should_stop)
+
+        work = Path(tempfile.mkdtemp(prefix=f"{unit.anon_id}_{unit.series_index}_", dir=self._run_dir()))
+        series_dir = work / "series"
+        jobs = [AnonymizeJob(f, series_dir / f"{i:05d}.dcm", unit.patient_id) for i, f in enumerate(unit.files)]
+        for job, error in anonymize_jobs(
+            jobs,
+            self.salt,
+            self.max_workers,
+            should_stop=should_stop,
+            uid_store_path=self.uid_store_path,
+            pipeline=self.pipeline,
+        ):
+            if error:
+                self.log(f"    Error en {job.src.name}: {error}")
+        return work
+
+    def _anonymize_in_memory(self, unit: "ConversionUnit", should_stop) -> list:
+        uid_store = shared_uid_store(self.uid_store_path, self.salt)
+        datasets = []
+        try:
+            for dcm_path in unit.files:
+                if should_stop():
+                    break
+                try:
+                    datasets.append(anonymize_dicom_ps315(pydicom.dcmread(dcm_path), self.salt, unit.patient_id, uid_store))
+                except Exception as e:
+                    self.log(f"    Error en {dcm_path.name}: {e}")
+        finally:
+            if uid_store is not None:
+                uid_store.flush()
+        return datasets
+
+    def _write_assembled(self, unit: "ConversionUnit", volume) -> tuple:
+        output_folder = self.converter.output_path / unit.anon_id
+        with self._lock:
+            taken = self._taken.setdefault(unit.patient_id, set())
+            name = unique_output_name(f"{unit.anon_id}_{volume.name}.nii.gz", taken)[:-len(".nii.gz")]
+            taken.add(f"{name}.json")
+        nifti_path = write_volume(volume, output_folder, unit.anon_id, name=name)
+        finished = self.converter.finish_volume(nifti_path, volume.data, volume.voxel_spacing)
+        self._record(unit, [finished, output_folder / f"{name}.json"])
+        return 1, ""
+
+    def _stage_datasets(self, unit: "ConversionUnit", datasets: list) -> Path:
+        work = Path(tempfile.mkdtemp(prefix=f"{unit.anon_id}_{unit.series_index}_", dir=self._run_dir()))
+        (work / "series").mkdir()
+        for i, ds in enumerate(datasets):
+            ds.save_as(work / "series" / f"{i:05d}.dcm")
+        return work
+
+    def convert_unit(self, unit: "ConversionUnit", staged) -> tuple:
+        """Segunda etapa: ``(archivos generados, mensaje de error)``. Libera
+        el scratch de la serie en cuanto dcm2niix termina."""
+        if unit.modality == "DX" or staged is None:
+            return staged or 0, ""
+        if isinstance(staged, list):
+            if not staged:
+                return 0, "anonymization produced no files"
+            try:
+                return self._write_assembled(unit, assemble_series(staged))
+            except Exception as e:
+                if not self.converter.dcm2niix_bin:
+                    return 0, f"dcm2niix not found: {e}"
+                self.log(f"    {unit.anon_id} serie {unit.series_index + 1} pasa a dcm2niix: {e}")
+                staged = self._stage_datasets(unit, staged)
+        try:
+            series_dir, out_dir = staged / "series", staged / "out"
+            if not series_dir.exists():
+                return 0, "anonymization produced no files"
+            out_dir.mkdir(parents=True, exist_ok=True)
+            nifti_files, error_message = self.converter.convert_volume(
+                series_dir, out_dir, unit.anon_id, repair_root=staged / "repair",
+                needs_decompression=unit.needs_decompression, engine="dcm2niix",
+            )
+            output_folder = self.converter.output_path / unit.anon_id
+            placed = []
+            with self._lock:
+                taken = self._taken.setdefault(unit.patient_id, set())
+                for produced in out_dir.iterdir():
+                    target = output_folder / unique_output_name(produced.name, taken)
+                    shutil.move(str(produced), str(target))
+                    placed.append(target)
+            finished = self.converter.finish_volumes([p for p in placed if p.name.endswith(".nii.gz")])
+            if nifti_files and not error_message:
+                self._record(unit, placed + finished)
+            return len(nifti_files), error_message
+        finally:
+            shutil.rmtree(staged, ignore_errors=True)
+
+    def summarize(self, unit: "ConversionUnit", count: int, error_message: str, up_to_date: int = 0) -> tuple:
+        """``(ok, modalidad, motivo)`` del paciente de ``unit``, con los mismos
+        textos que ``SmartMedicalConverter.convert_patient``. ``up_to_date``
+        cuenta las unidades del paciente que se omitieron por estar al día."""
+        modality = unit.modality
+        if not unit.files:
+            return (False, modality, "No DICOM files")
+        if modality == "DX":
+            if up_to_date:
+                with self._lock:
+                    skipped = len(self._manifest(unit.patient_id).entries[unit.key]["outputs"])
+                return (True, modality, f"Up to date: {skipped} images skipped")
+            return (True, modality, f"2D processed: {count} {self.converter.mammo_format[0].upper()}s")
+        if not self.converter.is_volumetric_modality(modality):
+            return (False, modality, f"Modality {modality} not supported")
+        if up_to_date == unit.series_count:
+            return (True, modality, f"Up to date: {up_to_date} series skipped")
+        note = f", {up_to_date} series up to date" if up_to_date else ""
+        if count:
+            return (True, modality, f"3D processed: {count} NIfTIs{note}")
+        return (False, modality, f"NIfTI error: {error_message[:50]}")
+
+    def convert_patient(
+        self,
+        src: Path,
+        patient_id: str,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> tuple:
+        """Convierte un paciente serie a serie, sin solapar etapas."""
+        should_stop = should_stop or (lambda: False)
+        units = self.check_manifest(self.plan_patient(src, patient_id))
+        count, error_message = 0, ""
+        for unit in units:
+            if should_stop():
+                break
+            n, error = self.convert_unit(unit, self.anonymize_unit(unit, should_stop))
+            count += n
+            error_message = error_message or error
+        return self.summarize(units[0], count, error_message, sum(u.up_to_date for u in units))
+
+    def _run_dir(self) -> Path:
+        with self._lock:
+            if self._work_dir is None:
+                self._work_dir = Path(tempfile.mkdtemp(prefix="fused_", dir=self.scratch_dir))
+            return self._work_dir
+
+    def close(self) -> None:
+        """Borra el scratch de la ejecución (series canceladas a medias)."""
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
+    def _process_mammo_2d(self, unit: "ConversionUnit", output_folder: Path, should_stop) -> int:
+        uid_store = shared_uid_store(self.uid_store_path, self.salt)
+        try:
+            written = self.converter.export_mammograms(
+                unit.files,
+                output_folder,
+                read=lambda path: anonymize_dicom_ps315(pydicom.dcmread(path), self.salt, unit.patient_id, uid_store),
+                should_stop=should_stop,
+            )
+            if len(written) == len(unit.files):
+                self._record(unit, written)
+            return len(written)
+        finally:
+            if uid_store is not None:
+                uid_store.flush()
@@ -0,0 +1,217 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pydicom
+
+from dicom_processor import resolve_workers
+from file_discovery import walk_files
+
+HEADER_INDEX_FILENAME = ".header_index.sqlite"
+INDEX_VERSION = 1
+_CHUNKSIZE = 64
+_MAX_VALUE = 200
+
+# Columnas consultables; el resto de la cabecera queda en ``tags`` (JSON).
+INDEXED_TAGS = (
+    "PatientName", "PatientID", "PatientBirthDate", "PatientSex", "PatientAge",
+    "StudyInstanceUID", "StudyDate", "StudyTime", "StudyDescription", "StudyID", "AccessionNumber",
+    "SeriesInstanceUID", "SeriesDescription", "SeriesNumber", "Modality",
+    "SOPInstanceUID", "InstanceNumber",
+    "InstitutionName", "InstitutionAddress", "Manufacturer", "ManufacturerModelName",
+    "ReferringPhysicianName", "PerformingPhysicianName", "IssuerOfPatientID",
+    "PatientComments", "ImageComments",
+    "Rows", "Columns", "PixelSpacing",
+)
+
+_COLUMNS = ", ".join(f'"{tag}"' for tag in INDEXED_TAGS)
+
+def _value(elem):
+    if elem.VR == "SQ":
+        return f"<secuencia de {len(elem.value)} ítems>"
+    value = elem.value
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return str(value)[:_MAX_VALUE]
+
+def read_header(path: str) -> tuple:
+    """``(columnas indexadas, todos los elementos, error)`` de ``path``,
+    leyendo solo la cabecera (``stop_before_pixels``)."""
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except Exception as e:
+        return {}, [], str(e) or type(e).__name__
+    columns = {}
+    elements = []
+    for elem in ds:
+        value = _value(elem)
+        elements.append([str(elem.tag), elem.keyword, value])
+        if elem.keyword in INDEXED_TAGS and elem.value not in (None, ""):
+            columns[elem.keyword] = value
+    return columns, elements, ""
+
+def resolve_index_path(base_dir: Path, index_path: Optional[str] = None) -> Path:
+    """Argumento > DICOM_HEADER_INDEX > ``<base_dir>/.header_index.sqlite``.
+    Si apunta a un directorio se usa ``.header_index.sqlite`` dentro de él."""
+    index_path = index_path or os.getenv("DICOM_HEADER_INDEX")
+    if not index_path:
+        return Path(base_dir) / HEADER_INDEX_FILENAME
+    path = Path(index_path)
+    return path / HEADER_INDEX_FILENAME if path.is_dir() else path
+
+class HeaderIndex:
+    """Índice SQLite con la cabecera de cada archivo de un archivo DICOM.
+
+    :meth:`refresh` recorre ``base_dir`` y solo vuelve a leer los archivos
+    nuevos o cuyo tamaño o mtime cambió (los borrados salen del índice).
+    Las lecturas son solo de cabecera y se reparten entre ``max_workers``
+    procesos (ver ``resolve_workers``). Las consultas se responden desde la tabla, sin abrir los
+    archivos. Contiene datos de pacientes sin anonimizar: debe guardarse
+    con los datos originales, nunca con los anonimizados.
+    """
+
+    def __init__(self, base_dir: Path, index_path: Optional[str] = None):
+        self.base_dir = Path(os.path.abspath(base_dir))
+        self.path = resolve_index_path(self.base_dir, index_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.row_factory = sqlite3.Row
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS headers")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS headers (
+                path      TEXT PRIMARY KEY,
+                folder    TEXT NOT NULL,
+                size      INTEGER NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                error     TEXT NOT NULL,
+                tags      TEXT NOT NULL,
+                {_COLUMNS}
+            )
+            """
+        )
+        for tag in ("folder", "SeriesInstanceUID", "Modality", "PatientID"):
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS headers_{tag} ON headers ("{tag}")')
+        self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _folder(self, path: Path) -> str:
+        """Primera carpeta bajo ``base_dir`` (la "serie" del explorador)."""
+        try:
+            parts = path.relative_to(self.base_dir).parts
+        except ValueError:
+            return ""
+        return parts[0] if len(parts) > 1 else ""
+
+    def refresh(self, max_workers: Optional[int] = None, files: Optional[Iterable[Path]] = None) -> dict:
+        """Pone el índice al día. Con ``files`` solo se revisan esos archivos
+        (y no se borra nada). Devuelve cuántos se añadieron, actualizaron,
+        eliminaron o seguían igual."""
+        partial = files is not None
+        files = [Path(os.path.abspath(f)) for f in files] if partial else walk_files(self.base_dir)
+        known = {
+            row["path"]: (row["size"], row["mtime_ns"])
+            for row in self._conn.execute("SELECT path, size, mtime_ns FROM headers")
+        }
+        stale, stats = [], {}
+        for f in files:
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            previous = known.pop(str(f), None)
+            if previous != (st.st_size, st.st_mtime_ns):
+                stale.append((f, st.st_size, st.st_mtime_ns, previous is not None))
+            else:
+                stats["unchanged"] = stats.get("unchanged", 0) + 1
+        removed = [] if partial else list(known)
+
+        workers = min(resolve_workers(max_workers), len(stale)) if stale else 0
+        paths = [str(f) for f, *_ in stale]
+        if workers <= 1:
+            headers = map(read_header, paths)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            headers = executor.map(read_header, paths, chunksize=_CHUNKSIZE)
+
+        sql = (
+            f"INSERT OR REPLACE INTO headers (path, folder, size, mtime_ns, error, tags, {_COLUMNS}) "
+            f"VALUES ({', '.join('?' * (6 + len(INDEXED_TAGS)))})"
+        )
+        try:
+            with self._conn:
+                for (f, size, mtime_ns, existed), (columns, elements, error) in zip(stale, headers):
+                    self._conn.execute(sql, (
+                        str(f), self._folder(f), size, mtime_ns, error, json.dumps(elements),
+                        *(columns.get(tag) for tag in INDEXED_TAGS),
+                    ))
+                    kind = "updated" if existed else "added"
+                    stats[kind] = stats.get(kind, 0) + 1
+                self._conn.executemany("DELETE FROM headers WHERE path = ?", [(p,) for p in removed])
+        finally:
+            if workers > 1:
+                executor.shutdown()
+        stats["removed"] = len(removed)
+        return {k: stats.get(k, 0) for k in ("added", "updated", "removed", "unchanged")}
+
+    def get(self, path: Path) -> Optional[dict]:
+        """Fila de ``path`` (columnas indexadas + ``tags``), o ``None``."""
+        row = self._conn.execute("SELECT * FROM headers WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record["tags"] = json.loads(record["tags"])
+        return record
+
+    def folders(self) -> list:
+        """``(carpeta, archivos, primer archivo)`` por carpeta de primer nivel,
+        contando solo cabeceras legibles."""
+        return [
+            (row["folder"], row["n"], Path(row["first"]))
+            for row in self._conn.execute(
+                "SELECT folder, COUNT(*) AS n, MIN(path) AS first FROM headers "
+                "WHERE error = '' AND folder != '' GROUP BY folder ORDER BY folder"
+            )
+        ]
+
+    def find(self, limit: Optional[int] = None, **criteria) -> list:
+        """Rutas cuyas columnas coinciden con ``criteria`` (p. ej. ``Modality="MR"``)."""
+        unknown = set(criteria) - set(INDEXED_TAGS)
+        if unknown:
+            raise ValueError(f"Columnas no indexadas: {', '.join(sorted(unknown))}")
+        where = " AND ".join(["error = ''"] + [f'"{tag}" = ?' for tag in criteria])
+        sql = f"SELECT path FROM headers WHERE {where} ORDER BY path"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [Path(p) for (p,) in self._conn.execute(sql, tuple(criteria.values()))]
+
+    def series(self) -> list:
+        """Una fila por SeriesInstanceUID con modalidad, descripción y archivos."""
+        return [
+            dict(row) for row in self._conn.execute(
+                "SELECT SeriesInstanceUID, Modality, SeriesDescription, SeriesNumber, "
+                "COUNT(*) AS files, MIN(path) AS first FROM headers "
+                "WHERE error = '' GROUP BY SeriesInstanceUID ORDER BY first"
+            )
+        ]
+
+    def errors(self) -> list:
+        return [tuple(row) for row in self._conn.execute("SELECT path, error FROM headers WHERE error != ''")]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
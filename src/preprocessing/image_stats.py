@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+import nibabel as nib
+import numpy as np
+
+STATS_SUFFIX = ".stats.json"
+STATS_VERSION = 1
+PERCENTILES = (0.5, 2, 98, 99.5)
+HISTOGRAM_BINS = 256
+
+def stats_path(image_path: Path) -> Path:
+    """``scan.nii.gz`` -> ``scan.nii.gz.stats.json``."""
+    image_path = Path(image_path)
+    return image_path.with_name(image_path.name + STATS_SUFFIX)
+
+def compute_stats(data: np.ndarray, spacing: Optional[list] = None) -> dict:
+    """Percentiles, rango, histograma, dtype, forma y espaciado de ``data``.
+    Los valores son los que ve el visor (NIfTI escalado a float32)."""
+    values = np.asarray(data)
+    finite = values if values.dtype.kind not in "fc" or np.isfinite(values).all() else values[np.isfinite(values)]
+    if finite.size == 0:
+        finite = np.zeros(1, dtype=np.float32)
+    low, high = float(finite.min()), float(finite.max())
+    counts, edges = np.histogram(finite, bins=HISTOGRAM_BINS, range=(low, high if high > low else low + 1))
+    return {
+        "version": STATS_VERSION,
+        "dtype": str(values.dtype),
+        "shape": list(values.shape),
+        "voxel_spacing": [float(s) for s in spacing] if spacing is not None else None,
+        "min": low,
+        "max": high,
+        "mean": float(finite.mean()),
+        "percentiles": {str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(finite, PERCENTILES))},
+        "histogram": {"edges": [float(e) for e in edges], "counts": counts.tolist()},
+    }
+
+def is_fresh(image_path: Path) -> bool:
+    """El sidecar existe y corresponde al archivo actual (mismo tamaño)."""
+    try:
+        stats = json.loads(stats_path(image_path).read_text())
+        return stats.get("version") == STATS_VERSION and stats.get("size") == Path(image_path).stat().st_size
+    except (OSError, ValueError):
+        return False
+
+def write_stats(
+    image_path: Path,
+    data: Optional[np.ndarray] = None,
+    spacing: Optional[list] = None,
+    dtype: Optional[str] = None,
+) -> Optional[dict]:
+    """Escribe el sidecar de ``image_path`` y devuelve las estadísticas. Sin
+    ``data`` se lee el NIfTI. Un fallo aquí no debe tumbar la conversión:
+    devuelve ``None``."""
+    image_path = Path(image_path)
+    try:
+        if data is None:
+            image = nib.load(image_path)
+            data = image.get_fdata(dtype=np.float32)
+            spacing = spacing or image.header.get_zooms()[:3]
+            dtype = dtype or str(image.get_data_dtype())
+        stats = compute_stats(data, spacing)
+        stats["dtype"] = dtype or stats["dtype"]
+        stats["size"] = image_path.stat().st_size
+        stats_path(image_path).write_text(json.dumps(stats))
+        return stats
+    except Exception:
+        return None
@@ -0,0 +1,192 @@
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import nibabel as nib
+import numpy as np
+
+ASSEMBLER_VERSION = "1.0"
+
+_SLICE_TOLERANCE = 1e-3
+_SPACING_TOLERANCE = 0.01
+
+# (sidecar key, DICOM keyword, conversion) following dcm2niix's BIDS names.
+_SIDECAR_FIELDS = (
+    ("Modality", "Modality", str),
+    ("MagneticFieldStrength", "MagneticFieldStrength", float),
+    ("Manufacturer", "Manufacturer", str),
+    ("ManufacturersModelName", "ManufacturerModelName", str),
+    ("InstitutionName", "InstitutionName", str),
+    ("SeriesInstanceUID", "SeriesInstanceUID", str),
+    ("StudyInstanceUID", "StudyInstanceUID", str),
+    ("StudyID", "StudyID", str),
+    ("PatientName", "PatientName", str),
+    ("PatientID", "PatientID", str),
+    ("AccessionNumber", "AccessionNumber", str),
+    ("PatientSex", "PatientSex", str),
+    ("BodyPartExamined", "BodyPartExamined", str),
+    ("SeriesDescription", "SeriesDescription", str),
+    ("ProtocolName", "ProtocolName", str),
+    ("ImageType", "ImageType", list),
+    ("SeriesNumber", "SeriesNumber", int),
+    ("SliceThickness", "SliceThickness", float),
+    ("SpacingBetweenSlices", "SpacingBetweenSlices", float),
+    ("EchoTime", "EchoTime", lambda v: float(v) / 1000),
+    ("RepetitionTime", "RepetitionTime", lambda v: float(v) / 1000),
+    ("InversionTime", "InversionTime", lambda v: float(v) / 1000),
+    ("FlipAngle", "FlipAngle", float),
+    ("ConvolutionKernel", "ConvolutionKernel", str),
+    ("KVP", "KVP", float),
+)
+
+class UnsupportedSeries(ValueError):
+    """The series needs dcm2niix (mosaic, multi-echo, multi-frame, 4D, ...)."""
+
+@dataclass
+class AssembledVolume:
+    data: np.ndarray
+    affine: np.ndarray
+    sidecar: dict
+    name: str
+    slice_count: int = 0
+
+    @property
+    def voxel_spacing(self) -> list:
+        return np.linalg.norm(self.affine[:3, :3], axis=0).tolist()
+
+def _clean_name(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_\-]", "_", value.strip()) or "series"
+
+def _geometry(ds):
+    try:
+        orientation = np.array([float(v) for v in ds.ImageOrientationPatient])
+        position = np.array([float(v) for v in ds.ImagePositionPatient])
+        spacing = [float(v) for v in ds.PixelSpacing]
+    except (AttributeError, TypeError, ValueError):
+        raise UnsupportedSeries("missing ImagePositionPatient/ImageOrientationPatient/PixelSpacing")
+    return orientation, position, spacing
+
+def _check_supported(datasets: list) -> None:
+    first = datasets[0]
+    if "MOSAIC" in [str(v).upper() for v in first.get("ImageType", [])]:
+        raise UnsupportedSeries("mosaic")
+    if int(first.get("SamplesPerPixel", 1)) != 1:
+        raise UnsupportedSeries("color data")
+    for ds in datasets:
+        if int(ds.get("NumberOfFrames", 1) or 1) > 1:
+            raise UnsupportedSeries("multi-frame")
+        if (ds.get("Rows"), ds.get("Columns")) != (first.get("Rows"), first.get("Columns")):
+            raise UnsupportedSeries("inconsistent matrix size")
+    echo_times = {str(ds.get("EchoTime", "")) for ds in datasets}
+    echo_numbers = {str(ds.get("EchoNumbers", "")) for ds in datasets}
+    if len(echo_times) > 1 or len(echo_numbers) > 1:
+        raise UnsupportedSeries("multi-echo")
+
+def _rescaled(ds) -> np.ndarray:
+    """Pixel data with RescaleSlope/Intercept applied. Integer rescales keep
+    an integer dtype (int16 when it fits); anything else becomes float32."""
+    pixels = ds.pixel_array
+    slope = float(ds.get("RescaleSlope", 1) or 1)
+    inter = float(ds.get("RescaleIntercept", 0) or 0)
+    if slope == 1.0 and inter == 0.0:
+        return pixels
+    if slope.is_integer() and inter.is_integer():
+        values = pixels.astype(np.int64) * int(slope) + int(inter)
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if values.min() >= info.min and values.max() <= info.max:
+                return values.astype(dtype)
+    return pixels.astype(np.float32) * slope + inter
+
+def _sidecar(ds, spacing: float) -> dict:
+    sidecar = {}
+    for key, keyword, convert in _SIDECAR_FIELDS:
+        value = ds.get(keyword)
+        if value is None or value == "":
+            continue
+        try:
+            sidecar[key] = convert(value)
+        except (TypeError, ValueError):
+            continue
+    birth = str(ds.get("PatientBirthDate", ""))
+    if len(birth) == 8:
+        sidecar["PatientBirthDate"] = f"{birth[:4]}-{birth[4:6]}-{birth[6:]}"
+    sidecar.setdefault("SpacingBetweenSlices", round(spacing, 6))
+    sidecar["ImageOrientationPatientDICOM"] = [float(v) for v in ds.ImageOrientationPatient]
+    sidecar["ConversionSoftware"] = "nifti_assembler"
+    sidecar["ConversionSoftwareVersion"] = ASSEMBLER_VERSION
+    return sidecar
+
+def assemble_series(datasets: Iterable) -> AssembledVolume:
+    """Builds one volume from the datasets of a single series.
+
+    Slices are sorted along the normal of ImageOrientationPatient and the
+    voxel layout and affine follow dcm2niix (columns on i, rows flipped on
+    j so the image is not upside down, RAS+). Raises
+    :class:`UnsupportedSeries` for anything that is not a plain stack of
+    equally spaced, single-frame, single-echo slices.
+    """
+    datasets = list(datasets)
+    if not datasets:
+        raise UnsupportedSeries("empty series")
+    _check_supported(datasets)
+
+    orientation, _, spacing = _geometry(datasets[0])
+    row_cos, col_cos = orientation[:3], orientation[3:]
+    normal = np.cross(row_cos, col_cos)
+    slices = []
+    for ds in datasets:
+        ds_orientation, position, _ = _geometry(ds)
+        if not np.allclose(ds_orientation, orientation, atol=1e-4):
+            raise UnsupportedSeries("mixed orientations")
+        slices.append((float(position @ normal), position, ds))
+    slices.sort(key=lambda s: s[0])
+
+    distances = np.diff([s[0] for s in slices])
+    if len(distances) and np.min(np.abs(distances)) < _SLICE_TOLERANCE:
+        raise UnsupportedSeries("repeated slice positions (4D or multi-volume series)")
+    if len(distances) and np.ptp(distances) > _SPACING_TOLERANCE * max(abs(np.mean(distances)), 1.0):
+        raise UnsupportedSeries("non-uniform slice spacing")
+
+    # (slice, row, col) -> (col, row, slice), then flip rows like dcm2niix.
+    data = np.stack([_rescaled(s[2]) for s in slices]).transpose(2, 1, 0)[:, ::-1, :]
+
+    first, last = slices[0][1], slices[-1][1]
+    rows = data.shape[1]
+    if len(slices) > 1:
+        step = (last - first) / (len(slices) - 1)
+    else:
+        step = normal * float(slices[0][2].get("SliceThickness", 1) or 1)
+    lps = np.eye(4)
+    lps[:3, 0] = row_cos * spacing[1]
+    lps[:3, 1] = -col_cos * spacing[0]
+    lps[:3, 2] = step
+    lps[:3, 3] = first + (rows - 1) * col_cos * spacing[0]
+    affine = np.diag([-1.0, -1.0, 1.0, 1.0]) @ lps
+
+    ds = slices[0][2]
+    protocol = str(ds.get("ProtocolName", "") or ds.get("SeriesDescription", "") or "")
+    name = f"{_clean_name(protocol)}_{ds.get('SeriesNumber', '')}"
+    return AssembledVolume(
+        data=data,
+        affine=affine,
+        sidecar=_sidecar(ds, float(np.linalg.norm(step))),
+        name=name,
+        slice_count=len(slices),
+    )
+
+def write_volume(volume: AssembledVolume, output_p: Path, patient_id: str, name: Optional[str] = None) -> Path:
+    """Writes ``<patient_id>_<protocol>_<series>.nii.gz`` and its JSON sidecar
+    (the names dcm2niix produces with ``-f <id>_%p_%s``)."""
+    output_p.mkdir(parents=True, exist_ok=True)
+    stem = name or f"{patient_id}_{volume.name}"
+    image = nib.Nifti1Image(volume.data, volume.affine)
+    image.header.set_xyzt_units("mm", "sec")
+    image.set_qform(volume.affine, code=1)
+    image.set_sform(volume.affine, code=1)
+    nifti_path = output_p / f"{stem}.nii.gz"
+    nib.save(image, nifti_path)
+    (output_p / f"{stem}.json").write_text(json.dumps(volume.sidecar, indent=1))
+    return nifti_path
@@ -1,22 +1,271 @@
+import multiprocessing
 import subprocess
 import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
 import os
+import signal
+import tempfile
 import pydicom
+from pydicom.filereader import read_file_meta_info
+from pydicom.uid import (
+    DeflatedExplicitVRLittleEndian,
+    ExplicitVRBigEndian,
+    ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian,
+    JPEGBaseline8Bit,
+    JPEGLossless,
+    JPEGLosslessSV1,
+    RLELossless,
+)
 import numpy as np
+import nibabel as nib
 import imageio
+import tifffile
 from dotenv import load_dotenv
 
+from file_discovery import DICOM_SUFFIX, DiscoveryCache, iter_files
+from conversion_manifest import ConversionManifest, input_fingerprint, outputs_by_series
+from dicom_triage import resolve_triage_workers
+from image_stats import is_fresh, stats_path, write_stats
+from nifti_assembler import ASSEMBLER_VERSION, assemble_series, write_volume
+from zarr_store import resolve_zarr_mode, write_zarr, zarr_path
+
 load_dotenv()
 
+# Bump when a change here alters what a conversion writes, so incremental
+# runs redo patients converted by the previous version.
+CONVERTER_VERSION = "1"
+
+_POLL_SECONDS = 0.2
+_TERMINATE_GRACE = 5
+
+# Transfer syntaxes every dcm2niix build decodes by itself; anything else is
+# decompressed with pydicom before conversion.
+DCM2NIIX_NATIVE_SYNTAXES = frozenset({
+    ImplicitVRLittleEndian,
+    ExplicitVRLittleEndian,
+    ExplicitVRBigEndian,
+    DeflatedExplicitVRLittleEndian,
+    JPEGBaseline8Bit,
+    JPEGLossless,
+    JPEGLosslessSV1,
+    RLELossless,
+})
+
+def resolve_jobs(max_jobs: int = None) -> int:
+    """Argument, then DCM2NIIX_JOBS, then 1. 0 means one job per CPU core.
+    An unparsable DCM2NIIX_JOBS falls back to 1."""
+    if max_jobs is None:
+        try:
+            max_jobs = int(os.getenv("DCM2NIIX_JOBS", "1"))
+        except ValueError:
+            max_jobs = 1
+    return max_jobs if max_jobs > 0 else (os.cpu_count() or 1)
+
+def resolve_timeout(timeout: float = None) -> float:
+    """Argument, then DCM2NIIX_TIMEOUT (seconds). None or 0 disables it,
+    and so does an unparsable DCM2NIIX_TIMEOUT."""
+    if timeout is None:
+        try:
+            timeout = float(os.getenv("DCM2NIIX_TIMEOUT", "0"))
+        except ValueError:
+            timeout = 0
+    return timeout or None
+
+ENGINES = ("dcm2niix", "native")
+
+def resolve_engine(engine: str = None) -> str:
+    """Argument, then NIFTI_ENGINE, then ``dcm2niix``. ``native`` assembles
+    plain series in-process and leaves the rest to dcm2niix."""
+    engine = (engine or os.getenv("NIFTI_ENGINE") or "dcm2niix").strip().lower()
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown NIfTI engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    return engine
+
+# 2D mammography export formats. TIFF and NPY decode without inflating when
+# written uncompressed; the level is the zlib level (PNG and TIFF only).
+MAMMO_FORMATS = {"png": ".png", "tiff": ".tiff", "npy": ".npy"}
+
+def resolve_mammo_format(mammo_format: str = None) -> tuple:
+    """Argument, then MAMMO_FORMAT (``png``, ``png:1``, ``tiff``, ``tiff:6``,
+    ``npy``), then ``png``. Returns ``(format, level)``; a missing level
+    means the encoder default for PNG and no compression for TIFF."""
+    value = (mammo_format or os.getenv("MAMMO_FORMAT") or "png").strip().lower()
+    fmt, _, level = value.partition(":")
+    if fmt not in MAMMO_FORMATS:
+        raise ValueError(f"Unknown mammography format {fmt!r}; expected one of {', '.join(MAMMO_FORMATS)}")
+    level = int(level) if level else None
+    if level is not None and not 0 <= level <= 9:
+        raise ValueError(f"Compression level must be between 0 and 9, got {level}")
+    return fmt, level
+
+def resolve_mammo_workers(workers: int = None) -> int:
+    """Argument, then MAMMO_WORKERS, then 1. 0 means one thread per CPU core.
+    An unparsable MAMMO_WORKERS falls back to 1."""
+    if workers is None:
+        try:
+            workers = int(os.getenv("MAMMO_WORKERS", "1"))
+        except ValueError:
+            workers = 1
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def write_mammo_image(pixels: np.ndarray, path: Path, fmt: str = "png", level: int = None) -> Path:
+    """Writes ``pixels`` to ``path`` (extension included) in ``fmt``."""
+    if fmt == "png":
+        imageio.imwrite(path, pixels, **({"compress_level": level} if level is not None else {}))
+    elif fmt == "tiff":
+        tifffile.imwrite(path, pixels, **({"compression": "zlib", "compressionargs": {"level": level}} if level else {}))
+    else:
+        np.save(path, pixels)
+    return path
+
+def unique_output_name(name: str, taken: set) -> str:
+    """dcm2niix only disambiguates names within one run; reuse its suffix
+    (``a``, ``b``, ...) when several runs write into the same folder."""
+    stem, dot, suffix = name.partition(".")
+    candidate, k = name, 0
+    while candidate in taken:
+        candidate = f"{stem}{chr(ord('a') + k % 26) * (k // 26 + 1)}{dot}{suffix}"
+        k += 1
+    taken.add(candidate)
+    return candidate
+
+def resolve_scratch_dir(scratch_dir: str = None) -> Path:
+    """Argument, then DICOM_SCRATCH_DIR, then the system temp directory."""
+    path = Path(scratch_dir or os.getenv("DICOM_SCRATCH_DIR") or tempfile.gettempdir())
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _decompress_file(src: Path, dst: Path) -> bool:
+    try:
+        dataset = pydicom.dcmread(src)
+        if dataset.file_meta.TransferSyntaxUID.is_compressed:
+            dataset.decompress()
+        dataset.save_as(dst)
+        return True
+    except Exception:
+        return False
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.symlink(src.resolve(), dst)
+    except OSError:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+@dataclass
+class SeriesFiles:
+    files: list
+    needs_decompression: bool = False
+    uid: str = ""
+    instance_uids: list = field(default_factory=list)
+
+@dataclass
+class Dcm2niixResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    cancelled: bool = False
+
+class Dcm2niixPool:
+    """Bounded set of concurrent dcm2niix processes.
+
+    At most ``max_jobs`` processes run at once, whichever thread submits
+    them. Each job captures its own stdout/stderr, is killed after
+    ``timeout`` seconds, and is terminated as soon as :meth:`cancel` is
+    called or ``should_stop`` returns True.
+    """
+
+    def __init__(self, max_jobs: int = 1, timeout: float = None, should_stop=None):
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.should_stop = should_stop or (lambda: False)
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or self.should_stop()
+
+    @staticmethod
+    def _signal(proc: subprocess.Popen, sig) -> None:
+        """Signals the whole process group on POSIX so no child keeps the pipes open."""
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, sig)
+            else:
+                proc.terminate()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def run(self, command: list) -> Dcm2niixResult:
+        with self._slots:
+            if self.cancelled():
+                return Dcm2niixResult(-1, "", "dcm2niix cancelled", cancelled=True)
+            proc = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                start_new_session=os.name == "posix",
+            )
+            deadline = time.monotonic() + self.timeout if self.timeout else None
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(timeout=_POLL_SECONDS)
+                    return Dcm2niixResult(proc.returncode, stdout, stderr)
+                except subprocess.TimeoutExpired:
+                    cancelled = self.cancelled()
+                    timed_out = not cancelled and deadline is not None and time.monotonic() > deadline
+                    if cancelled or timed_out:
+                        break
+            self._signal(proc, signal.SIGTERM)
+            try:
+                stdout, stderr = proc.communicate(timeout=_TERMINATE_GRACE)
+            except subprocess.TimeoutExpired:
+                self._signal(proc, getattr(signal, "SIGKILL", signal.SIGTERM))
+                stdout, stderr = proc.communicate()
+            reason = "dcm2niix cancelled" if cancelled else f"dcm2niix timed out after {self.timeout:g}s"
+            return Dcm2niixResult(proc.returncode, stdout, f"{stderr}\n{reason}".strip(), timed_out, cancelled)
+
 class SmartMedicalConverter:
-    def __init__(self, input_dir: str):
+    def __init__(
+        self,
+        input_dir: str,
+        output_dir: str = None,
+        max_jobs: int = None,
+        timeout: float = None,
+        should_stop=None,
+        scratch_dir: str = None,
+        engine: str = None,
+        mammo_format: str = None,
+        mammo_workers: int = None,
+        zarr_mode: str = None,
+    ):
         self.input_path = Path(input_dir)
-        self.output_path = self.input_path.parent / "PROCESSED_DATA"
+        self.output_path = Path(output_dir) if output_dir else self.input_path.parent / "PROCESSED_DATA"
         self.dcm2niix_bin = shutil.which('dcm2niix')
-        self.temp_dir = self.output_path / "temp_repair"
+        if scratch_dir or os.getenv("DICOM_SCRATCH_DIR"):
+            self.temp_dir = resolve_scratch_dir(scratch_dir) / f"temp_repair_{os.getpid()}"
+        else:
+            self.temp_dir = self.output_path / "temp_repair"
+        self.pool = Dcm2niixPool(resolve_jobs(max_jobs), resolve_timeout(timeout), should_stop)
+        self.engine = resolve_engine(engine)
+        self.mammo_format = resolve_mammo_format(mammo_format)
+        self.mammo_workers = resolve_mammo_workers(mammo_workers)
+        self.zarr_mode = resolve_zarr_mode(zarr_mode)
+        self._dcm2niix_version = None
+        self.discovery = DiscoveryCache()
+        self._decompressor = None
+        self._decompressor_lock = threading.Lock()
         
-        if not self.dcm2niix_bin:
+        if not self.dcm2niix_bin and self.engine != "native":
             raise RuntimeError("dcm2niix not found. Follow instructions at Readme")
 
     def is_anonymized_patient(self, folder: Path) -> bool:
@@ -29,8 +278,7 @@ class SmartMedicalConverter:
             if pattern in folder.name.upper():
                 return False
         
-        dicom_files = [f for f in folder.rglob("*.dcm") if not f.name.startswith('.')]
-        return len(dicom_files) > 0
+        return self.discovery.first(folder) is not None
 
     def get_patient_folders(self) -> list:
         patient_folders = []
@@ -42,7 +290,7 @@ class SmartMedicalConverter:
         return sorted(patient_folders)
 
     def detect_modality(self, patient_folder: Path) -> str:
-        dicom_files = [f for f in patient_folder.rglob("*.dcm") if not f.name.startswith('.')]
+        dicom_files = self.patient_files(patient_folder)
         if not dicom_files:
             return "UNKNOWN"
         try:
@@ -55,37 +303,91 @@ class SmartMedicalConverter:
         volumetric_modalities = ['MR', 'CT', 'PT', 'NM', 'US']
         return modality in volumetric_modalities
 
-    def repair_dicom_compression(self, patient_folder: Path):
-        repair_path = self.temp_dir / patient_folder.name
-        repair_path.mkdir(parents=True, exist_ok=True)
-        
-        valid_dicom_files = [f for f in patient_folder.rglob("*.dcm") if not f.name.startswith('.')]
-        
-        for dcm_file in valid_dicom_files:
+    def dicom_files(self, folder: Path) -> list:
+        return sorted(iter_files(folder, DICOM_SUFFIX))
+
+    def patient_files(self, patient_folder: Path) -> list:
+        """``dicom_files`` of a patient folder, listed once per converter and
+        shared by modality detection, fingerprinting and conversion. Working
+        folders (repair, per-series links) use :meth:`dicom_files`."""
+        return self.discovery.files(patient_folder)
+
+    def repair_dicom_compression(self, patient_folder: Path, repair_root: Path = None):
+        repair_path = (repair_root or self.temp_dir) / patient_folder.name
+        self.decompress_files(self.dicom_files(patient_folder), repair_path)
+        return repair_path
+
+    def _decompress_executor(self) -> ProcessPoolExecutor:
+        """One process pool per converter, shared by every patient and series
+        thread, so decompression never runs more than ``pool.max_jobs``
+        processes. Spawned rather than forked: callers run inside Qt threads."""
+        with self._decompressor_lock:
+            if self._decompressor is None:
+                self._decompressor = ProcessPoolExecutor(
+                    max_workers=self.pool.max_jobs, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._decompressor
+
+    def decompress_files(self, files: list, dest: Path) -> int:
+        """Writes decompressed copies of ``files`` into ``dest`` through the
+        converter's shared process pool. Returns how many succeeded."""
+        dest.mkdir(parents=True, exist_ok=True)
+        targets = [dest / f"{i:05d}_{f.name}" for i, f in enumerate(files)]
+        if self.pool.max_jobs <= 1 or len(files) <= 1:
+            return sum(_decompress_file(f, t) for f, t in zip(files, targets))
+        return sum(self._decompress_executor().map(_decompress_file, files, targets, chunksize=8))
+
+    def close(self) -> None:
+        """Shuts down the decompression processes, if any were started."""
+        with self._decompressor_lock:
+            executor, self._decompressor = self._decompressor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def needs_decompression(self, files: list) -> bool:
+        """Header-only check: does any file use a syntax dcm2niix cannot decode?"""
+        for f in files:
             try:
-                dataset = pydicom.dcmread(dcm_file)
-                dataset.decompress()
-                dataset.save_as(repair_path / dcm_file.name)
-            except:
+                syntax = read_file_meta_info(f).get("TransferSyntaxUID")
+            except Exception:
                 continue
-        return repair_path
+            if syntax is not None and syntax not in DCM2NIIX_NATIVE_SYNTAXES:
+                return True
+        return False
 
     def process_mammo_2d(self, patient_folder: Path, output_folder: Path):
-        valid_dicom_files = [f for f in patient_folder.rglob("*.dcm") if not f.name.startswith('.')]
-        converted_count = 0
-        
-        for idx, dcm_path in enumerate(valid_dicom_files):
+        return self.export_mammograms(self.patient_files(patient_folder), output_folder)
+
+    def export_mammograms(self, files: list, output_folder: Path, read=pydicom.dcmread, should_stop=None) -> list:
+        """Decodes and writes ``files`` with ``mammo_workers`` threads (pixel
+        decoding and zlib release the GIL). ``read`` turns a path into the
+        dataset to export. Returns the images written."""
+        should_stop = should_stop or (lambda: False)
+
+        def export(idx, dcm_path):
+            if should_stop():
+                return None
             try:
-                dataset = pydicom.dcmread(dcm_path)
-                pixels = dataset.pixel_array.astype(np.uint16)
-                view = dataset.get('ViewPosition', f'view_{idx}')
-                laterality = dataset.get('ImageLaterality', '')
-                filename = f"{laterality}_{view}_{idx}.png"
-                imageio.imwrite(output_folder / filename, pixels)
-                converted_count += 1
-            except:
-                continue
-        return converted_count
+                return self.save_mammo_image(read(dcm_path), output_folder, idx)
+            except Exception:
+                return None
+
+        if self.mammo_workers <= 1 or len(files) <= 1:
+            written = [export(idx, f) for idx, f in enumerate(files)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.mammo_workers, len(files))) as executor:
+                written = list(executor.map(export, range(len(files)), files))
+        return [path for path in written if path is not None]
+
+    def save_mammo_image(self, dataset, output_folder: Path, idx: int) -> Path:
+        pixels = dataset.pixel_array.astype(np.uint16)
+        view = dataset.get('ViewPosition', f'view_{idx}')
+        laterality = dataset.get('ImageLaterality', '')
+        fmt, level = self.mammo_format
+        output_file = output_folder / f"{laterality}_{view}_{idx}{MAMMO_FORMATS[fmt]}"
+        write_mammo_image(pixels, output_file, fmt, level)
+        write_stats(output_file, pixels, dataset.get('ImagerPixelSpacing') or dataset.get('PixelSpacing'))
+        return output_file
 
     def _run_dcm2niix(self, input_p: Path, output_p: Path, patient_id: str):
         command = [
@@ -94,43 +396,312 @@ class SmartMedicalConverter:
             "-m", "y", "-p", "n", "-x", "n", "-v", "0", str(input_p)
         ]
         
-        result = subprocess.run(command, capture_output=True, text=True, check=False)
+        result = self.pool.run(command)
         
         nifti_files = [f for f in output_p.glob("*.nii.gz") if not f.name.startswith('.')]
-        return nifti_files, result.stderr
+        return nifti_files, result.stderr or (result.stdout if result.returncode else "")
+
+    def convert_volume(
+        self,
+        input_p: Path,
+        output_p: Path,
+        patient_id: str,
+        repair_root: Path = None,
+        needs_decompression: bool = None,
+        engine: str = None,
+    ):
+        """Runs dcm2niix, or the native assembler when ``engine`` (default
+        ``self.engine``) is ``native``. Inputs whose transfer syntax dcm2niix
+        cannot decode (checked from the headers unless ``needs_decompression``
+        is given) are decompressed first; an unexpected decode error still
+        triggers a retry on a decompressed copy."""
+        if (engine or self.engine) == "native":
+            return self._convert_native(input_p, output_p, patient_id)
+        if needs_decompression is None:
+            needs_decompression = self.needs_decompression(self.dicom_files(input_p))
+        if needs_decompression:
+            repaired_dicom_path = self.repair_dicom_compression(input_p, repair_root)
+            try:
+                return self._run_dcm2niix(repaired_dicom_path, output_p, patient_id)
+            finally:
+                shutil.rmtree(repaired_dicom_path, ignore_errors=True)
+
+        nifti_files, error_message = self._run_dcm2niix(input_p, output_p, patient_id)
+
+        is_compression_error = "JPEG" in error_message or "Unable to decode" in error_message
+
+        if is_compression_error and not self.pool.cancelled():
+            for file_path in output_p.iterdir():
+                if file_path.is_file() and file_path.suffix in ('.gz', '.json', '.nii', '.bval', '.bvec'):
+                    file_path.unlink(missing_ok=True)
 
-    
-    def convert_patient(self, patient_folder: Path) -> tuple:
+            repaired_dicom_path = self.repair_dicom_compression(input_p, repair_root)
+            nifti_files, error_message = self._run_dcm2niix(repaired_dicom_path, output_p, patient_id)
+            shutil.rmtree(repaired_dicom_path, ignore_errors=True)
+
+        return nifti_files, error_message
+
+    def _convert_native(self, input_p: Path, output_p: Path, patient_id: str):
+        return self._convert_native_groups(self.group_series(self.dicom_files(input_p)), output_p, patient_id)
+
+    def _convert_native_groups(self, groups: list, output_p: Path, patient_id: str, taken: set = None):
+        """Assembles each series in-process. Series the assembler rejects
+        (mosaics, multi-echo, 4D, undecodable pixels, ...) go to dcm2niix."""
+        output_p.mkdir(parents=True, exist_ok=True)
+        nifti_files, leftovers, reasons = [], [], []
+        taken = set() if taken is None else taken
+        for group in groups:
+            if self.pool.cancelled():
+                return nifti_files, "conversion cancelled"
+            try:
+                volume = assemble_series(pydicom.dcmread(f) for f in group.files)
+            except Exception as e:
+                leftovers.append(group)
+                reasons.append(str(e))
+                continue
+            name = unique_output_name(f"{patient_id}_{volume.name}.nii.gz", taken)[:-len(".nii.gz")]
+            taken.add(f"{name}.json")
+            nifti_path = write_volume(volume, output_p, patient_id, name=name)
+            nifti_files.append(self.finish_volume(nifti_path, volume.data, volume.voxel_spacing))
+        if not leftovers:
+            return nifti_files, ""
+        if not self.dcm2niix_bin:
+            return nifti_files, f"dcm2niix not found for {len(leftovers)} series: {'; '.join(reasons)}"
+        extra, error_message = self.convert_series_parallel(leftovers, output_p, patient_id, taken)
+        return nifti_files + self.finish_volumes(extra), error_message
+
+    def finish_volume(self, nifti_path: Path, data: np.ndarray = None, spacing: list = None) -> Path:
+        """Writes the stats sidecar of a final NIfTI and, with NIFTI_ZARR, its
+        Zarr copy (removing the NIfTI in ``only`` mode). ``data`` avoids
+        re-reading a volume still in memory. Returns the output to report;
+        calling it again on a finished volume is a no-op."""
+        nifti_path = Path(nifti_path)
+        zarr_target = zarr_path(nifti_path)
+        if not nifti_path.exists():
+            return zarr_target if zarr_target.exists() else nifti_path
+        if data is None and is_fresh(nifti_path) and (self.zarr_mode == "off" or zarr_target.exists()):
+            return nifti_path
+        try:
+            image = nib.load(nifti_path)
+            dtype = image.get_data_dtype()
+            if data is None and dtype.names is None:
+                data = np.asanyarray(image.dataobj)
+                data = data.astype(np.float32) if data.dtype == np.float64 else data
+            stats = write_stats(nifti_path, data, spacing or image.header.get_zooms()[:3], str(dtype))
+            if self.zarr_mode == "off" or data is None:
+                return nifti_path
+            write_zarr(nifti_path, data, image.affine, stats)
+        except Exception:
+            return nifti_path
+        if self.zarr_mode == "only":
+            nifti_path.unlink(missing_ok=True)
+            stats_path(nifti_path).unlink(missing_ok=True)
+            return zarr_target
+        return nifti_path
+
+    def finish_volumes(self, nifti_files: list) -> list:
+        return [self.finish_volume(f) for f in nifti_files]
+
+    def group_series(self, files: list, triage=None) -> list:
+        """Groups files into :class:`SeriesFiles` by SeriesInstanceUID, reading
+        headers only, and flags the series dcm2niix cannot decode. Files with
+        a record in ``triage`` (a ``TriageManifest``) are not opened again;
+        the rest are read with ``DICOM_TRIAGE_WORKERS`` threads."""
+        headers = {}
+        missing = []
+        for f in files:
+            record = triage.get(f) if triage is not None else None
+            if record is not None and record.series_uid:
+                headers[f] = (record.series_uid, record.instance_uid, record.transfer_syntax or None)
+            else:
+                missing.append(f)
+        workers = min(resolve_triage_workers(), len(missing))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                headers.update(zip(missing, executor.map(self._series_header, missing)))
+        else:
+            headers.update((f, self._series_header(f)) for f in missing)
+
+        series = {}
+        for f in files:
+            key, instance_uid, syntax = headers[f]
+            group = series.setdefault(key, SeriesFiles([], uid=key))
+            group.files.append(f)
+            group.instance_uids.append(instance_uid)
+            if syntax is not None and syntax not in DCM2NIIX_NATIVE_SYNTAXES:
+                group.needs_decompression = True
+        return list(series.values())
+
+    @staticmethod
+    def _series_header(f: Path) -> tuple:
+        """``(SeriesInstanceUID, SOPInstanceUID, TransferSyntaxUID)`` of ``f``."""
+        try:
+            ds = pydicom.dcmread(
+                f, stop_before_pixels=True, specific_tags=["SeriesInstanceUID", "SOPInstanceUID"]
+            )
+        except Exception:
+            return str(f.parent), "", None
+        syntax = ds.file_meta.get("TransferSyntaxUID") if hasattr(ds, "file_meta") else None
+        return str(ds.get("SeriesInstanceUID", f.parent)), str(ds.get("SOPInstanceUID", "")), syntax
+
+    def convert_series_parallel(self, groups: list, output_folder: Path, patient_id: str, taken: set = None):
+        """Runs one dcm2niix job per series through the pool. Each series is
+        linked into temp_dir, or decompressed there when it needs it. Output
+        names already in ``taken`` are not reused."""
+        work = self.temp_dir / f"{patient_id}_series"
+        shutil.rmtree(work, ignore_errors=True)
+
+        def convert(k, group):
+            series_dir = work / f"s{k}" / "in"
+            out_dir = work / f"s{k}" / "out"
+            out_dir.mkdir(parents=True, exist_ok=True)
+            if group.needs_decompression:
+                self.decompress_files(group.files, series_dir)
+            else:
+                series_dir.mkdir(parents=True, exist_ok=True)
+                for i, f in enumerate(group.files):
+                    _link_or_copy(f, series_dir / f"{i:05d}_{f.name}")
+            return self.convert_volume(
+                series_dir, out_dir, patient_id, repair_root=work / f"s{k}" / "repair",
+                needs_decompression=False, engine="dcm2niix",
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(groups), self.pool.max_jobs)) as executor:
+                results = list(executor.map(convert, range(len(groups)), groups))
+            nifti_files, error_message = [], ""
+            taken = set() if taken is None else taken
+            for k, (series_nifti, series_error) in enumerate(results):
+                error_message = error_message or series_error
+                renamed = {}
+                for produced in sorted((work / f"s{k}" / "out").iterdir()):
+                    target = output_folder / unique_output_name(produced.name, taken)
+                    shutil.move(str(produced), str(target))
+                    renamed[produced.name] = target
+                nifti_files.extend(renamed[f.name] for f in series_nifti if f.name in renamed)
+            return nifti_files, error_message
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    @property
+    def dcm2niix_version(self) -> str:
+        if self._dcm2niix_version is None:
+            self._dcm2niix_version = ""
+            if self.dcm2niix_bin:
+                try:
+                    result = subprocess.run([self.dcm2niix_bin, "--version"], capture_output=True, text=True, timeout=30)
+                    lines = result.stdout.strip().splitlines()
+                    self._dcm2niix_version = lines[-1] if lines else ""
+                except (OSError, subprocess.SubprocessError):
+                    pass
+        return self._dcm2niix_version
+
+    def conversion_settings(self, kind: str) -> dict:
+        """Everything besides the inputs that changes what ``kind`` (``2D``
+        or ``3D``) conversions write; part of the incremental fingerprint."""
+        if kind == "2D":
+            return {"converter": CONVERTER_VERSION, "mammo_format": list(self.mammo_format)}
+        settings = {"converter": CONVERTER_VERSION, "engine": self.engine, "dcm2niix": self.dcm2niix_version,
+                    "zarr": self.zarr_mode}
+        if self.engine == "native":
+            settings["assembler"] = ASSEMBLER_VERSION
+        return settings
+
+    def _convert_groups(self, groups: list, output_folder: Path, patient_id: str, taken: set):
+        if self.engine == "native":
+            return self._convert_native_groups(groups, output_folder, patient_id, taken)
+        nifti_files, error_message = self.convert_series_parallel(groups, output_folder, patient_id, taken)
+        return self.finish_volumes(nifti_files), error_message
+
+    def convert_patient(self, patient_folder: Path, triage=None) -> tuple:
+        """Converts one patient, skipping the series whose inputs and settings
+        match ``.conversion.json`` in its output folder (see
+        :class:`ConversionManifest`). Only new or changed series are redone.
+        ``triage`` (a ``TriageManifest`` of ``patient_folder``) supplies the
+        file list, modality and header fields instead of reading them again."""
         patient_id = patient_folder.name
-        modality = self.detect_modality(patient_folder)
+        if triage is None:
+            files = self.patient_files(patient_folder)
+            modality = self.detect_modality(patient_folder)
+        else:
+            files, modality = triage.files(), triage.modality()
         output_folder = self.output_path / patient_id
         output_folder.mkdir(parents=True, exist_ok=True)
+        manifest = ConversionManifest(output_folder)
 
         if modality == 'DX':
-            count = self.process_mammo_2d(patient_folder, output_folder)
-            return (True, modality, f"2D processed: {count} PNGs")
+            groups = self.group_series(files, triage)
+            files = [f for g in groups for f in g.files]
+            instance_uids = [uid for g in groups for uid in g.instance_uids]
+            fingerprint = input_fingerprint(files, instance_uids, self.conversion_settings("2D"))
+            if manifest.is_current("2D", fingerprint):
+                return (True, modality, f"Up to date: {len(manifest.entries['2D']['outputs'])} images skipped")
+            manifest.discard("2D")
+            written = self.export_mammograms(files, output_folder)
+            if written:
+                manifest.record("2D", fingerprint, written)
+            manifest.save()
+            return (True, modality, f"2D processed: {len(written)} {self.mammo_format[0].upper()}s")
 
         if self.is_volumetric_modality(modality):
-            nifti_files, error_message = self._run_dcm2niix(patient_folder, output_folder, patient_id)
-            
-            is_compression_error = "JPEG" in error_message or "Unable to decode" in error_message
-            
-            if is_compression_error:
-                for file_path in output_folder.iterdir():
-                    if file_path.is_file() and file_path.suffix in ('.gz', '.json', '.nii', '.bval', '.bvec'):
-                        file_path.unlink(missing_ok=True)
-                
-                repaired_dicom_path = self.repair_dicom_compression(patient_folder)
-                nifti_files, error_message = self._run_dcm2niix(repaired_dicom_path, output_folder, patient_id)
-                shutil.rmtree(repaired_dicom_path, ignore_errors=True)
-                
+            groups = self.group_series(files, triage)
+            settings = self.conversion_settings("3D")
+            fingerprints = {g.uid: input_fingerprint(g.files, g.instance_uids, settings) for g in groups}
+            pending = [g for g in groups if not manifest.is_current(g.uid, fingerprints[g.uid])]
+            skipped = len(groups) - len(pending)
+            if not pending:
+                return (True, modality, f"Up to date: {skipped} series skipped")
+            for group in pending:
+                manifest.discard(group.uid)
+
+            before = {f.name for f in output_folder.iterdir()}
+            split = len(groups) > 1 and (self.pool.max_jobs > 1 or any(g.needs_decompression for g in groups))
+            if len(pending) == len(groups) and self.engine != "native" and not split:
+                nifti_files, error_message = self.convert_volume(
+                    patient_folder, output_folder, patient_id,
+                    needs_decompression=any(g.needs_decompression for g in groups),
+                )
+                nifti_files = self.finish_volumes(nifti_files)
+            else:
+                nifti_files, error_message = self._convert_groups(pending, output_folder, patient_id, set(before))
+
+            produced = outputs_by_series(output_folder, {f.name for f in output_folder.iterdir()} - before)
+            for group in pending:
+                if produced.get(group.uid):
+                    manifest.record(group.uid, fingerprints[group.uid], produced[group.uid])
+            manifest.save()
+
+            note = f", {skipped} series up to date" if skipped else ""
             if nifti_files:
-                return (True, modality, f"3D processed: {len(nifti_files)} NIfTIs")
+                return (True, modality, f"3D processed: {len(nifti_files)} NIfTIs{note}")
             else:
                 return (False, modality, f"NIfTI error: {error_message[:50]}")
 
         return (False, modality, f"Modality {modality} not supported")
-    
+
+    def convert_patients(self, patient_folders: list, should_stop=None):
+        """Converts patients concurrently, yielding ``(folder, result)`` as they
+        finish. Stopping cancels queued patients and terminates running jobs."""
+        should_stop = should_stop or (lambda: False)
+        pending = list(reversed(patient_folders))
+        with ThreadPoolExecutor(max_workers=self.pool.max_jobs) as executor:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < self.pool.max_jobs and not should_stop():
+                    folder = pending.pop()
+                    in_flight[executor.submit(self.convert_patient, folder)] = folder
+                if not in_flight:
+                    return
+                done, _ = wait(in_flight, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder = in_flight.pop(future)
+                    try:
+                        yield folder, future.result()
+                    except Exception as e:
+                        yield folder, (False, "UNKNOWN", str(e))
+                if should_stop():
+                    pending.clear()
+                    self.pool.cancel()
 
     def run(self) -> None:
         patient_folders = self.get_patient_folders()
@@ -145,24 +716,27 @@ class SmartMedicalConverter:
         print(f"Processing {len(patient_folders)} patients from: {self.input_path}")
         print(f"{'='*70}")
         
-        stats = {'success': 0, 'failed': 0, 'modalities': {}}
+        stats = {'success': 0, 'failed': 0, 'up_to_date': 0, 'modalities': {}}
         
-        for idx, folder in enumerate(patient_folders, 1):
+        for idx, (folder, (success, modality, reason)) in enumerate(self.convert_patients(patient_folders), 1):
             print(f"[{idx}/{len(patient_folders)}] {folder.name}")
-            success, modality, reason = self.convert_patient(folder)
             
             stats['modalities'][modality] = stats['modalities'].get(modality, 0) + 1
-            if success:
+            if success and reason.startswith("Up to date"):
+                stats['up_to_date'] += 1
+                print(f"{reason}")
+            elif success:
                 stats['success'] += 1
                 print(f"{reason}")
             else:
                 stats['failed'] += 1
                 print(f"{reason}")
         
+        self.close()
         shutil.rmtree(self.temp_dir, ignore_errors=True)
 
         print(f"\n{'='*70}")
-        print(f"SUMMARY: {stats['success']} success, {stats['failed']} failed")
+        print(f"SUMMARY: {stats['success']} success, {stats['failed']} failed, {stats['up_to_date']} up to date")
         print(f"{'='*70}\n")
 
 if __name__ == "__main__":
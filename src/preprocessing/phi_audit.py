@@ -0,0 +1,251 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pydicom
+
+from dicom_processor import (
+    PS315_FIXED_VALUES,
+    PS315_MAPPED_UIDS,
+    PS315_REMOVED_KEYWORDS,
+    UID_ROOT,
+    resolve_uid_store_path,
+    resolve_workers,
+    shared_uid_store,
+)
+from file_discovery import DICOM_SUFFIX, iter_files
+
+ERROR = "error"
+WARNING = "warning"
+_CHUNKSIZE = 64
+
+# Atributos de identificación del perfil básico de PS3.15 que
+# ``anonymize_dicom_ps315`` no modifica: si aparecen con valor se avisa.
+PS315_OTHER_KEYWORDS = (
+    "PatientBirthName",
+    "PatientBirthTime", "PatientAddress", "PatientTelephoneNumbers", "PatientMotherBirthName",
+    "MilitaryRank", "BranchOfService", "MedicalRecordLocator", "PatientInsurancePlanCodeSequence",
+    "PatientReligiousPreference", "IssuerOfPatientID", "PatientComments", "AdditionalPatientHistory",
+    "RequestingPhysician", "PhysiciansOfRecord", "NameOfPhysiciansReadingStudy",
+    "ReferringPhysicianAddress", "ReferringPhysicianTelephoneNumbers", "InstitutionalDepartmentName",
+    "StationName", "DeviceSerialNumber", "RequestAttributesSequence", "ScheduledPerformingPhysicianName",
+    "PerformedProcedureStepID", "RequestedProcedureID", "ContentCreatorName", "VerifyingObserverName",
+)
+
+@dataclass(frozen=True)
+class Finding:
+    """Un problema en un archivo. ``location`` es la ruta del elemento
+    (``ReferencedStudySequence[0].PatientName``); el valor no se copia al
+    informe para no trasladar datos de paciente."""
+
+    path: str
+    location: str
+    severity: str
+    problem: str
+
+def _has_value(elem) -> bool:
+    value = elem.value
+    if elem.VR == "SQ":
+        return bool(value)
+    return value not in (None, "", b"") and str(value).strip() != ""
+
+def _check_top_level(ds, path: str, findings: list, expected: Optional[dict], uid_store) -> None:
+    """Valores fijos del perfil y UIDs mapeados. ``UID_ROOT`` es la raíz
+    real de GE, así que el prefijo no distingue un UID original de GE de
+    uno anonimizado: con ``expected`` (``{keyword: uid}``) el valor debe
+    coincidir exactamente y con ``uid_store`` debe estar registrado como
+    UID anonimizado."""
+    for keyword, value in PS315_FIXED_VALUES.items():
+        if keyword in ds and str(ds.data_element(keyword).value) != value:
+            findings.append(Finding(path, keyword, ERROR, f"debería ser {value!r}" if value else "no está vacío"))
+    if "PatientID" in ds and not str(ds.PatientID).startswith("ANON"):
+        findings.append(Finding(path, "PatientID", ERROR, "no está seudonimizado"))
+    for keyword in PS315_MAPPED_UIDS:
+        if keyword not in ds:
+            continue
+        uid = str(ds.data_element(keyword).value)
+        if not uid.startswith(UID_ROOT):
+            findings.append(Finding(path, keyword, ERROR, "UID original"))
+        elif expected and keyword in expected and uid != expected[keyword]:
+            findings.append(Finding(path, keyword, ERROR, "UID distinto del anonimizado"))
+        elif uid_store is not None and not uid_store.is_mapped(uid):
+            findings.append(Finding(path, keyword, ERROR, "UID ausente del índice de UIDs"))
+    for keyword in PS315_REMOVED_KEYWORDS:
+        if keyword in ds:
+            findings.append(Finding(path, keyword, ERROR, "debería eliminarse"))
+    if "PatientIdentityRemoved" not in ds:
+        findings.append(Finding(path, "PatientIdentityRemoved", ERROR, "falta YES"))
+
+def _check_file_meta(ds, path: str, findings: list) -> None:
+    """La cabecera de archivo repite el SOPInstanceUID y puede llevar
+    tags privados."""
+    meta = getattr(ds, "file_meta", None)
+    if meta is None:
+        return
+    media_uid = meta.get("MediaStorageSOPInstanceUID")
+    if media_uid is not None and "SOPInstanceUID" in ds and str(media_uid) != str(ds.SOPInstanceUID):
+        findings.append(Finding(path, "file_meta.MediaStorageSOPInstanceUID", ERROR, "UID original"))
+    _walk(meta, path, "file_meta.", findings)
+
+def _walk(ds, path: str, prefix: str, findings: list) -> None:
+    """Recorre ``ds`` y sus secuencias anidadas: tags privados, atributos
+    del perfil con valor dentro de secuencias y atributos de
+    :data:`PS315_OTHER_KEYWORDS`."""
+    for elem in ds:
+        location = f"{prefix}{elem.keyword or str(elem.tag)}"
+        if elem.tag.is_private:
+            findings.append(Finding(path, location, ERROR, "tag privado"))
+            continue
+        if prefix and elem.keyword in PS315_FIXED_VALUES and _has_value(elem) \
+                and str(elem.value) != PS315_FIXED_VALUES[elem.keyword]:
+            findings.append(Finding(path, location, ERROR, "dato identificativo en secuencia"))
+        elif prefix and elem.keyword == "PatientID" and _has_value(elem) and not str(elem.value).startswith("ANON"):
+            findings.append(Finding(path, location, ERROR, "dato identificativo en secuencia"))
+        elif elem.keyword in PS315_OTHER_KEYWORDS and _has_value(elem):
+            findings.append(Finding(path, location, WARNING, "atributo PS3.15 no tratado"))
+        if elem.VR == "SQ":
+            for i, item in enumerate(elem.value):
+                _walk(item, path, f"{location}[{i}].", findings)
+
+def audit_file(path: str, expected: Optional[dict] = None, uid_store: Optional[tuple] = None) -> tuple:
+    """``(hallazgos, error de lectura)`` de un archivo, leyendo solo la
+    cabecera. ``uid_store`` es ``(ruta, salt)`` del índice de UIDs."""
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except Exception as e:
+        return [], str(e) or type(e).__name__
+    store = shared_uid_store(Path(uid_store[0]), uid_store[1]) if uid_store else None
+    findings = []
+    _check_top_level(ds, path, findings, expected, store)
+    _check_file_meta(ds, path, findings)
+    _walk(ds, path, "", findings)
+    return findings, ""
+
+@dataclass
+class AuditReport:
+    root: str
+    files: int = 0
+    findings: list = field(default_factory=list)
+    unreadable: list = field(default_factory=list)
+
+    @property
+    def errors(self) -> list:
+        return [f for f in self.findings if f.severity == ERROR]
+
+    @property
+    def warnings(self) -> list:
+        return [f for f in self.findings if f.severity == WARNING]
+
+    def passed(self, strict: bool = False) -> bool:
+        """Sin errores ni archivos ilegibles (ni avisos, con ``strict``)."""
+        return not self.errors and not self.unreadable and not (strict and self.warnings)
+
+    def summary(self) -> str:
+        flagged = len({f.path for f in self.findings})
+        lines = [
+            f"Auditoría PHI de {self.root}: {self.files} archivos, {flagged} con hallazgos "
+            f"({len(self.errors)} errores, {len(self.warnings)} avisos), {len(self.unreadable)} ilegibles"
+        ]
+        by_location = Counter((f.severity, f.location.split(".")[-1], f.problem) for f in self.findings)
+        for (severity, keyword, problem), n in by_location.most_common(10):
+            lines.append(f"  {severity:<7} {keyword:<30} {problem} ×{n}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            "root": self.root,
+            "files": self.files,
+            "passed": self.passed(),
+            "findings": [asdict(f) for f in self.findings],
+            "unreadable": [{"path": p, "error": e} for p, e in self.unreadable],
+        }
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=1, ensure_ascii=False))
+
+def audit_files(
+    files: Iterable[Path],
+    max_workers: Optional[int] = None,
+    root: str = "",
+    expected: Optional[dict] = None,
+    uid_store: Optional[tuple] = None,
+) -> AuditReport:
+    """Audita ``files`` repartiéndolos entre ``max_workers`` procesos
+    (``spawn``, como la anonimización: se llama desde hilos Qt).
+
+    ``expected`` asocia una ruta con sus UIDs anonimizados
+    (``{keyword: uid}``); ``uid_store`` es ``(ruta, salt)`` del índice de
+    UIDs contra el que se comprueban todos los archivos.
+    """
+    paths = [str(f) for f in files]
+    report = AuditReport(root, files=len(paths))
+    expected = expected or {}
+    per_path = [expected.get(p) for p in paths]
+    stores = [uid_store] * len(paths)
+    workers = min(resolve_workers(max_workers), len(paths) or 1)
+    if workers <= 1:
+        _collect(report, paths, map(audit_file, paths, per_path, stores))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            _collect(report, paths, executor.map(audit_file, paths, per_path, stores, chunksize=_CHUNKSIZE))
+    return report
+
+def _collect(report: AuditReport, paths: list, results) -> None:
+    for path, (findings, error) in zip(paths, results):
+        report.findings.extend(findings)
+        if error:
+            report.unreadable.append((path, error))
+
+def audit_tree(
+    root: Path,
+    max_workers: Optional[int] = None,
+    expected: Optional[dict] = None,
+    uid_store: Optional[tuple] = None,
+) -> AuditReport:
+    """Audita todos los ``.dcm`` de un árbol anonimizado (``ANONYMIZED``,
+    ``_temp_anon``, ...); ver :func:`audit_files`."""
+    files = sorted(iter_files(root, DICOM_SUFFIX))
+    return audit_files(files, max_workers, root=str(root), expected=expected, uid_store=uid_store)
+
+def resolve_phi_audit(enabled: Optional[bool] = None) -> bool:
+    """Argumento o ``DICOM_PHI_AUDIT`` (activa salvo ``DICOM_PHI_AUDIT=0``)."""
+    if enabled is not None:
+        return enabled
+    return os.getenv("DICOM_PHI_AUDIT", "1").strip() != "0"
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Comprueba que un árbol anonimizado no conserva PHI.")
+    parser.add_argument("root", help="Carpeta anonimizada (ANONYMIZED, _temp_anon, ...)")
+    parser.add_argument("--workers", type=int, help="Procesos (DICOM_WORKERS; 0 = todos los núcleos)")
+    parser.add_argument("--report", help="Guardar el informe completo en JSON")
+    parser.add_argument("--strict", action="store_true", help="Fallar también con avisos")
+    parser.add_argument(
+        "--uid-store", help="Índice de UIDs contra el que comprobar los UIDs (DICOM_UID_STORE; usa DICOM_SALT_SECRET)"
+    )
+    args = parser.parse_args(argv)
+
+    uid_store = None
+    store_path = resolve_uid_store_path(args.uid_store)
+    if store_path is not None:
+        salt = os.getenv("DICOM_SALT_SECRET", "").strip()
+        if not store_path.exists():
+            parser.error(f"no existe el índice de UIDs {store_path}")
+        if not salt:
+            parser.error("el índice de UIDs necesita DICOM_SALT_SECRET")
+        uid_store = (str(store_path), salt)
+
+    report = audit_tree(Path(args.root), args.workers, uid_store=uid_store)
+    print(report.summary())
+    if args.report:
+        report.save(Path(args.report))
+    return 0 if report.passed(args.strict) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+UID_STORE_FILENAME = ".uid_map.sqlite"
+# PRAGMA user_version del archivo; sube si cambia cómo se cifra.
+STORE_FORMAT = 2
+_FLUSH_EVERY = 512
+_NONCE_BYTES = 12
+
+class UIDMapStore:
+    """Índice persistente original → UID anonimizado para un salt.
+
+    Delante de la tabla SQLite hay un LRU en memoria, así que los UIDs de
+    estudio y serie (iguales en miles de instancias) se resuelven en O(1)
+    y solo se escriben una vez. El UID original no se guarda en claro: se
+    cifra con AES-256-GCM (clave derivada del salt con HKDF, nonce
+    aleatorio por fila y el UID anonimizado como dato asociado, de modo
+    que una fila alterada o movida a otro UID no se descifra), y se indexa
+    con un HMAC del salt. Sin el salt no se puede revertir ni consultar la
+    tabla.
+
+    Varios procesos pueden compartir el mismo archivo (WAL + timeout);
+    cada uno acumula filas y las escribe en bloque con :meth:`flush`.
+    Dentro de un proceso la instancia puede compartirse entre hilos.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        salt: str,
+        derive: Callable[[str], str],
+        cache_size: int = 65536,
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.salt = salt
+        self._key = salt.encode()
+        self._aead = AESGCM(HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"uid-map:aes-256-gcm",
+        ).derive(self._key))
+        self._derive = derive
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self._pending: list = []
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uid_map (
+                anon          TEXT NOT NULL,
+                original_tag  TEXT NOT NULL,
+                original_enc  BLOB NOT NULL,
+                level         TEXT,
+                first_seen    TEXT NOT NULL,
+                PRIMARY KEY (anon, original_tag)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS uid_map_tag ON uid_map (original_tag)"
+        )
+        self._check_format()
+        self._conn.commit()
+
+    def _check_format(self) -> None:
+        version, = self._conn.execute("PRAGMA user_version").fetchone()
+        if version == STORE_FORMAT:
+            return
+        rows, = self._conn.execute("SELECT COUNT(*) FROM uid_map").fetchone()
+        if rows:
+            self._conn.close()
+            raise ValueError(
+                f"{self.db_path} usa el formato {version} del índice de UIDs "
+                f"(se espera {STORE_FORMAT}); genéralo de nuevo"
+            )
+        self._conn.execute(f"PRAGMA user_version = {STORE_FORMAT}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _tag(self, original: str) -> str:
+        return hmac.new(self._key, original.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def _encrypt(self, original: str, anon: str) -> bytes:
+        nonce = os.urandom(_NONCE_BYTES)
+        return nonce + self._aead.encrypt(nonce, original.encode(), anon.encode())
+
+    def _decrypt(self, blob: bytes, anon: str) -> str:
+        try:
+            return self._aead.decrypt(blob[:_NONCE_BYTES], blob[_NONCE_BYTES:], anon.encode()).decode()
+        except InvalidTag:
+            raise ValueError(f"Entrada del índice de UIDs alterada o de otro salt: {anon}") from None
+
+    def map_uid(self, original: str, level: Optional[str] = None) -> str:
+        original = str(original)
+        with self._lock:
+            anon = self._cache.get(original)
+            if anon is not None:
+                self._cache.move_to_end(original)
+                return anon
+
+            anon = self._derive(original)
+            self._cache[original] = anon
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+            self._pending.append((
+                anon,
+                self._tag(original),
+                self._encrypt(original, anon),
+                level,
+                datetime.now(timezone.utc).isoformat(),
+            ))
+            if len(self._pending) >= _FLUSH_EVERY:
+                self.flush()
+            return anon
+
+    def map_many(self, originals: Iterable[str], level: Optional[str] = None) -> list:
+        """Versión en bloque de :meth:`map_uid`; escribe en una sola transacción."""
+        result = [self.map_uid(uid, level) for uid in originals]
+        self.flush()
+        return result
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO uid_map VALUES (?, ?, ?, ?, ?)", self._pending
+                )
+            self._pending.clear()
+
+    def reverse(self, anon: str) -> list:
+        """UIDs originales que producen ``anon`` (más de uno = colisión)."""
+        self.flush()
+        rows = self._conn.execute(
+            "SELECT original_enc FROM uid_map WHERE anon = ?", (anon,)
+        ).fetchall()
+        return [self._decrypt(blob, anon) for (blob,) in rows]
+
+    def lookup(self, original: str) -> Optional[str]:
+        """UID anonimizado registrado para ``original``, sin crear la entrada."""
+        self.flush()
+        row = self._conn.execute(
+            "SELECT anon FROM uid_map WHERE original_tag = ?", (self._tag(str(original)),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_mapped(self, anon: str) -> bool:
+        """True si ``anon`` es un UID anonimizado registrado en el índice."""
+        self.flush()
+        row = self._conn.execute("SELECT 1 FROM uid_map WHERE anon = ? LIMIT 1", (str(anon),)).fetchone()
+        return row is not None
+
+    def collisions(self) -> list:
+        """``(anon, n_originales)`` para cada UID truncado que comparten varios originales."""
+        self.flush()
+        return self._conn.execute(
+            "SELECT anon, COUNT(*) FROM uid_map GROUP BY anon HAVING COUNT(*) > 1"
+        ).fetchall()
+
+    def audit(self) -> dict:
+        self.flush()
+        total, = self._conn.execute("SELECT COUNT(*) FROM uid_map").fetchone()
+        by_level = dict(self._conn.execute(
+            "SELECT COALESCE(level, '?'), COUNT(*) FROM uid_map GROUP BY level"
+        ).fetchall())
+        return {"total": total, "by_level": by_level, "collisions": self.collisions()}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,61 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import zarr
+from zarr.codecs import BloscCodec
+
+ZARR_MODES = ("off", "alongside", "only")
+ZARR_SUFFIX = ".zarr"
+ZARR_SLAB = 4
+
+def resolve_zarr_mode(mode: str = None) -> str:
+    """Argument, then NIFTI_ZARR, then ``off``. ``alongside`` writes a Zarr
+    copy next to each NIfTI; ``only`` keeps the Zarr and drops the NIfTI."""
+    mode = (mode or os.getenv("NIFTI_ZARR") or "off").strip().lower()
+    mode = {"0": "off", "1": "alongside"}.get(mode, mode)
+    if mode not in ZARR_MODES:
+        raise ValueError(f"Unknown Zarr mode {mode!r}; expected one of {', '.join(ZARR_MODES)}")
+    return mode
+
+def zarr_path(nifti_path: Path) -> Path:
+    """``scan.nii.gz`` -> ``scan.zarr``."""
+    nifti_path = Path(nifti_path)
+    return nifti_path.with_name(nifti_path.name.removesuffix(".gz").removesuffix(".nii") + ZARR_SUFFIX)
+
+def write_zarr(
+    nifti_path: Path,
+    data: np.ndarray,
+    affine: np.ndarray,
+    stats: Optional[dict] = None,
+    slab: int = ZARR_SLAB,
+) -> Path:
+    """Writes ``data`` (same axes as the NIfTI) as a Zarr array chunked in
+    slabs of ``slab`` planes along the last axis, the one the viewer
+    scrolls and SAM reads slice by slice (as for the memmap and gzip
+    readers), and compressed with Blosc zstd + bitshuffle (multithreaded).
+    The affine, the source file name and ``stats`` go into the attributes.
+    The store is built under a temporary name and renamed when complete.
+    """
+    target = zarr_path(nifti_path)
+    partial = target.with_name(target.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+    data = np.asarray(data)
+    array = zarr.create_array(
+        partial,
+        shape=data.shape,
+        dtype=data.dtype,
+        chunks=data.shape[:-1] + (min(slab, data.shape[-1]),),
+        compressors=BloscCodec(cname="zstd", clevel=3, shuffle="bitshuffle"),
+    )
+    array[...] = data
+    array.attrs.update({
+        "affine": np.asarray(affine, dtype=float).tolist(),
+        "source": Path(nifti_path).name,
+        "stats": stats,
+    })
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+    return target
@@ -39,7 +39,7 @@ class AnnotationManager:
                     ann[key].visible = True
             return
 
-        suffix = filename.replace('.nii.gz', '').replace('.nii', '').replace('.png', '')
+        suffix = filename.replace('.nii.gz', '').replace('.nii', '').replace('.png', '').replace('.tiff', '').replace('.tif', '').replace('.npy', '')
         ndim = len(reference_shape)
         is_3d = ndim >= 3
 
@@ -1,39 +1,217 @@
+import os
+import threading
 import numpy as np
+from collections import OrderedDict
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import io_utils
 
+DEFAULT_MEMORY_BUDGET_MB = 4096
+DEFAULT_GZIP_INDEX_MIN_MB = 64
+_CONTRAST_SAMPLE_SLICES = 16
+
+
+def _volume_key(path):
+    return path.name.replace('.nii.gz', '').replace('.nii', '').replace('.zarr', '')
+
+
+def _is_resident(data):
+    """``True`` si ``data`` ocupa memoria entero; los ``np.memmap`` y dask
+    array (``.nii``, Zarr) se leen por cortes."""
+    return isinstance(data, np.ndarray) and not isinstance(data, np.memmap)
+
+
+def _contrast_limits(data, stats):
+    if stats is not None:
+        return [stats['percentiles']['2'], stats['percentiles']['98']]
+    if not _is_resident(data):
+        # Percentiles sobre una muestra de cortes del eje en que se trocea
+        # el archivo, para no leerlo entero.
+        chunks = getattr(data, 'chunks', None)
+        axis = int(np.argmax([len(c) for c in chunks])) if chunks else data.ndim - 1
+        step = max(1, data.shape[axis] // _CONTRAST_SAMPLE_SLICES)
+        data = data[(slice(None),) * axis + (slice(None, None, step),)]
+    p_low, p_high = np.percentile(np.asarray(data), [2, 98])
+    return [float(p_low), float(p_high)]
+
+
+def _nbytes(data):
+    """Memoria de ``data`` ya decodificado (ver :func:`_is_resident`)."""
+    return data.nbytes if _is_resident(data) else 0
+
+
+def resolve_native_dtype(native=None):
+    """Argumento > VIEWER_NATIVE_DTYPE (por defecto float32, como siempre)."""
+    if native is not None:
+        return native
+    return os.environ.get("VIEWER_NATIVE_DTYPE", "0").strip() == "1"
+
+
+def resolve_memory_budget(budget_mb=None):
+    """Argumento > VIEWER_MEMORY_BUDGET_MB > 4096, en bytes."""
+    if budget_mb is None:
+        try:
+            budget_mb = float(os.environ.get("VIEWER_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB))
+        except ValueError:
+            budget_mb = DEFAULT_MEMORY_BUDGET_MB
+    return int(max(0, budget_mb) * 1024 * 1024)
+
+
+def resolve_gzip_index_min_bytes(min_mb=None):
+    """Argumento > VIEWER_GZIP_INDEX_MIN_MB > 64: a partir de qué tamaño
+    descomprimido un ``.nii.gz`` se lee por cortes con un índice de acceso
+    aleatorio en lugar de descomprimirse entero. Negativo lo desactiva
+    (``None``)."""
+    if min_mb is None:
+        try:
+            min_mb = float(os.environ.get("VIEWER_GZIP_INDEX_MIN_MB", DEFAULT_GZIP_INDEX_MIN_MB))
+        except ValueError:
+            min_mb = DEFAULT_GZIP_INDEX_MIN_MB
+    return None if min_mb < 0 else int(min_mb * 1024 * 1024)
+
 
 class ImageLoader:
-    def __init__(self, base_path, max_workers: int = 6):
+    """Volúmenes e imágenes 2D de un paciente. Con ``native`` los volúmenes
+    se quedan en su tipo (int16, uint8...) en lugar de float32; si el NIfTI
+    trae escala, ``scaling`` la guarda y los límites de contraste se dan en
+    unidades almacenadas (ver ``io_utils.load_nifti_native``). Los ``.nii``
+    y los ``.nii.gz`` de al menos ``gzip_index_min_mb`` se leen por cortes
+    (``io_utils.load_nifti_lazy`` / ``load_nifti_gzip_lazy``)."""
+
+    def __init__(self, base_path, max_workers: int = 6, native=None, gzip_index_min_mb=None):
         self.base_path = Path(base_path)
         self.max_workers = max_workers
+        self.native = resolve_native_dtype(native)
+        self.gzip_index_min_bytes = resolve_gzip_index_min_bytes(gzip_index_min_mb)
 
     def load_all_images(self):
         nifti_data = self._load_nifti_volumes()
         png_data = self._load_png_images()
         return nifti_data + png_data
 
-    def _load_nifti_volumes(self):
+    def list_images(self):
+        """Las mismas entradas que :meth:`load_all_images`, en el mismo orden,
+        pero leyendo solo cabeceras: ``data`` es ``None`` (salvo Zarr y ``.nii``,
+        que ya se leen por cortes), ``shape`` da la forma y ``contrast_limits`` es ``None``
+        si no hay estadísticas. :meth:`load` decodifica cada una."""
+        entries = []
+        for f in self._nifti_files():
+            try:
+                entries.append(self._describe_volume(f))
+            except Exception as e:
+                print(f"Error en {f.name}: {e}")
+        for f in self._png_files():
+            try:
+                entries.append(self._describe_2d(f))
+            except Exception as e:
+                print(f"Error en {f.name}: {e}")
+        return entries
+
+    def load(self, entry):
+        """Decodifica una entrada de :meth:`list_images`."""
+        if entry['data'] is not None:
+            return entry
+        path = entry['path']
+        scaling = None
+        if entry['type'] == '3D' and self._use_gzip_index(path):
+            data, _, scaling = io_utils.load_nifti_gzip_lazy(path, native=self.native)
+        elif entry['type'] == '3D' and self.native:
+            data, _, scaling = io_utils.load_nifti_native(path)
+        elif entry['type'] == '3D':
+            data, _ = io_utils.load_nifti_volume(path)
+        else:
+            data = io_utils.load_2d_image(path)
+        contrast_limits = entry['contrast_limits']
+        if contrast_limits is not None:
+            contrast_limits = io_utils.to_stored_units(contrast_limits, scaling)
+        return {
+            **entry,
+            'data': data,
+            'shape': data.shape,
+            'contrast_limits': contrast_limits or _contrast_limits(data, None),
+            'scaling': scaling,
+        }
+
+    def _use_gzip_index(self, path):
+        if self.gzip_index_min_bytes is None:
+            return False
+        nbytes = io_utils.gzip_nifti_nbytes(path)
+        return nbytes is not None and nbytes >= self.gzip_index_min_bytes
+
+    def _nifti_files(self):
         nifti_files = list(self.base_path.glob("*.nii.gz")) + list(self.base_path.glob("*.nii"))
-        nifti_files = sorted([f for f in nifti_files if not f.name.startswith('.')])
+        nifti_files = [f for f in nifti_files if not f.name.startswith('.')]
+        # Una copia Zarr sustituye a su NIfTI: se decodifica por cortes.
+        zarr_stores = [f for f in self.base_path.glob("*.zarr") if f.is_dir() and not f.name.startswith('.')]
+        by_key = {_volume_key(f): f for f in sorted(nifti_files) + sorted(zarr_stores)}
+        return [by_key[k] for k in sorted(by_key)]
+
+    def _png_files(self):
+        return sorted(
+            f for f in self.base_path.glob("*")
+            if f.suffix.lower() in io_utils.IMAGE_2D_EXTENSIONS and not f.name.startswith('.')
+        )
+
+    def _describe_volume(self, nii_file):
+        scaling = None
+        if nii_file.suffix == '.zarr':
+            data, affine, attrs = io_utils.load_zarr_volume(nii_file, native=self.native)
+            stats = attrs.get('stats')
+            filename = attrs.get('source', nii_file.name)
+            shape = data.shape
+        elif io_utils.is_mappable_nifti(nii_file):
+            # Como Zarr: mapeado en memoria, se pagina por cortes.
+            data, affine, scaling = io_utils.load_nifti_lazy(nii_file, native=self.native)
+            stats = io_utils.load_image_stats(nii_file)
+            filename = nii_file.name
+            shape = data.shape
+        else:
+            data = None
+            shape, affine = io_utils.read_nifti_header(nii_file)
+            stats = io_utils.load_image_stats(nii_file)
+            filename = nii_file.name
+        spacing = np.abs(np.diag(affine[:3, :3])).tolist()
+        return {
+            'data': data,
+            'name': f"3D_{Path(filename).stem}",
+            'filename': filename,
+            'type': '3D',
+            'colormap': 'gray',
+            'contrast_limits': (
+                io_utils.to_stored_units(_contrast_limits(data, stats), scaling if stats else None)
+                if data is not None or stats else None
+            ),
+            'affine': affine,
+            'voxel_spacing': spacing,
+            'stats': stats,
+            'scaling': scaling,
+            'path': nii_file,
+            'shape': shape,
+        }
+
+    def _describe_2d(self, png_file):
+        stats = io_utils.load_image_stats(png_file)
+        return {
+            'data': None,
+            'name': f"2D_{png_file.stem}",
+            'filename': png_file.name,
+            'type': '2D',
+            'colormap': 'gray',
+            'contrast_limits': _contrast_limits(None, stats) if stats else None,
+            'affine': None,
+            'stats': stats,
+            'scaling': None,
+            'path': png_file,
+            'shape': io_utils.read_2d_shape(png_file),
+        }
+
+    def _load_nifti_volumes(self):
+        nifti_files = self._nifti_files()
 
         print(f"Cargando {len(nifti_files)} volúmenes en paralelo (workers={self.max_workers})...")
 
         def _load_one(nii_file):
-            data, affine = io_utils.load_nifti_volume(nii_file)
-            p_low, p_high = np.percentile(data, [2, 98])
-            spacing = np.abs(np.diag(affine[:3, :3])).tolist()
-            return {
-                'data': data,
-                'name': f"3D_{nii_file.stem}",
-                'filename': nii_file.name,
-                'type': '3D',
-                'colormap': 'gray',
-                'contrast_limits': [float(p_low), float(p_high)],
-                'affine': affine,
-                'voxel_spacing': spacing
-            }
+            return self.load(self._describe_volume(nii_file))
 
         results: dict = {}
         with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
@@ -50,24 +228,103 @@ class ImageLoader:
         return [results[f.name] for f in nifti_files if f.name in results]
 
     def _load_png_images(self):
-        png_files = sorted([f for f in self.base_path.glob("*.png") if not f.name.startswith('.')])
-
         loaded_images = []
-        for png_file in png_files:
+        for png_file in self._png_files():
             try:
-                data = io_utils.load_2d_image(png_file)
-                image_info = {
-                    'data': data,
-                    'name': f"2D_{png_file.stem}",
-                    'filename': png_file.name,
-                    'type': '2D',
-                    'colormap': 'gray',
-                    'contrast_limits': [np.percentile(data, 2), np.percentile(data, 98)],
-                    'affine': None
-                }
-                loaded_images.append(image_info)
+                loaded_images.append(self.load(self._describe_2d(png_file)))
                 print(f"  {png_file.name}")
             except Exception as e:
                 print(f"Error en {png_file.name}: {e}")
 
-        return loaded_images
\ No newline at end of file
+        return loaded_images
+
+
+class VolumeCache:
+    """Decodifica bajo demanda las entradas de :meth:`ImageLoader.list_images`
+    y mantiene decodificados como mucho ``budget_mb`` (VIEWER_MEMORY_BUDGET_MB).
+
+    :meth:`prefetch` empieza a decodificar en segundo plano una imagen y
+    devuelve su ``Future``; :meth:`get` espera a que esté (sin esperar si
+    el ``Future`` ya terminó).
+    :meth:`evict` libera, de la menos a la más recientemente usada, las que
+    no estén en ``pinned`` hasta quedar dentro del presupuesto.
+    """
+
+    def __init__(self, loader, budget_mb=None, max_workers: int = 2):
+        self.loader = loader
+        self.budget_bytes = resolve_memory_budget(budget_mb)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._loaded = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _future(self, entry):
+        filename = entry['filename']
+        with self._lock:
+            future = self._futures.get(filename)
+            if future is None:
+                future = self._executor.submit(self.loader.load, entry)
+                self._futures[filename] = future
+                future.add_done_callback(lambda f: self._store(filename, f))
+            return future
+
+    def _store(self, filename, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            if self._futures.get(filename) is future:
+                self._loaded[filename] = future.result()
+
+    def prefetch(self, entry):
+        if entry['data'] is None:
+            return self._future(entry)
+        future = Future()
+        future.set_result(entry)
+        return future
+
+    def get(self, entry):
+        """Entrada decodificada; si falla, la excepción se propaga y un
+        siguiente intento vuelve a leer el archivo."""
+        if entry['data'] is not None:
+            return entry
+        filename = entry['filename']
+        future = self._future(entry)
+        try:
+            info = future.result()
+        except Exception:
+            with self._lock:
+                self._futures.pop(filename, None)
+            raise
+        with self._lock:
+            self._store(filename, future)
+            if filename in self._loaded:
+                self._loaded.move_to_end(filename)
+        return info
+
+    def is_loaded(self, filename):
+        with self._lock:
+            return filename in self._loaded
+
+    def loaded_bytes(self):
+        with self._lock:
+            return sum(_nbytes(info['data']) for info in self._loaded.values())
+
+    def evict(self, pinned=()):
+        """Libera imágenes no fijadas hasta quedar dentro del presupuesto.
+        Devuelve los ``filename`` liberados."""
+        pinned = set(pinned)
+        evicted = []
+        with self._lock:
+            total = sum(_nbytes(info['data']) for info in self._loaded.values())
+            for filename in list(self._loaded):
+                if total <= self.budget_bytes:
+                    break
+                if filename in pinned:
+                    continue
+                total -= _nbytes(self._loaded.pop(filename)['data'])
+                self._futures.pop(filename, None)
+                evicted.append(filename)
+        return evicted
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,13 +1,30 @@
 import numpy as np
 import nibabel as nib
 import imageio.v3 as iio
+import dask.array as da
+import indexed_gzip as igzip
+import zarr
+import hashlib
 import json
+import os
 import tempfile
+import threading
+import weakref
 from datetime import datetime, timezone
 from pathlib import Path
 
 from schemas import PatientManifest, migrate_v1_manifest
 
+IMAGE_2D_EXTENSIONS = (".png", ".tif", ".tiff", ".npy")
+STATS_SUFFIX = ".stats.json"
+STATS_VERSION = 1
+# Los volúmenes se recorren por su último eje (los cortes del NIfTI, contiguos
+# en disco): el visor lo pone en el deslizador, SAM lo lee corte a corte y
+# Zarr, memmap y gzip se leen en bloques de NIFTI_SLAB cortes de ese eje.
+NIFTI_SLAB = 4
+GZIP_INDEX_SUFFIX = ".gzidx"
+GZIP_INDEX_SPACING = 4 * 1024 * 1024
+
 def find_patient_path(patient_id, root_dir):
     search_paths = [
         Path(f"{root_dir}/MAMA/PROCESSED_DATA/{patient_id}"),
@@ -16,16 +33,27 @@ def find_patient_path(patient_id, root_dir):
     return next((path for path in search_paths if path.exists()), None)
 
 
+def _rgb_luminance(raw, dtype=np.float32):
+    """Luminancia de un volumen RGB estructurado, calculada corte a corte
+    (último eje) sobre un array preasignado, sin temporales del tamaño del
+    volumen."""
+    out = np.empty(raw.shape, dtype=dtype)
+    round_result = np.issubdtype(dtype, np.integer)
+    for k in range(raw.shape[-1]):
+        chunk = raw[..., k]
+        lum = 0.299 * chunk['R'].astype(np.float32)
+        lum += 0.587 * chunk['G'].astype(np.float32)
+        lum += 0.114 * chunk['B'].astype(np.float32)
+        out[..., k] = np.rint(lum) if round_result else lum
+    return out
+
+
 def load_nifti_volume(file_path):
     nifti_obj = nib.load(file_path)
     raw_dtype = nifti_obj.header.get_data_dtype()
 
     if raw_dtype.names is not None and set(raw_dtype.names) >= {'R', 'G', 'B'}:
-        raw = np.asarray(nifti_obj.dataobj)
-        r = raw['R'].astype(np.float32)
-        g = raw['G'].astype(np.float32)
-        b = raw['B'].astype(np.float32)
-        volume_data = 0.299 * r + 0.587 * g + 0.114 * b
+        volume_data = _rgb_luminance(np.asarray(nifti_obj.dataobj))
 
     elif raw_dtype.names is not None:
         raw = np.asarray(nifti_obj.dataobj)
@@ -40,18 +68,297 @@ def load_nifti_volume(file_path):
     return volume_data, nifti_obj.affine
 
 
+def load_nifti_native(file_path):
+    """Como :func:`load_nifti_volume` pero sin pasar a float32:
+    ``(datos, affine, escala)``. Los enteros se quedan en su tipo y, si la
+    cabecera trae ``scl_slope``/``scl_inter``, no se aplican: ``escala`` es
+    ``(slope, inter)`` (valor real = almacenado * slope + inter) para
+    llevar a unidades almacenadas los límites de contraste (ver
+    :func:`to_stored_units`); si no hay escala es ``None``. Los RGB se
+    reducen a luminancia en el tipo de sus canales."""
+    nifti_obj = nib.load(file_path)
+    raw_dtype = nifti_obj.header.get_data_dtype()
+    dataobj = nifti_obj.dataobj
 
-def load_nifti_mask(file_path):
+    if raw_dtype.names is not None and set(raw_dtype.names) >= {'R', 'G', 'B'}:
+        return _rgb_luminance(np.asarray(dataobj), raw_dtype['R']), nifti_obj.affine, None
+
+    if raw_dtype.names is not None or not nib.is_proxy(dataobj):
+        volume_data, affine = load_nifti_volume(file_path)
+        return volume_data, affine, None
+
+    volume_data = np.asarray(dataobj.get_unscaled())
+    slope, inter = float(dataobj.slope), float(dataobj.inter)
+    if (slope, inter) == (1.0, 0.0):
+        return volume_data, nifti_obj.affine, None
+    if np.issubdtype(volume_data.dtype, np.floating):
+        volume_data *= volume_data.dtype.type(slope)
+        volume_data += volume_data.dtype.type(inter)
+        return volume_data, nifti_obj.affine, None
+    return volume_data, nifti_obj.affine, (slope, inter)
+
+
+def is_mappable_nifti(file_path):
+    """``.nii`` sin comprimir y de un solo canal: se puede mapear en memoria."""
+    if not str(file_path).endswith(".nii"):
+        return False
+    return nib.load(file_path).header.get_data_dtype().names is None
+
+
+def load_nifti_lazy(file_path, native=False):
+    """Volumen de un ``.nii`` sin comprimir (ver :func:`is_mappable_nifti`)
+    sin leerlo: napari solo pagina los cortes que visita. Con ``native`` y
+    datos enteros (o sin escala) es el propio ``np.memmap`` de solo lectura;
+    si no, un dask array float32 (escala aplicada) en bloques de
+    ``NIFTI_SLAB`` cortes del último eje, que son contiguos en disco.
+    Devuelve ``(datos, affine, escala)`` como :func:`load_nifti_native`."""
+    nifti_obj = nib.load(file_path, mmap="r")
+    dataobj = nifti_obj.dataobj
+    raw = dataobj.get_unscaled()
+    slope, inter = float(dataobj.slope), float(dataobj.inter)
+    scaling = None if (slope, inter) == (1.0, 0.0) else (slope, inter)
+    if native and (scaling is None or np.issubdtype(raw.dtype, np.integer)):
+        return raw, nifti_obj.affine, scaling
+    return _lazy_volume(raw, scaling, native), nifti_obj.affine, None
+
+
+def _lazy_volume(raw, scaling, native):
+    """``raw`` como dask array en bloques de ``NIFTI_SLAB`` cortes del último
+    eje, en float32 (o su tipo, con ``native``) y con la escala aplicada."""
+    chunks = raw.shape[:-1] + (min(NIFTI_SLAB, raw.shape[-1]),)
+    dtype = np.dtype(raw.dtype if native else np.float32)
+    volume_data = da.from_array(raw, chunks=chunks).astype(dtype)
+    if scaling is not None:
+        volume_data = volume_data * dtype.type(scaling[0]) + dtype.type(scaling[1])
+    return volume_data
+
+
+def slab_aligned(data, axis=-1):
+    """``data`` listo para leerse corte a corte a lo largo de ``axis``: un
+    dask array con bloques de más de ``NIFTI_SLAB`` cortes en ese eje (p.
+    ej. un Zarr antiguo, en bloques del primer eje) se lee entero una vez,
+    en vez de descomprimir un bloque completo por cada corte."""
+    if isinstance(data, da.Array) and max(data.chunks[axis], default=0) > NIFTI_SLAB:
+        return data.compute()
+    return data
+
+
+def gzip_nifti_nbytes(file_path):
+    """Tamaño descomprimido de los vóxeles de un ``.nii.gz`` de un solo
+    canal, o ``None`` si no es uno (ver :func:`load_nifti_gzip_lazy`)."""
+    if not str(file_path).endswith(".nii.gz"):
+        return None
+    header = nib.load(file_path).header
+    dtype = header.get_data_dtype()
+    if dtype.names is not None:
+        return None
+    return int(np.prod(header.get_data_shape())) * dtype.itemsize
+
+
+def gzip_index_path(file_path):
+    """``<archivo>.gzidx`` junto al NIfTI o, si esa carpeta no admite
+    escritura (p. ej. un disco de solo lectura), en la caché temporal."""
+    file_path = Path(file_path).resolve()
+    beside = file_path.with_name(file_path.name + GZIP_INDEX_SUFFIX)
+    if beside.exists() or os.access(file_path.parent, os.W_OK):
+        return beside
+    key = hashlib.sha1(str(file_path).encode()).hexdigest()
+    return Path(tempfile.gettempdir()) / "nifti_gzidx" / f"{key}{GZIP_INDEX_SUFFIX}"
+
+
+def open_indexed_gzip(file_path):
+    """``.gz`` con acceso aleatorio: cada ``GZIP_INDEX_SPACING`` bytes
+    descomprimidos hay un punto desde el que se puede reanudar. Devuelve
+    ``(archivo, indexado)``; si en :func:`gzip_index_path` hay un índice
+    más reciente que el archivo se importa, y si no (``indexado`` falso)
+    los puntos se van creando al leer y :func:`build_gzip_index` hace la
+    pasada completa."""
+    index_path = gzip_index_path(file_path)
+    gz = igzip.IndexedGzipFile(str(file_path), spacing=GZIP_INDEX_SPACING)
+    try:
+        if index_path.exists() and index_path.stat().st_mtime_ns >= Path(file_path).stat().st_mtime_ns:
+            gz.import_index(str(index_path))
+            return gz, True
+    except Exception:
+        gz.close()
+        gz = igzip.IndexedGzipFile(str(file_path), spacing=GZIP_INDEX_SPACING)
+    return gz, False
+
+
+def build_gzip_index(file_path):
+    """Recorre el ``.gz`` entero con un manejador propio, guarda el índice
+    en :func:`gzip_index_path` y devuelve ese manejador ya indexado."""
+    gz = igzip.IndexedGzipFile(str(file_path), spacing=GZIP_INDEX_SPACING)
+    try:
+        gz.build_full_index()
+    except Exception:
+        gz.close()
+        raise
+    index_path = gzip_index_path(file_path)
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        partial = index_path.with_name(index_path.name + ".tmp")
+        gz.export_index(str(partial))
+        partial.replace(index_path)
+    except OSError:
+        pass
+    return gz
+
+
+def _close_gzip(handle):
+    if handle[0] is not None:
+        handle[0].close()
+        handle[0] = None
+
+
+class _GzipSlabs:
+    """Vóxeles de un ``.nii.gz`` como array de solo lectura para dask: cada
+    acceso descomprime solo los cortes que pide (último eje, contiguos en
+    orden Fortran; ver ``NIFTI_SLAB``), partiendo del punto del índice más
+    cercano.
+
+    Sin índice guardado, la primera apertura no espera a la pasada
+    completa: se lee con los puntos que se van creando y
+    :func:`build_gzip_index` corre en un hilo; al terminar, su manejador
+    indexado sustituye al inicial. El manejador se cierra con
+    :meth:`close` o al liberarse el array.
+    """
+
+    def __init__(self, file_path, offset, shape, dtype):
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(dtype)
+        self._offset = offset
+        self._plane = int(np.prod(self.shape[:-1])) * self.dtype.itemsize
+        self._lock = threading.Lock()
+        gz, indexed = open_indexed_gzip(file_path)
+        self._handle = [gz]
+        self._finalizer = weakref.finalize(self, _close_gzip, self._handle)
+        if not indexed:
+            threading.Thread(target=self._index, args=(file_path,), daemon=True).start()
+
+    def _index(self, file_path):
+        try:
+            gz = build_gzip_index(file_path)
+        except Exception:
+            return
+        with self._lock:
+            if self._handle[0] is None:
+                gz.close()
+                return
+            previous, self._handle[0] = self._handle[0], gz
+        previous.close()
+
+    def close(self):
+        with self._lock:
+            _close_gzip(self._handle)
+
+    def __getitem__(self, index):
+        index = index if isinstance(index, tuple) else (index,)
+        index = index + (slice(None),) * (self.ndim - len(index))
+        last = index[-1]
+        if isinstance(last, slice):
+            start, stop, step = last.indices(self.shape[-1])
+            rest = index[:-1] + (slice(None, None, step),)
+        else:
+            start = int(last) % self.shape[-1]
+            stop, rest = start + 1, index[:-1] + (0,)
+        count = max(0, stop - start)
+        with self._lock:
+            gz = self._handle[0]
+            if gz is None:
+                raise ValueError("volumen gzip cerrado")
+            gz.seek(self._offset + start * self._plane)
+            buffer = gz.read(count * self._plane)
+        slab = np.frombuffer(buffer, dtype=self.dtype).reshape(self.shape[:-1] + (count,), order="F")
+        return slab[rest]
+
+
+def load_nifti_gzip_lazy(file_path, native=False):
+    """Como :func:`load_nifti_lazy` para un ``.nii.gz``: un dask array que
+    descomprime solo los bloques de los cortes visitados, a través de
+    :class:`_GzipSlabs`."""
+    nifti_obj = nib.load(file_path)
+    dataobj = nifti_obj.dataobj
+    raw = _GzipSlabs(file_path, dataobj.offset, dataobj.shape, dataobj.dtype)
+    slope, inter = float(dataobj.slope), float(dataobj.inter)
+    scaling = None if (slope, inter) == (1.0, 0.0) else (slope, inter)
+    if native and (scaling is None or np.issubdtype(raw.dtype, np.integer)):
+        return _lazy_volume(raw, None, True), nifti_obj.affine, scaling
+    return _lazy_volume(raw, scaling, native), nifti_obj.affine, None
+
+
+def to_stored_units(values, scaling):
+    """Pasa valores reales (estadísticas, límites de contraste) a las
+    unidades almacenadas de un volumen cargado con :func:`load_nifti_native`."""
+    if scaling is None:
+        return list(values)
+    slope, inter = scaling
+    return [(float(v) - inter) / slope for v in values]
+
+
+
+def read_nifti_header(file_path):
+    """``(shape, affine)`` de un NIfTI leyendo solo la cabecera."""
     nifti_obj = nib.load(file_path)
-    mask_data = np.asarray(nifti_obj.dataobj, dtype=np.uint16)
+    return tuple(nifti_obj.shape), nifti_obj.affine
+
+
+def load_zarr_volume(file_path, native=False):
+    """Volumen Zarr escrito en la conversión como dask array float32 (o en
+    su tipo, con ``native``): no se lee nada hasta que napari pide un corte.
+    Devuelve también los atributos (``affine``, ``source``, ``stats``)."""
+    store = zarr.open_array(str(file_path), mode="r")
+    attrs = dict(store.attrs)
+    data = da.from_zarr(store)
+    return (data if native else data.astype(np.float32)), np.asarray(attrs["affine"]), attrs
+
+
+def load_nifti_mask(file_path):
+    """Máscara uint16. Un ``.nii`` uint16 sin escala se mapea en modo
+    copia-en-escritura: se pagina al pintar y los cambios no tocan el archivo."""
+    nifti_obj = nib.load(file_path, mmap="c")
+    dataobj = nifti_obj.dataobj
+    if (
+        str(file_path).endswith(".nii")
+        and nifti_obj.header.get_data_dtype() == np.uint16
+        and (float(dataobj.slope), float(dataobj.inter)) == (1.0, 0.0)
+    ):
+        return dataobj.get_unscaled(), nifti_obj.affine
+    mask_data = np.asarray(dataobj, dtype=np.uint16)
     return mask_data, nifti_obj.affine
 
 
+def load_image_stats(file_path):
+    """Estadísticas precalculadas en la conversión (``<archivo>.stats.json``).
+    ``None`` si faltan o no corresponden al archivo actual."""
+    file_path = Path(file_path)
+    try:
+        stats = json.loads(file_path.with_name(file_path.name + STATS_SUFFIX).read_text())
+        if stats.get("version") == STATS_VERSION and stats.get("size") == file_path.stat().st_size:
+            return stats
+    except (OSError, ValueError):
+        pass
+    return None
+
+
 def load_2d_image(file_path):
+    if Path(file_path).suffix.lower() == ".npy":
+        return np.load(file_path)
     return iio.imread(file_path)
 
 
+def read_2d_shape(file_path):
+    """Forma de una imagen 2D sin decodificar los píxeles."""
+    if Path(file_path).suffix.lower() == ".npy":
+        return tuple(np.load(file_path, mmap_mode="r").shape)
+    return tuple(iio.improps(file_path).shape)
+
+
 def save_nifti_mask(data, affine, output_path):
+    """Acepta arrays numpy, mapeados o dask; solo se copia si hay que
+    cambiar el tipo o calcular los bloques."""
+    data = np.asarray(data)
     if data.dtype != np.uint16:
         data = data.astype(np.uint16)
     mask_nifti = nib.Nifti1Image(data, affine)
@@ -6,7 +6,7 @@ import napari
 from PySide6.QtCore import QThread, QTimer, QObject, QEvent, Signal, Qt
 from PySide6.QtGui import QShortcut, QKeySequence
 from PySide6.QtWidgets import QMessageBox
-from image_loader import ImageLoader
+from image_loader import ImageLoader, VolumeCache
 from annotation_manager import AnnotationManager
 from save_service import SaveService, SaveRequest
 import io_utils
@@ -21,17 +21,19 @@ class _SamWorker(QThread):
     error = Signal(str)
 
     def __init__(self, assistant, volume: np.ndarray, slice_idx: int,
-                 bbox_yx: tuple) -> None:
+                 bbox_yx: tuple, value_range: tuple = None) -> None:
         super().__init__()
         self._assistant = assistant
         self.volume = volume
         self.slice_idx = slice_idx
         self.bbox_yx = bbox_yx
+        self.value_range = value_range
 
     def run(self) -> None:
         try:
+            volume = io_utils.slab_aligned(self.volume, axis=0)
             mask = self._assistant.segment_volume(
-                self.volume, self.slice_idx, self.bbox_yx
+                volume, self.slice_idx, self.bbox_yx, self.value_range
             )
             self.result_ready.emit(mask)
         except Exception as exc:
@@ -40,6 +42,13 @@ class _SamWorker(QThread):
             self.volume = None  # liberar memoria del volumen
 
 
+class _LayerLoader(QObject):
+    """Avisa al hilo de la interfaz de que una imagen terminó de
+    decodificarse; la señal se emite desde el hilo del ``VolumeCache``."""
+
+    loaded = Signal(str)
+
+
 def _get_active_image_layer(viewer):
     return next(
         (l for l in viewer.layers
@@ -48,7 +57,33 @@ def _get_active_image_layer(viewer):
     )
 
 
-def start_viewer(patient_id, base_dir=None):
+def _slide_last_axis(viewer, layer):
+    """Pone el último eje de un volumen en el deslizador (ver
+    ``io_utils.NIFTI_SLAB``); con una imagen 2D vuelve al orden normal."""
+    ndim = viewer.dims.ndim
+    if layer.ndim >= 3 and ndim >= 3:
+        viewer.dims.order = (*range(ndim - 3), ndim - 1, ndim - 3, ndim - 2)
+    else:
+        viewer.dims.order = tuple(range(ndim))
+
+
+def _placeholder(shape):
+    """Capa sin decodificar: ceros de la forma final que no ocupan memoria."""
+    return np.broadcast_to(np.float32(0), shape)
+
+
+def _is_placeholder(data):
+    return isinstance(data, np.ndarray) and data.ndim > 0 and not any(data.strides)
+
+
+def resolve_lazy_loading(lazy=None):
+    """Argumento > VIEWER_LAZY (por defecto activo; 0 carga todo al abrir)."""
+    if lazy is not None:
+        return lazy
+    return os.environ.get("VIEWER_LAZY", "1").strip() != "0"
+
+
+def start_viewer(patient_id, base_dir=None, lazy=None):
     if base_dir is None:
         base_dir = os.environ.get("BASE_DIR", "/Volumes/HRAEPY")
     base_path = io_utils.find_patient_path(patient_id, base_dir)
@@ -60,23 +95,39 @@ def start_viewer(patient_id, base_dir=None):
     viewer = napari.Viewer(title=f"Annotator - Patient: {patient_id}")
 
     loader = ImageLoader(base_path)
-    images = loader.load_all_images()
+    cache = None
+    entries = {}
+    if resolve_lazy_loading(lazy):
+        # Solo se decodifica la primera imagen; el resto, al mostrarse.
+        images = loader.list_images()
+        cache = VolumeCache(loader)
+        entries = {info['filename']: info for info in images}
+        if images:
+            try:
+                images[0] = cache.get(images[0])
+            except Exception as e:
+                print(f"Error en {images[0]['filename']}: {e}")
+    else:
+        images = loader.load_all_images()
 
     if not images:
         viewer.close()
         return
 
     for idx, image_info in enumerate(images):
+        data = image_info['data']
         viewer.add_image(
-            image_info['data'],
+            data if data is not None else _placeholder(image_info['shape']),
             name=image_info['name'],
             colormap=image_info['colormap'],
-            contrast_limits=image_info['contrast_limits'],
+            contrast_limits=image_info['contrast_limits'] or [0.0, 1.0],
             visible=(idx == 0),
             metadata={
                 'filename': image_info['filename'],
                 'affine': image_info['affine'],
-                'voxel_spacing': image_info.get('voxel_spacing')
+                'voxel_spacing': image_info.get('voxel_spacing'),
+                'stats': image_info.get('stats'),
+                'scaling': image_info.get('scaling'),
             }
         )
 
@@ -157,10 +208,65 @@ def start_viewer(patient_id, base_dir=None):
             annotator, first_layer.metadata['filename'], output_dir
         )
 
+    def _image_layers():
+        return [l for l in viewer.layers if isinstance(l, napari.layers.Image)]
+
+    layer_loader = _LayerLoader()
+
+    def _evict_hidden():
+        layers = _image_layers()
+        pinned = {l.metadata.get('filename') for l in layers if l.visible}
+        pinned.add(annotator.active_filename)
+        evicted = set(cache.evict(pinned))
+        for other in layers:
+            if other.metadata.get('filename') in evicted:
+                other.data = _placeholder(other.data.shape)
+
+    def _ensure_loaded(layer):
+        """Pide en segundo plano la capa si aún es un marcador (se asigna en
+        :func:`_on_layer_loaded`), adelanta la lectura de sus vecinas y
+        libera las ocultas que excedan el presupuesto."""
+        if cache is None:
+            return
+        filename = layer.metadata.get('filename')
+        if _is_placeholder(layer.data):
+            viewer.status = f"Cargando {filename}..."
+            cache.prefetch(entries[filename]).add_done_callback(
+                lambda _future, fn=filename: layer_loader.loaded.emit(fn)
+            )
+
+        layers = _image_layers()
+        idx = layers.index(layer)
+        for neighbour in (layers[idx + 1:idx + 2] + layers[max(idx - 1, 0):idx]):
+            cache.prefetch(entries[neighbour.metadata['filename']])
+        _evict_hidden()
+
+    def _on_layer_loaded(filename):
+        """En el hilo de la interfaz: asigna la imagen ya decodificada si su
+        capa sigue visible y sin datos. ``cache.get`` no espera, porque la
+        lectura ya terminó."""
+        layer = next((l for l in _image_layers() if l.metadata.get('filename') == filename), None)
+        if layer is None or not layer.visible or not _is_placeholder(layer.data):
+            return
+        try:
+            info = cache.get(entries[filename])
+        except Exception as e:
+            viewer.status = f"Error cargando {filename}: {e}"
+            return
+        layer.data = info['data']
+        layer.contrast_limits = info['contrast_limits']
+        layer.metadata['scaling'] = info['scaling']
+        viewer.status = filename
+        _evict_hidden()
+
+    layer_loader.loaded.connect(_on_layer_loaded, Qt.ConnectionType.QueuedConnection)
+
     def on_visibility_change(event):
         layer = event.source
         if not isinstance(layer, napari.layers.Image) or not layer.visible:
             return
+        _slide_last_axis(viewer, layer)
+        _ensure_loaded(layer)
         filename = layer.metadata.get('filename')
         if not filename or filename == annotator.active_filename:
             return
@@ -171,6 +277,9 @@ def start_viewer(patient_id, base_dir=None):
     for layer in viewer.layers:
         if isinstance(layer, napari.layers.Image):
             layer.events.visible.connect(on_visibility_change)
+    if first_layer:
+        _slide_last_axis(viewer, first_layer)
+        _ensure_loaded(first_layer)
 
     def _save_session():
         active_layer = _get_active_image_layer(viewer)
@@ -374,14 +483,20 @@ def start_viewer(patient_id, base_dir=None):
             data = active_layer.data
             ndim = data.ndim
             step = viewer.dims.current_step
+            stats = active_layer.metadata.get('stats')
+            value_range = None
 
             if ndim == 3:
                 slice_idx = int(step[ndim - 1])
-                volume = np.moveaxis(np.asarray(data), -1, 0)
+                volume = np.moveaxis(data, -1, 0)
                 _sam_state['transpose_mask'] = True
+                if stats is not None:
+                    value_range = tuple(io_utils.to_stored_units(
+                        (stats['min'], stats['max']), active_layer.metadata.get('scaling')
+                    ))
             elif ndim == 4:
                 slice_idx = int(step[ndim - 1])
-                volume = np.moveaxis(np.asarray(data[int(step[0])]), -1, 0)
+                volume = np.moveaxis(data[int(step[0])], -1, 0)
                 _sam_state['transpose_mask'] = True
             else:
                 viewer.status = f"Dimensiones {ndim}D no soportadas por SAM."
@@ -390,7 +505,7 @@ def start_viewer(patient_id, base_dir=None):
 
             viewer.status = "⏳ SAM2 procesando…"
 
-            worker = _SamWorker(_sam, volume, slice_idx, (r0, c0, r1, c1))
+            worker = _SamWorker(_sam, volume, slice_idx, (r0, c0, r1, c1), value_range)
             worker.result_ready.connect(_on_sam_result)
             worker.error.connect(_on_sam_error)
             _sam_state['worker'] = worker
@@ -611,6 +726,8 @@ def start_viewer(patient_id, base_dir=None):
     napari.run()
     saver.stop()
     debounce_timer.stop()
+    if cache is not None:
+        cache.close()
 
 def _resolve_path(output_dir, filename, suffix):
     """Devuelve la ruta correcta del artefacto, con compatibilidad hacia atrás."""
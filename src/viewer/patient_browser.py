@@ -27,6 +27,8 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
+from io_utils import IMAGE_2D_EXTENSIONS
+
 def _default_base_dir() -> str:
     env = os.environ.get("BASE_DIR")
     if env:
@@ -55,7 +57,7 @@ DEFAULT_BASE_DIR = _default_base_dir()
 CATEGORY_DIRS = ("MAMA", "PROSTATA")
 PROCESSED_SUBDIR = "PROCESSED_DATA"
 ANNOTATIONS_SUBDIR = "ANNOTATIONS"
-VALID_EXTENSIONS = {".nii", ".nii.gz", ".png"}
+VALID_EXTENSIONS = {".nii", ".nii.gz", ".zarr", *IMAGE_2D_EXTENSIONS}
 
 @dataclass
 class PatientInfo:
@@ -74,14 +76,20 @@ def _scan_patient(patient_dir: Path, category: str) -> Optional[PatientInfo]:
 
     nifti_count = 0
     png_count = 0
+    nifti_stems, zarr_stems = set(), set()
     for f in patient_dir.iterdir():
         if f.name.startswith("."):
             continue
         name_lower = f.name.lower()
         if name_lower.endswith(".nii.gz") or name_lower.endswith(".nii"):
             nifti_count += 1
-        elif name_lower.endswith(".png"):
+            nifti_stems.add(name_lower.removesuffix(".gz").removesuffix(".nii"))
+        elif name_lower.endswith(".zarr"):
+            zarr_stems.add(name_lower.removesuffix(".zarr"))
+        elif name_lower.endswith(IMAGE_2D_EXTENSIONS):
             png_count += 1
+    # Un volumen convertido solo a Zarr cuenta como uno más; junto a su NIfTI, no.
+    nifti_count += len(zarr_stems - nifti_stems)
 
     ann_dir = patient_dir / ANNOTATIONS_SUBDIR
     has_ann = ann_dir.is_dir() and any(ann_dir.iterdir())
@@ -130,6 +130,7 @@ class SAM2Assistant:
         volume: np.ndarray,
         slice_idx: int,
         bbox_yx: tuple[int, int, int, int],
+        value_range: Optional[tuple[float, float]] = None,
     ) -> np.ndarray:
         """
         Segmenta un tumor en todo el volumen 3D usando SAM2.
@@ -138,9 +139,12 @@ class SAM2Assistant:
         hacia todos los slices del volumen (hacia arriba y hacia abajo).
 
         Args:
-            volume:    Array 3D de shape (Z, Y, X), cualquier dtype numérico.
+            volume:    Array 3D de shape (Z, Y, X), cualquier dtype numérico;
+                       puede ser un memmap o dask array: se lee slice a slice.
             slice_idx: Índice Z del slice donde se dibujó la bounding box.
             bbox_yx:   Tupla (row_min, col_min, row_max, col_max) en píxeles.
+            value_range: (min, max) precalculados del volumen (sidecar de
+                         estadísticas); si falta se recorre el volumen.
 
         Returns:
             mask_3d: Array bool de shape (Z, Y, X). True = tumor.
@@ -149,26 +153,26 @@ class SAM2Assistant:
 
         Z, H, W = volume.shape
 
-        v_min = float(volume.min())
-        v_max = float(volume.max())
-        if v_max > v_min:
-            vol_u8 = (
-                (volume.astype(np.float32) - v_min) / (v_max - v_min) * 255
-            ).astype(np.uint8)
+        if value_range is not None:
+            v_min, v_max = float(value_range[0]), float(value_range[1])
         else:
-            vol_u8 = np.zeros((Z, H, W), dtype=np.uint8)
+            v_min = float(volume.min())
+            v_max = float(volume.max())
 
         tmpdir = tempfile.mkdtemp(prefix="sam2_vol_")
         try:
             for z in range(Z):
-                rgb = np.stack([vol_u8[z]] * 3, axis=-1)
+                if v_max > v_min:
+                    slice_u8 = (
+                        (np.asarray(volume[z], dtype=np.float32) - v_min) / (v_max - v_min) * 255
+                    ).astype(np.uint8)
+                else:
+                    slice_u8 = np.zeros((H, W), dtype=np.uint8)
+                rgb = np.stack([slice_u8] * 3, axis=-1)
                 Image.fromarray(rgb).save(
                     os.path.join(tmpdir, f"{z:05d}.jpg"), quality=95
                 )
 
-            del vol_u8
-            gc.collect()
-
             r0, c0, r1, c1 = bbox_yx
             r0 = max(0, min(int(r0), H - 1))
             c0 = max(0, min(int(c0), W - 1))
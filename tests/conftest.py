@@ -4,9 +4,11 @@ from pathlib import Path
 import numpy as np
 import pytest
 
-_VIEWER_DIR = str(Path(__file__).resolve().parent.parent / "src" / "viewer")
-if _VIEWER_DIR not in sys.path:
-    sys.path.insert(0, _VIEWER_DIR)
+_SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+for _subdir in ("viewer", "preprocessing", "pipeline"):
+    _path = str(_SRC_DIR / _subdir)
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
 
 @pytest.fixture
 def identity_affine():
@@ -61,4 +63,47 @@ def patient_tree(tmp_path):
     mask = np.zeros((2, 4, 4), dtype=np.uint16)
     nib.save(nib.Nifti1Image(mask, np.eye(4)), ann_dir / "mask.nii.gz")
 
-    return base
\ No newline at end of file
+    return base
+
+@pytest.fixture
+def dicom_patient(tmp_path):
+    """Copia de los DICOM de prueba de pydicom como un paciente::
+
+        tmp/raw/PAC001/CT_small.dcm, MR_small.dcm
+    """
+    import shutil
+    from pydicom.data import get_testdata_file
+
+    folder = tmp_path / "raw" / "PAC001"
+    folder.mkdir(parents=True)
+    for name in ("CT_small.dcm", "MR_small.dcm"):
+        shutil.copy(get_testdata_file(name), folder / name)
+    return folder
+
+@pytest.fixture
+def ct_series():
+    """Construye una serie de ``count`` cortes de CT_small apilados a lo
+    largo de la normal, la guarda en ``folder`` y devuelve los datasets."""
+    import pydicom
+    from pydicom.data import get_testdata_file
+    from pydicom.uid import generate_uid
+
+    def build(folder, row=(1.0, 0.0, 0.0), col=(0.0, 1.0, 0.0), spacing=2.5, count=4):
+        folder.mkdir(parents=True, exist_ok=True)
+        normal = np.cross(row, col)
+        origin = np.array([-158.0, -179.0, -75.0])
+        series_uid = generate_uid()
+        datasets = []
+        for i in range(count):
+            ds = pydicom.dcmread(get_testdata_file("CT_small.dcm"))
+            ds.SeriesInstanceUID = series_uid
+            ds.SOPInstanceUID = generate_uid()
+            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+            ds.InstanceNumber = i + 1
+            ds.ImageOrientationPatient = [*row, *col]
+            ds.ImagePositionPatient = (origin + i * spacing * normal).tolist()
+            ds.save_as(folder / f"{i}.dcm")
+            datasets.append(ds)
+        return datasets
+
+    return build
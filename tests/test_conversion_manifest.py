@@ -0,0 +1,48 @@
+from conversion_manifest import ConversionManifest, input_fingerprint
+
+SETTINGS = {"engine": "dcm2niix"}
+
+
+def _outputs(folder):
+    folder.mkdir(parents=True, exist_ok=True)
+    names = ["PAC_T1_3.nii.gz", "PAC_T1_3.json"]
+    for name in names + ["PAC_T1_3.nii.gz.stats.json", "PAC_T1_3.nii.gz.gzidx"]:
+        (folder / name).write_text("x")
+    (folder / "PAC_T1_3.zarr").mkdir()
+    return names
+
+
+class TestConversionManifest:
+    def test_recorded_series_is_current_after_reload(self, dicom_patient, tmp_path):
+        files = sorted(dicom_patient.iterdir())
+        fingerprint = input_fingerprint(files, ["1.2.3", "1.2.4"], SETTINGS)
+        out = tmp_path / "ANONPAC001"
+        manifest = ConversionManifest(out)
+        manifest.record("1.2.9", fingerprint, _outputs(out))
+        manifest.save()
+
+        reloaded = ConversionManifest(out)
+        assert reloaded.is_current("1.2.9", fingerprint)
+        assert not reloaded.is_current("1.2.9", input_fingerprint(files, ["1.2.3", "1.2.4"], {"engine": "native"}))
+        assert not reloaded.is_current("1.2.10", fingerprint)
+
+    def test_changed_inputs_or_missing_outputs_are_not_current(self, dicom_patient, tmp_path):
+        files = sorted(dicom_patient.iterdir())
+        fingerprint = input_fingerprint(files, ["1.2.3", "1.2.4"], SETTINGS)
+        out = tmp_path / "ANONPAC001"
+        manifest = ConversionManifest(out)
+        manifest.record("1.2.9", fingerprint, _outputs(out))
+
+        assert input_fingerprint(files[:1], ["1.2.3"], SETTINGS) != fingerprint
+        (out / "PAC_T1_3.nii.gz").unlink()
+        assert not manifest.is_current("1.2.9", fingerprint)
+
+    def test_discard_removes_outputs_and_companions(self, tmp_path):
+        out = tmp_path / "ANONPAC001"
+        manifest = ConversionManifest(out)
+        manifest.record("1.2.9", "abc", _outputs(out))
+        (out / "other.nii.gz").write_text("x")
+
+        manifest.discard("1.2.9")
+        assert "1.2.9" not in manifest.entries
+        assert sorted(p.name for p in out.iterdir()) == ["other.nii.gz"]
@@ -0,0 +1,195 @@
+import os
+from copy import deepcopy
+
+import pydicom
+
+import dicom_processor
+from anon_journal import AnonymizationJournal, file_digest
+from anon_pipeline import PipelineConfig
+from dicom_processor import (
+    PROFILE_VERSION,
+    AnonymizeJob,
+    anonymize_dicom_ps315,
+    anonymize_file,
+    anonymize_jobs,
+    collect_jobs,
+)
+
+SALT = "sal-de-prueba"
+
+
+def _jobs(src, dst):
+    return collect_jobs(src, dst, src.name)
+
+
+class TestPassthrough:
+    def test_output_equals_full_read_and_save(self, dicom_patient, tmp_path):
+        for job in _jobs(dicom_patient, tmp_path / "direct"):
+            anonymize_file(job, SALT, passthrough=True)
+            decoded = AnonymizeJob(job.src, tmp_path / "decoded" / job.dst.name, job.patient_id)
+            anonymize_file(decoded, SALT, passthrough=False)
+
+            assert job.dst.read_bytes() == decoded.dst.read_bytes()
+
+    def test_digest_is_computed_while_copying(self, dicom_patient, tmp_path):
+        for passthrough in (True, False):
+            for job in _jobs(dicom_patient, tmp_path / str(passthrough)):
+                digest = anonymize_file(job, SALT, passthrough, with_digest=True)
+                assert digest == file_digest(job.src)
+
+    def test_header_is_anonymized(self, dicom_patient, tmp_path):
+        for job in _jobs(dicom_patient, tmp_path / "out"):
+            anonymize_file(job, SALT)
+            ds = pydicom.dcmread(job.dst)
+            assert ds.PatientID == "ANONPAC001"
+            assert ds.PatientName == "ANONYMIZED"
+            assert ds.SOPInstanceUID != pydicom.dcmread(job.src).SOPInstanceUID
+
+
+class TestPlanCache:
+    def _plans(self, monkeypatch):
+        built = []
+        plan = dicom_processor.AnonymizationPlan
+        monkeypatch.setattr(dicom_processor, "AnonymizationPlan", lambda *a: built.append(a[0].SeriesInstanceUID) or plan(*a))
+        dicom_processor._PLAN_CACHE.clear()
+        return built
+
+    def test_plan_is_shared_within_a_series_only(self, ct_series, tmp_path, monkeypatch):
+        first = ct_series(tmp_path / "S1", count=3)
+        second = ct_series(tmp_path / "S2", count=2)
+        built = self._plans(monkeypatch)
+
+        cached = [anonymize_dicom_ps315(deepcopy(ds), SALT, "PAC001") for ds in first + second]
+        assert built == [first[0].SeriesInstanceUID, second[0].SeriesInstanceUID]
+
+        anonymize_dicom_ps315(deepcopy(first[0]), "otra-sal", "PAC001")
+        assert len(built) == 3
+
+        for ds, expected in zip(first + second, cached):
+            dicom_processor._PLAN_CACHE.clear()
+            assert anonymize_dicom_ps315(deepcopy(ds), SALT, "PAC001") == expected
+
+
+class TestParallel:
+    def _series(self, ct_series, tmp_path):
+        src = tmp_path / "raw" / "PAC001"
+        ct_series(src / "S1", count=3)
+        ct_series(src / "S2", count=3)
+        return collect_jobs(src, tmp_path / "ANONPAC001", "PAC001")
+
+    def test_output_equals_serial_path(self, ct_series, tmp_path):
+        jobs = self._series(ct_series, tmp_path)
+        serial = [AnonymizeJob(j.src, tmp_path / "serial" / j.dst.relative_to(tmp_path / "ANONPAC001"), j.patient_id)
+                  for j in jobs]
+        assert [e for _, e in anonymize_jobs(serial, SALT, max_workers=1)] == [None] * len(jobs)
+
+        results = list(anonymize_jobs(jobs, SALT, max_workers=2, chunk_size=2))
+
+        assert sorted((j.src, e) for j, e in results) == sorted((j.src, None) for j in jobs)
+        for job, ref in zip(jobs, serial):
+            assert job.dst.read_bytes() == ref.dst.read_bytes()
+
+    def test_should_stop_drops_queued_shards(self, ct_series, tmp_path):
+        jobs = self._series(ct_series, tmp_path)
+        stop = []
+
+        results = []
+        for result in anonymize_jobs(jobs, SALT, max_workers=2, chunk_size=1, should_stop=lambda: bool(stop)):
+            results.append(result)
+            stop.append(True)
+
+        # Con 2 procesos hay como mucho 4 bloques en curso; los otros 2 se descartan.
+        assert 1 <= len(results) <= 4
+        assert sum(job.dst.exists() for job in jobs) == len(results)
+
+
+class TestPipeline:
+    def test_pipeline_output_and_digest_match_file_by_file(self, dicom_patient, tmp_path):
+        serial = _jobs(dicom_patient, tmp_path / "serial")
+        for job in serial:
+            anonymize_file(job, SALT)
+
+        out = tmp_path / "ANONYMIZED"
+        jobs = _jobs(dicom_patient, out / "ANONPAC001")
+        pipeline = PipelineConfig(max_buffer_mb=1)
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            results = list(anonymize_jobs(jobs, SALT, journal=journal, pipeline=pipeline))
+            assert [error for _, error in results] == [None, None]
+            pending, _ = journal.partition(jobs)
+        assert pending == []
+        for job, ref in zip(jobs, serial):
+            assert job.dst.read_bytes() == ref.dst.read_bytes()
+
+    def test_invalid_env_falls_back_to_file_by_file(self, monkeypatch):
+        monkeypatch.setenv("DICOM_PIPELINE", "2,x,2")
+        assert PipelineConfig.from_env() is None
+
+
+class TestJournalResume:
+    def _run(self, jobs, journal):
+        return [job for job, error in anonymize_jobs(jobs, SALT, journal=journal) if error is None]
+
+    def test_second_run_skips_recorded_files(self, dicom_patient, tmp_path):
+        out = tmp_path / "ANONYMIZED"
+        jobs = _jobs(dicom_patient, out / "ANONPAC001")
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            assert len(self._run(jobs, journal)) == 2
+
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            pending, skipped = journal.partition(jobs)
+        assert pending == [] and len(skipped) == 2
+
+    def test_changed_or_missing_output_is_redone(self, dicom_patient, tmp_path):
+        out = tmp_path / "ANONYMIZED"
+        jobs = _jobs(dicom_patient, out / "ANONPAC001")
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            self._run(jobs, journal)
+
+        changed, removed = jobs
+        with open(changed.src, "ab") as f:
+            f.write(b"\0\0")
+        removed.dst.unlink()
+
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            pending, _ = journal.partition(jobs)
+        assert sorted(pending, key=str) == sorted(jobs, key=str)
+
+    def test_touched_file_with_same_content_is_skipped(self, dicom_patient, tmp_path):
+        out = tmp_path / "ANONYMIZED"
+        jobs = _jobs(dicom_patient, out / "ANONPAC001")
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            self._run(jobs, journal)
+        st = jobs[0].src.stat()
+        os.utime(jobs[0].src, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            pending, _ = journal.partition(jobs)
+        assert pending == []
+
+    def test_other_salt_redoes_everything(self, dicom_patient, tmp_path):
+        out = tmp_path / "ANONYMIZED"
+        jobs = _jobs(dicom_patient, out / "ANONPAC001")
+        with AnonymizationJournal(out, SALT, PROFILE_VERSION) as journal:
+            self._run(jobs, journal)
+
+        with AnonymizationJournal(out, "otra-sal", PROFILE_VERSION) as journal:
+            pending, _ = journal.partition(jobs)
+        assert len(pending) == 2
+
+    def test_converted_patient_survives_removed_scratch_copy(self, dicom_patient, tmp_path):
+        root = tmp_path / "PROCESSED_DATA"
+        jobs = _jobs(dicom_patient, tmp_path / "_temp_anon" / "ANONPAC001")
+        settings = {"engine": "dcm2niix"}
+        with AnonymizationJournal(root, SALT, PROFILE_VERSION) as journal:
+            self._run(jobs, journal)
+            journal.mark_converted("PAC001", jobs, settings)
+        for job in jobs:
+            job.dst.unlink()
+
+        with AnonymizationJournal(root, SALT, PROFILE_VERSION) as journal:
+            assert journal.is_converted("PAC001", jobs, settings)
+            assert not journal.is_converted("PAC001", jobs, {"engine": "native"})
+            assert not journal.is_converted("PAC001", jobs[:1], settings)
+            with open(jobs[0].src, "ab") as f:
+                f.write(b"\0\0")
+            assert not journal.is_converted("PAC001", jobs, settings)
@@ -0,0 +1,52 @@
+import shutil
+
+from pydicom.data import get_testdata_file
+
+from dicom_triage import INVALID, QUARANTINED, VALID, sniff, triage_folder
+
+
+class TestSniff:
+    def test_valid_file(self, dicom_patient):
+        record = sniff(dicom_patient / "CT_small.dcm")
+        assert record.status == VALID
+        assert record.modality == "CT"
+        assert record.instance_uid and record.series_uid
+
+    def test_truncated_pixels_are_quarantined(self, dicom_patient):
+        path = dicom_patient / "CT_small.dcm"
+        raw = path.read_bytes()
+        path.write_bytes(raw[:-1000])
+
+        record = sniff(path)
+        assert record.status == QUARANTINED
+        assert "truncado" in record.reason
+
+    def test_dicomdir_is_invalid(self, tmp_path):
+        path = tmp_path / "DICOMDIR"
+        shutil.copy(get_testdata_file("DICOMDIR"), path)
+
+        record = sniff(path)
+        assert record.status == INVALID
+        assert record.reason == "DICOMDIR"
+
+    def test_non_dicom_is_invalid(self, tmp_path):
+        path = tmp_path / "notas.txt"
+        path.write_text("no es una imagen")
+        assert sniff(path).status == INVALID
+
+    def test_dcm_without_preamble_is_quarantined(self, tmp_path):
+        path = tmp_path / "roto.dcm"
+        path.write_bytes(b"\0" * 64)
+        assert sniff(path).status == QUARANTINED
+
+
+class TestTriageFolder:
+    def test_only_valid_files_are_listed(self, dicom_patient):
+        (dicom_patient / "CT_small.dcm").write_bytes((dicom_patient / "CT_small.dcm").read_bytes()[:-1000])
+        shutil.copy(get_testdata_file("DICOMDIR"), dicom_patient / "DICOMDIR")
+
+        manifest = triage_folder(dicom_patient, max_workers=2)
+        assert manifest.files() == [dicom_patient / "MR_small.dcm"]
+        assert [r.path.name for r in manifest.quarantined] == ["CT_small.dcm"]
+        assert [r.path.name for r in manifest.invalid] == ["DICOMDIR"]
+        assert manifest.modality() == "MR"
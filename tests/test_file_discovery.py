@@ -0,0 +1,130 @@
+import os
+
+import file_discovery
+from file_discovery import DiscoveryCache, first_file, iter_files, list_dir, walk_files
+
+
+def _touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    return path
+
+
+def _names(paths, root):
+    return sorted(p.relative_to(root).as_posix() for p in paths)
+
+
+class TestIterFiles:
+    def test_skips_hidden_and_excluded(self, tmp_path):
+        _touch(tmp_path / "a.dcm")
+        _touch(tmp_path / ".oculto.dcm")
+        _touch(tmp_path / ".git" / "b.dcm")
+        _touch(tmp_path / "serie" / "c.DCM")
+        _touch(tmp_path / "serie" / "notas.txt")
+        _touch(tmp_path / "PROCESSED_DATA" / "d.dcm")
+
+        found = iter_files(tmp_path, ".dcm", exclude=("PROCESSED_DATA",))
+
+        assert _names(found, tmp_path) == ["a.dcm", "serie/c.DCM"]
+
+    def test_without_suffix_lists_everything(self, tmp_path):
+        _touch(tmp_path / "b" / "x.txt")
+        _touch(tmp_path / "a.dcm")
+
+        assert _names(walk_files(tmp_path), tmp_path) == ["a.dcm", "b/x.txt"]
+
+    def test_folder_before_subfolders(self, tmp_path):
+        _touch(tmp_path / "a" / "profundo.dcm")
+        _touch(tmp_path / "z.dcm")
+
+        assert next(iter_files(tmp_path, ".dcm")).name == "z.dcm"
+
+    def test_missing_folder_is_empty(self, tmp_path):
+        assert list(iter_files(tmp_path / "no-existe")) == []
+
+
+class TestFirstFile:
+    def test_stops_after_first_match(self, tmp_path, monkeypatch):
+        for i in range(6):
+            _touch(tmp_path / f"serie{i}" / "a.dcm")
+        scanned = []
+        real_scandir = os.scandir
+
+        def counting_scandir(path):
+            scanned.append(path)
+            return real_scandir(path)
+
+        monkeypatch.setattr(file_discovery.os, "scandir", counting_scandir)
+
+        found = first_file(tmp_path)
+
+        assert found.name == "a.dcm"
+        assert len(scanned) == 2
+
+    def test_none_without_match(self, tmp_path):
+        _touch(tmp_path / "notas.txt")
+
+        assert first_file(tmp_path) is None
+
+
+class TestListDir:
+    def test_sorted_and_visible(self, tmp_path):
+        for name in ("c.dcm", "a.dcm", "b.txt", ".oculto"):
+            _touch(tmp_path / name)
+        for name in ("zeta", "alfa", ".cache"):
+            (tmp_path / name).mkdir()
+
+        dirs, files = list_dir(tmp_path)
+
+        assert [d.name for d in dirs] == ["alfa", "zeta"]
+        assert [f.name for f in files] == ["a.dcm", "b.txt", "c.dcm"]
+
+    def test_missing_folder(self, tmp_path):
+        assert list_dir(tmp_path / "no-existe") == ([], [])
+
+
+class TestDiscoveryCache:
+    def test_files_are_cached_until_forget(self, tmp_path):
+        _touch(tmp_path / "a.dcm")
+        cache = DiscoveryCache()
+        assert cache.files(tmp_path) == [tmp_path / "a.dcm"]
+
+        _touch(tmp_path / "b.dcm")
+        assert cache.files(tmp_path) == [tmp_path / "a.dcm"]
+
+        cache.forget(tmp_path)
+        assert cache.files(tmp_path) == [tmp_path / "a.dcm", tmp_path / "b.dcm"]
+
+    def test_forget_all(self, tmp_path):
+        one, two = tmp_path / "uno", tmp_path / "dos"
+        _touch(one / "a.dcm")
+        _touch(two / "a.dcm")
+        cache = DiscoveryCache()
+        cache.files(one)
+        cache.files(two)
+        _touch(one / "b.dcm")
+        _touch(two / "b.dcm")
+
+        cache.forget()
+
+        assert len(cache.files(one)) == len(cache.files(two)) == 2
+
+    def test_returned_list_is_a_copy(self, tmp_path):
+        _touch(tmp_path / "a.dcm")
+        cache = DiscoveryCache()
+        cache.files(tmp_path).clear()
+
+        assert cache.files(tmp_path) == [tmp_path / "a.dcm"]
+
+    def test_first_uses_listing(self, tmp_path):
+        _touch(tmp_path / "b.dcm")
+        cache = DiscoveryCache()
+        assert cache.first(tmp_path) == tmp_path / "b.dcm"
+
+        cache.files(tmp_path)
+        _touch(tmp_path / "a.dcm")
+        assert cache.first(tmp_path) == tmp_path / "b.dcm"
+
+        cache.forget(tmp_path)
+        cache.files(tmp_path)
+        assert cache.first(tmp_path) == tmp_path / "a.dcm"
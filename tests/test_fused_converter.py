@@ -0,0 +1,40 @@
+import json
+
+from conversion_manifest import MANIFEST_FILENAME
+from dicom_processor import anonymize_uid
+from dicom_triage import triage_folder
+from fused_converter import FusedConverter
+from nifti_converter import SmartMedicalConverter
+
+SALT = "sal-de-prueba"
+
+
+def _fused(tmp_path):
+    converter = SmartMedicalConverter(str(tmp_path / "raw"), output_dir=str(tmp_path / "PROCESSED_DATA"), engine="native")
+    return FusedConverter(converter, SALT, scratch_dir=str(tmp_path / "scratch"))
+
+
+class TestFusedManifest:
+    def test_second_run_skips_converted_series(self, tmp_path, ct_series):
+        src = tmp_path / "raw" / "PAC001"
+        first = ct_series(src / "S1")
+        ct_series(src / "S2")
+
+        ok, modality, reason = _fused(tmp_path).convert_patient(src, "PAC001")
+        assert (ok, modality, reason) == (True, "CT", "3D processed: 2 NIfTIs")
+        manifest = json.loads((tmp_path / "PROCESSED_DATA" / "ANONPAC001" / MANIFEST_FILENAME).read_text())
+        assert anonymize_uid(first[0].SeriesInstanceUID, SALT) in manifest["series"]
+
+        assert _fused(tmp_path).convert_patient(src, "PAC001") == (True, "CT", "Up to date: 2 series skipped")
+
+    def test_changed_series_is_redone(self, tmp_path, ct_series):
+        src = tmp_path / "raw" / "PAC001"
+        ct_series(src / "S1")
+        ct_series(src / "S2")
+        _fused(tmp_path).convert_patient(src, "PAC001")
+        (src / "S2" / "3.dcm").unlink()
+
+        fused = _fused(tmp_path)
+        units = fused.check_manifest(fused.plan_patient(src, "PAC001", triage_folder(src)))
+        assert sorted(u.up_to_date for u in units) == [False, True]
+        assert fused.convert_patient(src, "PAC001") == (True, "CT", "3D processed: 1 NIfTIs, 1 series up to date")
@@ -0,0 +1,80 @@
+import os
+import shutil
+
+import pydicom
+import pytest
+
+from dicom_explorer import DicomExplorer
+from header_index import HeaderIndex
+
+
+def _index(dicom_patient, tmp_path):
+    return HeaderIndex(dicom_patient.parent, index_path=str(tmp_path / "index.sqlite"))
+
+
+class TestHeaderIndex:
+    def test_refresh_only_rereads_changed_files(self, dicom_patient, tmp_path):
+        with _index(dicom_patient, tmp_path) as index:
+            assert index.refresh(max_workers=1) == {"added": 2, "updated": 0, "removed": 0, "unchanged": 0}
+            assert index.refresh(max_workers=1) == {"added": 0, "updated": 0, "removed": 0, "unchanged": 2}
+
+            ct = dicom_patient / "CT_small.dcm"
+            st = ct.stat()
+            os.utime(ct, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            (dicom_patient / "MR_small.dcm").unlink()
+            shutil.copy(ct, dicom_patient / "copy.dcm")
+
+            assert index.refresh(max_workers=1) == {"added": 1, "updated": 1, "removed": 1, "unchanged": 0}
+            assert index.get(dicom_patient / "MR_small.dcm") is None
+
+    def test_parallel_refresh_matches_serial(self, dicom_patient, tmp_path):
+        with HeaderIndex(dicom_patient.parent, index_path=str(tmp_path / "serial.sqlite")) as serial:
+            serial.refresh(max_workers=1)
+            with _index(dicom_patient, tmp_path) as index:
+                assert index.refresh(max_workers=2)["added"] == 2
+                assert index.series() == serial.series()
+
+    def test_find_by_indexed_column(self, dicom_patient, tmp_path):
+        with _index(dicom_patient, tmp_path) as index:
+            index.refresh(max_workers=1)
+
+            assert index.find(Modality="MR") == [dicom_patient / "MR_small.dcm"]
+            assert index.find(Modality="CT", limit=1) == [dicom_patient / "CT_small.dcm"]
+            assert index.find(Modality="US") == []
+
+    def test_find_rejects_unindexed_columns(self, dicom_patient, tmp_path):
+        with _index(dicom_patient, tmp_path) as index:
+            with pytest.raises(ValueError, match="PixelData"):
+                index.find(PixelData=b"")
+
+    def test_folders_count_readable_headers(self, dicom_patient, tmp_path):
+        (dicom_patient / "notes.txt").write_text("no es DICOM")
+        (dicom_patient.parent / "loose.dcm").write_bytes(b"")
+        with _index(dicom_patient, tmp_path) as index:
+            index.refresh(max_workers=1)
+
+            assert index.folders() == [("PAC001", 2, dicom_patient / "CT_small.dcm")]
+            assert [path for path, _ in index.errors()] != []
+
+
+class TestDicomExplorer:
+    def test_structure_counts_dcm_files_of_each_folder(self, dicom_patient, tmp_path):
+        (dicom_patient / "sub").mkdir()
+        shutil.copy(dicom_patient / "CT_small.dcm", dicom_patient / "sub" / "nested.dcm")
+        (dicom_patient.parent / "EMPTY").mkdir()
+        explorer = DicomExplorer(dicom_patient.parent, index_path=str(tmp_path / "index.sqlite"))
+
+        info = explorer.explore_structure()
+
+        assert [(i["folder"], i["num_files"], i["first_file"]) for i in info] == [
+            ("EMPTY", 0, None),
+            ("PAC001", 2, dicom_patient / "CT_small.dcm"),
+        ]
+
+    def test_explore_dicom_file_returns_a_dataset(self, dicom_patient, tmp_path):
+        explorer = DicomExplorer(dicom_patient.parent, index_path=str(tmp_path / "index.sqlite"))
+
+        ds = explorer.explore_dicom_file(dicom_patient / "MR_small.dcm")
+
+        assert isinstance(ds, pydicom.Dataset) and ds.Modality == "MR"
+        assert explorer.index.get(dicom_patient / "MR_small.dcm")["Modality"] == "MR"
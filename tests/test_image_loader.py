@@ -1,8 +1,14 @@
+import json
+
+import dask.array as da
 import nibabel as nib
 import numpy as np
 from PIL import Image
+import tifffile
+import zarr
 
-from image_loader import ImageLoader
+import io_utils
+from image_loader import ImageLoader, VolumeCache
 
 
 class TestImageLoaderNifti:
@@ -122,6 +128,87 @@ class TestImageLoaderPng:
 
         assert results[0]["name"].startswith("2D_")
 
+    def test_loads_tiff_and_npy_mammography_exports(self, tmp_path):
+        img = np.arange(4096, dtype=np.uint16).reshape(64, 64)
+        tifffile.imwrite(tmp_path / "L_CC_0.tiff", img)
+        np.save(tmp_path / "R_CC_1.npy", img)
+        Image.fromarray(img).save(tmp_path / "R_MLO_2.png")
+
+        results = ImageLoader(tmp_path).load_all_images()
+
+        assert [r["filename"] for r in results] == ["L_CC_0.tiff", "R_CC_1.npy", "R_MLO_2.png"]
+        for r in results:
+            assert r["type"] == "2D"
+            np.testing.assert_array_equal(r["data"], img)
+
+
+class TestImageLoaderStats:
+    def _write_stats(self, image, p2, p98):
+        stats = {
+            "version": io_utils.STATS_VERSION,
+            "size": image.stat().st_size,
+            "min": p2, "max": p98,
+            "percentiles": {"2": p2, "98": p98},
+        }
+        (image.parent / (image.name + io_utils.STATS_SUFFIX)).write_text(json.dumps(stats))
+
+    def test_contrast_limits_come_from_sidecar(self, tmp_path, identity_affine):
+        nib.save(nib.Nifti1Image(np.zeros((2, 2, 2), dtype=np.float32), identity_affine), tmp_path / "v.nii.gz")
+        self._write_stats(tmp_path / "v.nii.gz", -5.0, 5.0)
+
+        r = ImageLoader(tmp_path).load_all_images()[0]
+
+        assert r["contrast_limits"] == [-5.0, 5.0]
+        assert r["stats"]["max"] == 5.0
+
+    def test_2d_contrast_limits_come_from_sidecar(self, tmp_path):
+        np.save(tmp_path / "L_CC_0.npy", np.zeros((4, 4), dtype=np.uint16))
+        self._write_stats(tmp_path / "L_CC_0.npy", 10.0, 20.0)
+
+        r = ImageLoader(tmp_path).load_all_images()[0]
+
+        assert r["contrast_limits"] == [10.0, 20.0]
+
+    def test_without_sidecar_percentiles_are_computed(self, tmp_path, identity_affine):
+        vol = np.linspace(0, 100, 100, dtype=np.float32).reshape(5, 5, 4)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "v.nii.gz")
+
+        r = ImageLoader(tmp_path).load_all_images()[0]
+
+        assert r["stats"] is None
+        np.testing.assert_almost_equal(r["contrast_limits"][1], float(np.percentile(vol, 98)), decimal=3)
+
+
+class TestImageLoaderZarr:
+    def _write_zarr(self, path, vol, affine, stats=None):
+        store = zarr.create_array(path, shape=vol.shape, dtype=vol.dtype, chunks=(1,) + vol.shape[1:])
+        store[...] = vol
+        store.attrs.update({"affine": affine.tolist(), "source": "scan.nii.gz", "stats": stats})
+
+    def test_zarr_is_loaded_lazily(self, tmp_path, identity_affine):
+        vol = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        self._write_zarr(tmp_path / "scan.zarr", vol, identity_affine, {"percentiles": {"2": 1.0, "98": 22.0}})
+
+        r = ImageLoader(tmp_path).load_all_images()[0]
+
+        assert isinstance(r["data"], da.Array)
+        assert r["data"].dtype == np.float32
+        assert r["filename"] == "scan.nii.gz"
+        assert r["name"] == "3D_scan.nii"
+        assert r["contrast_limits"] == [1.0, 22.0]
+        np.testing.assert_array_equal(np.asarray(r["data"]), vol)
+
+    def test_zarr_replaces_sibling_nifti(self, tmp_path, identity_affine):
+        vol = np.zeros((2, 3, 4), dtype=np.float32)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "scan.nii.gz")
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "other.nii.gz")
+        self._write_zarr(tmp_path / "scan.zarr", vol, identity_affine)
+
+        results = ImageLoader(tmp_path).load_all_images()
+
+        assert [r["filename"] for r in results] == ["other.nii.gz", "scan.nii.gz"]
+        assert isinstance(results[1]["data"], da.Array)
+
 
 class TestImageLoaderEdgeCases:
     def test_empty_directory_returns_empty_list(self, tmp_path):
@@ -145,3 +232,157 @@ class TestImageLoaderEdgeCases:
         results = ImageLoader(tmp_path).load_all_images()
 
         assert results[0]["data"].dtype == np.float32
+
+
+class TestImageLoaderLazy:
+    def test_list_images_reads_headers_only(self, tmp_path, identity_affine):
+        nib.save(nib.Nifti1Image(np.zeros((2, 3, 4), dtype=np.float32), identity_affine), tmp_path / "v.nii.gz")
+        Image.fromarray(np.zeros((5, 6), dtype=np.uint8)).save(tmp_path / "img.png")
+
+        entries = ImageLoader(tmp_path).list_images()
+
+        assert [e["filename"] for e in entries] == ["v.nii.gz", "img.png"]
+        assert all(e["data"] is None for e in entries)
+        assert [e["shape"] for e in entries] == [(2, 3, 4), (5, 6)]
+        assert entries[0]["contrast_limits"] is None
+
+    def test_load_matches_eager_loading(self, tmp_path, identity_affine):
+        vol = np.linspace(0, 100, 24, dtype=np.float32).reshape(2, 3, 4)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "v.nii.gz")
+        loader = ImageLoader(tmp_path)
+
+        lazy = loader.load(loader.list_images()[0])
+        eager = loader.load_all_images()[0]
+
+        np.testing.assert_array_equal(lazy["data"], eager["data"])
+        assert lazy["contrast_limits"] == eager["contrast_limits"]
+        assert lazy["voxel_spacing"] == eager["voxel_spacing"]
+
+
+class TestVolumeCache:
+    def _entries(self, tmp_path, identity_affine, n=3):
+        for i in range(n):
+            nib.save(nib.Nifti1Image(np.full((4, 4, 4), i, dtype=np.float32), identity_affine), tmp_path / f"v{i}.nii.gz")
+        loader = ImageLoader(tmp_path)
+        return loader, loader.list_images()
+
+    def test_get_decodes_once(self, tmp_path, identity_affine):
+        loader, entries = self._entries(tmp_path, identity_affine)
+        cache = VolumeCache(loader)
+
+        first = cache.get(entries[1])
+
+        assert first["data"].shape == (4, 4, 4)
+        assert cache.get(entries[1]) is first
+        assert cache.is_loaded("v1.nii.gz") and not cache.is_loaded("v0.nii.gz")
+        cache.close()
+
+    def test_prefetched_images_count_towards_budget(self, tmp_path, identity_affine):
+        loader, entries = self._entries(tmp_path, identity_affine)
+        cache = VolumeCache(loader)
+
+        cache.prefetch(entries[2])
+        cache.get(entries[2])
+
+        assert cache.loaded_bytes() == 4 * 4 * 4 * 4
+        cache.close()
+
+    def test_prefetch_future_resolves_without_blocking_get(self, tmp_path, identity_affine):
+        loader, entries = self._entries(tmp_path, identity_affine)
+        cache = VolumeCache(loader)
+
+        future = cache.prefetch(entries[0])
+        future.result(timeout=10)
+
+        assert cache.get(entries[0]) is future.result()
+        assert cache.is_loaded("v0.nii.gz")
+        cache.close()
+
+    def test_evict_drops_least_recent_unpinned_over_budget(self, tmp_path, identity_affine):
+        loader, entries = self._entries(tmp_path, identity_affine)
+        cache = VolumeCache(loader, budget_mb=256 / 1024 / 1024)
+        for entry in entries:
+            cache.get(entry)
+
+        evicted = cache.evict(pinned={"v0.nii.gz"})
+
+        assert evicted == ["v1.nii.gz", "v2.nii.gz"]
+        assert cache.is_loaded("v0.nii.gz")
+        assert cache.loaded_bytes() <= cache.budget_bytes
+        cache.close()
+
+
+class TestImageLoaderNativeDtype:
+    def test_int16_volume_keeps_its_dtype(self, tmp_path, identity_affine):
+        vol = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "v.nii.gz")
+
+        r = ImageLoader(tmp_path, native=True).load_all_images()[0]
+
+        assert r["data"].dtype == np.int16
+        assert r["scaling"] is None
+        np.testing.assert_array_equal(r["data"], vol)
+
+    def test_scaling_is_kept_apart_and_folded_into_contrast_limits(self, tmp_path, identity_affine):
+        vol = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        img = nib.Nifti1Image(vol, identity_affine)
+        img.header.set_slope_inter(2.0, -10.0)
+        nib.save(img, tmp_path / "v.nii.gz")
+        stats = {"version": io_utils.STATS_VERSION, "size": (tmp_path / "v.nii.gz").stat().st_size,
+                 "percentiles": {"2": -10.0, "98": 30.0}}
+        (tmp_path / ("v.nii.gz" + io_utils.STATS_SUFFIX)).write_text(json.dumps(stats))
+
+        r = ImageLoader(tmp_path, native=True).load_all_images()[0]
+
+        assert r["data"].dtype == np.int16
+        assert r["scaling"] == (2.0, -10.0)
+        assert r["contrast_limits"] == [0.0, 20.0]
+        np.testing.assert_allclose(r["data"] * 2.0 - 10.0, io_utils.load_nifti_volume(tmp_path / "v.nii.gz")[0])
+
+    def test_rgb_luminance_in_channel_dtype(self, tmp_path, identity_affine):
+        rgb = np.zeros((2, 3, 4), dtype=[("R", "u1"), ("G", "u1"), ("B", "u1")])
+        rgb["R"], rgb["G"], rgb["B"] = 100, 200, 50
+        nib.save(nib.Nifti1Image(rgb, identity_affine), tmp_path / "rgb.nii.gz")
+
+        native = ImageLoader(tmp_path, native=True).load_all_images()[0]["data"]
+        eager = ImageLoader(tmp_path).load_all_images()[0]["data"]
+
+        assert native.dtype == np.uint8 and eager.dtype == np.float32
+        np.testing.assert_allclose(native, np.rint(eager))
+
+
+class TestImageLoaderMappedNifti:
+    def test_plain_nii_is_paged_not_loaded(self, tmp_path, identity_affine):
+        vol = np.linspace(0, 100, 2 * 3 * 40, dtype=np.float32).reshape(2, 3, 40)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "v.nii")
+        loader = ImageLoader(tmp_path)
+
+        entry = loader.list_images()[0]
+        r = loader.load_all_images()[0]
+
+        assert isinstance(entry["data"], da.Array)
+        assert isinstance(r["data"], da.Array)
+        np.testing.assert_array_equal(np.asarray(r["data"]), vol)
+        assert r["contrast_limits"][0] < r["contrast_limits"][1]
+
+    def test_mapped_volumes_do_not_count_towards_budget(self, tmp_path, identity_affine):
+        nib.save(nib.Nifti1Image(np.zeros((2, 3, 4), dtype=np.int16), identity_affine), tmp_path / "v.nii")
+        loader = ImageLoader(tmp_path, native=True)
+        cache = VolumeCache(loader, budget_mb=0)
+
+        r = cache.get(loader.list_images()[0])
+
+        assert isinstance(r["data"], np.memmap)
+        assert cache.loaded_bytes() == 0
+        cache.close()
+
+    def test_large_gzip_nifti_is_read_through_index(self, tmp_path, identity_affine):
+        vol = np.linspace(0, 100, 2 * 3 * 40, dtype=np.float32).reshape(2, 3, 40)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "v.nii.gz")
+        loader = ImageLoader(tmp_path, gzip_index_min_mb=0)
+
+        r = loader.load(loader.list_images()[0])
+
+        assert isinstance(r["data"], da.Array)
+        np.testing.assert_array_equal(np.asarray(r["data"]), vol)
+        assert isinstance(ImageLoader(tmp_path, gzip_index_min_mb=-1).load_all_images()[0]["data"], np.ndarray)
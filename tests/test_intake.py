@@ -0,0 +1,61 @@
+import json
+import signal
+
+import pytest
+
+from intake import main
+
+
+@pytest.fixture(autouse=True)
+def _restore_signals():
+    """``main`` instala manejadores de SIGINT/SIGTERM; se restauran al terminar."""
+    saved = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    yield
+    for sig, handler in saved.items():
+        signal.signal(sig, handler)
+
+
+def _events(text):
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class TestCli:
+    def test_dry_run_reports_plan_and_writes_nothing(self, dicom_patient, monkeypatch, capsys):
+        monkeypatch.delenv("DICOM_SALT_SECRET", raising=False)
+        root = dicom_patient.parent
+        before = sorted(p.relative_to(root) for p in root.rglob("*"))
+
+        code = main([str(dicom_patient), "--dry-run", "--workers", "2", "--stage-workers", "1,1", "--engine", "native"])
+
+        assert code == 0
+        assert sorted(p.relative_to(root) for p in root.rglob("*")) == before
+        assert not (dicom_patient / "PROCESSED_DATA").exists()
+        assert not (dicom_patient / "_temp_anon").exists()
+
+        events = _events(capsys.readouterr().out)
+        assert all({"time", "event"} <= set(e) for e in events)
+        plans = [e for e in events if e["event"] == "plan"]
+        assert [p["patient"] for p in plans] == ["PAC001"]
+        assert plans[0]["files"] == 2
+        assert events[-1]["event"] == "done" and events[-1]["ok"] is True
+        assert "No se escribió nada" in events[-1]["message"]
+
+    def test_progress_file(self, dicom_patient, monkeypatch, tmp_path, capsys):
+        monkeypatch.delenv("DICOM_SALT_SECRET", raising=False)
+        progress = tmp_path / "progress.jsonl"
+
+        assert main([str(dicom_patient), "--dry-run", "--progress", str(progress)]) == 0
+
+        assert capsys.readouterr().out == ""
+        assert _events(progress.read_text(encoding="utf-8"))[-1]["event"] == "done"
+
+    def test_salt_required_without_dry_run(self, dicom_patient, monkeypatch, capsys):
+        monkeypatch.delenv("DICOM_SALT_SECRET", raising=False)
+
+        assert main([str(dicom_patient)]) == 2
+        assert "DICOM_SALT_SECRET" in capsys.readouterr().err
+        assert not (dicom_patient / "PROCESSED_DATA").exists()
+
+    def test_bad_pair_is_rejected(self, dicom_patient):
+        with pytest.raises(SystemExit):
+            main([str(dicom_patient), "--dry-run", "--stage-workers", "x,y"])
@@ -1,5 +1,8 @@
 import json
+import os
+import time
 
+import dask.array as da
 import nibabel as nib
 import numpy as np
 import pytest
@@ -7,6 +10,17 @@ import pytest
 import io_utils
 from schemas import PatientManifest
 
+
+def _wait_for_index(path, newer_than=None, timeout=10.0):
+    """El índice gzip se construye en segundo plano."""
+    index = io_utils.gzip_index_path(path)
+    newer_than = path.stat().st_mtime_ns if newer_than is None else newer_than
+    deadline = time.monotonic() + timeout
+    while not (index.exists() and index.stat().st_mtime_ns >= newer_than):
+        assert time.monotonic() < deadline, "el índice gzip no se construyó"
+        time.sleep(0.02)
+    return index
+
 class TestNiftiMask:
     def test_save_load_roundtrip(self, tmp_path, sample_mask, identity_affine):
         path = tmp_path / "mask.nii.gz"
@@ -25,6 +39,23 @@ class TestNiftiMask:
         assert loaded.dtype == np.uint16
         np.testing.assert_array_equal(loaded, 1)
 
+    def test_uncompressed_mask_is_mapped_copy_on_write(self, tmp_path, sample_mask, identity_affine):
+        path = tmp_path / "mask.nii"
+        io_utils.save_nifti_mask(sample_mask, identity_affine, str(path))
+
+        loaded, _ = io_utils.load_nifti_mask(str(path))
+        loaded[0, 0, 0] = 7
+
+        assert isinstance(loaded, np.memmap)
+        assert io_utils.load_nifti_mask(str(path))[0][0, 0, 0] == 0
+
+    def test_save_accepts_dask_array(self, tmp_path, sample_mask, identity_affine):
+        import dask.array as da
+        path = tmp_path / "mask.nii.gz"
+        io_utils.save_nifti_mask(da.from_array(sample_mask, chunks=2), identity_affine, str(path))
+
+        np.testing.assert_array_equal(io_utils.load_nifti_mask(str(path))[0], sample_mask)
+
 
 class TestNiftiVolume:
     def test_basic_float_volume(self, tmp_path, identity_affine):
@@ -35,6 +66,115 @@ class TestNiftiVolume:
         assert loaded.dtype == np.float32
         np.testing.assert_array_almost_equal(loaded, vol)
 
+    def test_uncompressed_nifti_is_read_lazily(self, tmp_path, identity_affine):
+        vol = np.arange(120, dtype=np.int16).reshape(2, 6, 10)
+        img = nib.Nifti1Image(vol, identity_affine)
+        img.header.set_slope_inter(0.5, 3.0)
+        nib.save(img, tmp_path / "vol.nii")
+
+        data, _, scaling = io_utils.load_nifti_lazy(tmp_path / "vol.nii")
+        raw, _, raw_scaling = io_utils.load_nifti_lazy(tmp_path / "vol.nii", native=True)
+
+        assert data.dtype == np.float32 and scaling is None
+        assert data.chunks[-1][0] == io_utils.NIFTI_SLAB
+        np.testing.assert_allclose(np.asarray(data), io_utils.load_nifti_volume(tmp_path / "vol.nii")[0])
+        assert isinstance(raw, np.memmap) and raw_scaling == (0.5, 3.0)
+        np.testing.assert_array_equal(raw, vol)
+
+    def test_slab_aligned_materializes_chunks_across_the_slice_axis(self):
+        vol = np.arange(2 * 3 * 12, dtype=np.float32).reshape(2, 3, 12)
+        aligned = da.from_array(vol, chunks=(2, 3, io_utils.NIFTI_SLAB))
+        across = da.from_array(vol, chunks=(1, 3, 12))
+
+        assert io_utils.slab_aligned(aligned) is aligned
+        assert isinstance(io_utils.slab_aligned(across), np.ndarray)
+        assert io_utils.slab_aligned(across, axis=0) is across
+
+    def test_gzip_nifti_reads_slices_through_cached_index(self, tmp_path, identity_affine):
+        vol = np.arange(4 * 5 * 30, dtype=np.int16).reshape(4, 5, 30)
+        img = nib.Nifti1Image(vol, identity_affine)
+        img.header.set_slope_inter(2.0, -1.0)
+        nib.save(img, tmp_path / "vol.nii.gz")
+
+        data, _, scaling = io_utils.load_nifti_gzip_lazy(tmp_path / "vol.nii.gz")
+
+        assert isinstance(data, da.Array) and data.dtype == np.float32 and scaling is None
+        np.testing.assert_allclose(np.asarray(data[..., 3]), vol[..., 3] * 2.0 - 1.0)
+        index = _wait_for_index(tmp_path / "vol.nii.gz")
+        assert index.name == "vol.nii.gz" + io_utils.GZIP_INDEX_SUFFIX
+        np.testing.assert_allclose(np.asarray(data[..., 17]), vol[..., 17] * 2.0 - 1.0)
+        np.testing.assert_allclose(np.asarray(data[1:3, 2, 5:25]), vol[1:3, 2, 5:25] * 2.0 - 1.0)
+
+        raw, _, raw_scaling = io_utils.load_nifti_gzip_lazy(tmp_path / "vol.nii.gz", native=True)
+        assert raw.dtype == np.int16 and raw_scaling == (2.0, -1.0)
+        np.testing.assert_array_equal(np.asarray(raw), vol)
+
+    def test_stale_gzip_index_is_rebuilt(self, tmp_path, identity_affine):
+        path = tmp_path / "vol.nii.gz"
+        nib.save(nib.Nifti1Image(np.zeros((2, 2, 6), dtype=np.int16), identity_affine), path)
+        io_utils.load_nifti_gzip_lazy(path)
+        index = _wait_for_index(path)
+        os.utime(index, ns=(0, 0))
+
+        vol = np.ones((2, 2, 6), dtype=np.int16)
+        nib.save(nib.Nifti1Image(vol, identity_affine), path)
+        data, _, _ = io_utils.load_nifti_gzip_lazy(path)
+
+        np.testing.assert_array_equal(np.asarray(data), vol)
+        _wait_for_index(path)
+
+    def test_gzip_slabs_close_their_handle(self, tmp_path, identity_affine):
+        path = tmp_path / "vol.nii.gz"
+        vol = np.arange(2 * 2 * 6, dtype=np.int16).reshape(2, 2, 6)
+        nib.save(nib.Nifti1Image(vol, identity_affine), path)
+        header = nib.load(path).dataobj
+
+        slabs = io_utils._GzipSlabs(path, header.offset, header.shape, header.dtype)
+        np.testing.assert_array_equal(slabs[:, :, 1:3], vol[:, :, 1:3])
+        _wait_for_index(path)
+        slabs.close()
+
+        with pytest.raises(ValueError):
+            slabs[:, :, 0]
+
+    def test_only_single_channel_nii_is_mappable(self, tmp_path, identity_affine):
+        vol = np.zeros((2, 2, 2), dtype=np.float32)
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "a.nii")
+        nib.save(nib.Nifti1Image(vol, identity_affine), tmp_path / "a.nii.gz")
+
+        assert io_utils.is_mappable_nifti(tmp_path / "a.nii")
+        assert not io_utils.is_mappable_nifti(tmp_path / "a.nii.gz")
+
+class TestImageStats:
+    def _write(self, image, **overrides):
+        stats = {"version": io_utils.STATS_VERSION, "size": image.stat().st_size, "min": 0.0, "max": 9.0}
+        stats.update(overrides)
+        (image.parent / (image.name + io_utils.STATS_SUFFIX)).write_text(json.dumps(stats))
+
+    def test_returns_sidecar_for_matching_file(self, tmp_path):
+        image = tmp_path / "scan.nii.gz"
+        image.write_bytes(b"0123456789")
+        self._write(image)
+        assert io_utils.load_image_stats(image)["max"] == 9.0
+
+    def test_missing_sidecar_returns_none(self, tmp_path):
+        image = tmp_path / "scan.nii.gz"
+        image.write_bytes(b"0123")
+        assert io_utils.load_image_stats(image) is None
+
+    def test_stale_sidecar_is_ignored(self, tmp_path):
+        image = tmp_path / "img.png"
+        image.write_bytes(b"0123")
+        self._write(image, size=999)
+        assert io_utils.load_image_stats(image) is None
+
+    def test_other_version_is_ignored(self, tmp_path):
+        image = tmp_path / "img.png"
+        image.write_bytes(b"0123")
+        self._write(image, version=io_utils.STATS_VERSION + 1)
+        assert io_utils.load_image_stats(image) is None
+
+
 class TestPointsCsv:
     def test_roundtrip(self, tmp_path):
         pts = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
@@ -0,0 +1,33 @@
+import shutil
+import subprocess
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from nifti_assembler import UnsupportedSeries, assemble_series
+
+def _dcm2niix(src, out):
+    subprocess.run(["dcm2niix", "-z", "y", "-f", "ref", "-o", str(out), str(src)], check=True, capture_output=True)
+    return nib.load(out / "ref.nii.gz")
+
+
+@pytest.mark.skipif(shutil.which("dcm2niix") is None, reason="dcm2niix no está instalado")
+class TestMatchesDcm2niix:
+    @pytest.mark.parametrize("tilt", [0, 20])
+    def test_affine_and_voxels(self, tmp_path, ct_series, tilt):
+        angle = np.deg2rad(tilt)
+        datasets = ct_series(tmp_path / "in", row=(np.cos(angle), 0.0, np.sin(angle)))
+        (tmp_path / "out").mkdir()
+        reference = _dcm2niix(tmp_path / "in", tmp_path / "out")
+
+        volume = assemble_series(reversed(datasets))
+        assert np.allclose(volume.affine, reference.affine, atol=1e-3)
+        assert np.array_equal(volume.data, np.asarray(reference.dataobj))
+
+
+class TestUnsupported:
+    def test_repeated_positions_are_rejected(self, tmp_path, ct_series):
+        datasets = ct_series(tmp_path, spacing=0.0)
+        with pytest.raises(UnsupportedSeries):
+            assemble_series(datasets)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+from pydicom.data import get_testdata_file
+
+import nifti_converter
+from nifti_converter import Dcm2niixPool, SmartMedicalConverter
+
+JPEG2000 = "MR_small_jp2klossless.dcm"
+
+
+def _converter(tmp_path, **kwargs):
+    return SmartMedicalConverter(
+        str(tmp_path / "anon"), output_dir=str(tmp_path / "PROCESSED_DATA"), engine="native", **kwargs
+    )
+
+
+def _script(tmp_path, name, body):
+    path = tmp_path / name
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(0o755)
+    return str(path)
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(os.name != "posix", reason="grupos de procesos POSIX")
+class TestDcm2niixPool:
+    def test_concurrent_jobs_are_bounded(self, tmp_path):
+        running = tmp_path / "running"
+        running.mkdir()
+        job = _script(tmp_path, "job.sh", f'touch {running}/$$\nls {running} | wc -l\nsleep 0.3\nrm {running}/$$\n')
+        pool = Dcm2niixPool(max_jobs=2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.run([job]))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert [r.returncode for r in results] == [0] * 5
+        assert max(int(r.stdout) for r in results) <= 2
+
+    def test_timeout_kills_the_process_group(self, tmp_path):
+        pid_file = tmp_path / "child.pid"
+        job = _script(tmp_path, "job.sh", f"sleep 30 &\necho $! > {pid_file}\nwait\n")
+        start = time.monotonic()
+
+        result = Dcm2niixPool(timeout=0.5).run([job])
+
+        assert result.timed_out and not result.cancelled
+        assert "timed out" in result.stderr
+        assert time.monotonic() - start < 10
+        assert not _alive(int(pid_file.read_text()))
+
+    def test_should_stop_terminates_running_jobs(self, tmp_path):
+        job = _script(tmp_path, "job.sh", "sleep 30\n")
+        stop = threading.Event()
+        threading.Timer(0.3, stop.set).start()
+        start = time.monotonic()
+
+        result = Dcm2niixPool(should_stop=stop.is_set).run([job])
+
+        assert result.cancelled and not result.timed_out
+        assert time.monotonic() - start < 10
+        assert Dcm2niixPool(should_stop=stop.is_set).run([job]).cancelled
+
+
+class TestDecompression:
+    def test_series_share_one_process_pool(self, tmp_path):
+        files = []
+        for i in range(2):
+            files.append(tmp_path / f"{i}.dcm")
+            shutil.copy(get_testdata_file(JPEG2000), files[-1])
+        converter = _converter(tmp_path, max_jobs=2)
+        try:
+            assert converter.decompress_files(files, tmp_path / "a") == 2
+            executor = converter._decompressor
+            assert converter.decompress_files(files, tmp_path / "b") == 2
+            assert converter._decompressor is executor
+            assert not converter.needs_decompression(converter.dicom_files(tmp_path / "b"))
+        finally:
+            converter.close()
+        assert converter._decompressor is None
+
+    def _routed(self, tmp_path, monkeypatch, name):
+        """Runs ``convert_volume`` on a one-file series, recording the
+        repair passes and the folders dcm2niix was given."""
+        monkeypatch.setattr(nifti_converter.shutil, "which", lambda _: "dcm2niix")
+        converter = SmartMedicalConverter(str(tmp_path / "anon"), engine="dcm2niix")
+        series = tmp_path / "anon" / "ANONPAC001"
+        series.mkdir(parents=True)
+        shutil.copy(get_testdata_file(name), series / name)
+        repairs, runs = [], []
+        repair = converter.repair_dicom_compression
+        monkeypatch.setattr(converter, "repair_dicom_compression", lambda *a: repairs.append(a) or repair(*a))
+        monkeypatch.setattr(converter, "_run_dcm2niix", lambda src, out, pid: runs.append(src) or ([], ""))
+        converter.convert_volume(series, tmp_path / "out", "PAC001")
+        return converter, series, repairs, runs
+
+    def test_explicit_vr_series_goes_straight_to_dcm2niix(self, tmp_path, monkeypatch):
+        converter, series, repairs, runs = self._routed(tmp_path, monkeypatch, "CT_small.dcm")
+
+        assert not converter.needs_decompression(converter.dicom_files(series))
+        assert repairs == [] and runs == [series]
+
+    def test_jpeg2000_series_is_decompressed_once(self, tmp_path, monkeypatch):
+        converter, series, repairs, runs = self._routed(tmp_path, monkeypatch, JPEG2000)
+
+        assert converter.needs_decompression(converter.dicom_files(series))
+        assert len(repairs) == 1 and len(runs) == 1
+        assert runs[0] != series
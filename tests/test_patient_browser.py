@@ -49,6 +49,27 @@ class TestScanPatient:
         assert info is not None
         assert info.png_count >= 1 
 
+    def test_counts_tiff_and_npy_as_2d_images(self, tmp_path):
+        d = tmp_path / "PAC004"
+        d.mkdir()
+        (d / "L_CC_0.tiff").touch()
+        (d / "R_CC_1.npy").touch()
+
+        info = _scan_patient(d, "MAMA")
+        assert info is not None
+        assert info.png_count == 2
+
+    def test_zarr_only_volume_counts_once(self, tmp_path):
+        d = tmp_path / "PAC005"
+        d.mkdir()
+        (d / "a.nii.gz").touch()
+        (d / "a.zarr").mkdir()
+        (d / "b.zarr").mkdir()
+
+        info = _scan_patient(d, "PROSTATA")
+        assert info is not None
+        assert info.nifti_count == 2
+
     def test_detects_annotations(self, tmp_path):
         d = tmp_path / "PAC003"
         d.mkdir()
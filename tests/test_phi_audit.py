@@ -0,0 +1,95 @@
+import pydicom
+import pytest
+
+from dicom_processor import UID_ROOT, AnonymizeJob, anonymize_file, anonymize_uid, close_uid_stores, shared_uid_store
+from phi_audit import ERROR, audit_file, audit_tree
+
+SALT = "sal-de-prueba"
+
+
+def _anonymized(dicom_patient, out, name="MR_small.dcm", uid_store=None):
+    job = AnonymizeJob(dicom_patient / name, out / name, "PAC001")
+    anonymize_file(job, SALT, uid_store=uid_store)
+    return job.dst
+
+
+class TestAudit:
+    @pytest.mark.parametrize("name", ["CT_small.dcm", "MR_small.dcm"])
+    def test_anonymizer_output_passes(self, dicom_patient, tmp_path, name):
+        out = tmp_path / "ANONYMIZED" / "ANONPAC001"
+        path = _anonymized(dicom_patient, out, name)
+
+        report = audit_tree(out, max_workers=1)
+        assert report.files == 1
+        assert report.passed(), report.summary()
+        ds = pydicom.dcmread(path)
+        assert ds.file_meta.MediaStorageSOPInstanceUID == ds.SOPInstanceUID
+        assert "OtherPatientIDsSequence" not in ds
+
+    def test_parallel_audit_matches_serial(self, dicom_patient):
+        serial = audit_tree(dicom_patient, max_workers=1)
+        parallel = audit_tree(dicom_patient, max_workers=2)
+        assert sorted(parallel.findings, key=str) == sorted(serial.findings, key=str)
+
+    def test_original_files_fail(self, dicom_patient):
+        report = audit_tree(dicom_patient, max_workers=1)
+        assert not report.passed()
+        flagged = {f.location for f in report.errors}
+        assert {"PatientID", "SOPInstanceUID", "PatientIdentityRemoved"} <= flagged
+
+    def test_uppercase_extension_is_audited(self, dicom_patient, tmp_path):
+        out = tmp_path / "ANONPAC001"
+        out.mkdir()
+        (dicom_patient / "MR_small.dcm").rename(out / "MR_SMALL.DCM")
+
+        report = audit_tree(out, max_workers=1)
+        assert report.files == 1
+        assert not report.passed()
+
+    def test_reintroduced_name_is_flagged(self, dicom_patient, tmp_path):
+        path = _anonymized(dicom_patient, tmp_path / "ANONPAC001")
+        ds = pydicom.dcmread(path)
+        ds.PatientName = "Apellido^Nombre"
+        ds.save_as(path)
+
+        findings, error = audit_file(str(path))
+        assert error == ""
+        assert [f.location for f in findings if f.severity == ERROR] == ["PatientName"]
+
+    def test_original_media_storage_uid_is_flagged(self, dicom_patient, tmp_path):
+        path = _anonymized(dicom_patient, tmp_path / "ANONPAC001")
+        original = pydicom.dcmread(dicom_patient / "MR_small.dcm").SOPInstanceUID
+        ds = pydicom.dcmread(path)
+        ds.file_meta.MediaStorageSOPInstanceUID = original
+        ds.save_as(path)
+
+        findings, _ = audit_file(str(path))
+        assert [f.location for f in findings if f.severity == ERROR] == ["file_meta.MediaStorageSOPInstanceUID"]
+
+    def test_original_uid_under_uid_root_needs_exact_check(self, dicom_patient, tmp_path):
+        path = _anonymized(dicom_patient, tmp_path / "ANONPAC001")
+        ds = pydicom.dcmread(path)
+        expected = {"SOPInstanceUID": ds.SOPInstanceUID}
+        ds.SOPInstanceUID = f"{UID_ROOT}12345.6"
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        ds.save_as(path)
+
+        findings, _ = audit_file(str(path))
+        assert not [f for f in findings if f.severity == ERROR]
+        findings, _ = audit_file(str(path), expected=expected)
+        assert [f.location for f in findings if f.severity == ERROR] == ["SOPInstanceUID"]
+
+    def test_uids_are_checked_against_the_store(self, dicom_patient, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        out = tmp_path / "ANONPAC001"
+        try:
+            path = _anonymized(dicom_patient, out, uid_store=shared_uid_store(db, SALT))
+            assert audit_tree(out, max_workers=1, uid_store=(str(db), SALT)).passed()
+
+            ds = pydicom.dcmread(path)
+            ds.SeriesInstanceUID = anonymize_uid("1.2.3.4", SALT)
+            ds.save_as(path)
+            report = audit_tree(out, max_workers=1, uid_store=(str(db), SALT))
+            assert [f.location for f in report.errors] == ["SeriesInstanceUID"]
+        finally:
+            close_uid_stores()
@@ -0,0 +1,74 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from pipeline_workers import ConvertWorker, LogChannel, ProgressChannel
+
+
+class TestConvertWorker:
+    def test_bad_converter_setting_reports_done(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("NIFTI_ENGINE", "bogus")
+        worker = ConvertWorker(str(tmp_path))
+        results = []
+        worker.done.connect(lambda ok, message: results.append((ok, message)))
+
+        worker.run()
+
+        assert len(results) == 1
+        ok, message = results[0]
+        assert not ok and "bogus" in message
+
+
+class TestLogChannel:
+    def test_drain_returns_and_clears(self):
+        channel = LogChannel()
+        channel.emit("uno")
+        channel.emit("dos")
+
+        assert channel.drain() == ["uno", "dos"]
+        assert channel.drain() == []
+
+    def test_file_keeps_every_line(self, tmp_path):
+        channel = LogChannel(tmp_path / "run.log")
+        for i in range(3):
+            channel.emit(f"línea {i}")
+        channel.drain()
+        channel.emit("última")
+        channel.close()
+
+        lines = (tmp_path / "run.log").read_text(encoding="utf-8").splitlines()
+        assert lines == ["línea 0", "línea 1", "línea 2", "última"]
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="permisos POSIX")
+    def test_private_permissions(self, tmp_path):
+        log_path = tmp_path / "logs" / "run.log"
+        old = os.umask(0)
+        try:
+            channel = LogChannel(log_path)
+        finally:
+            os.umask(old)
+        channel.close()
+
+        assert stat.S_IMODE(log_path.stat().st_mode) == 0o600
+        assert stat.S_IMODE(log_path.parent.stat().st_mode) == 0o700
+
+
+class TestProgressChannel:
+    def test_keeps_only_latest(self):
+        channel = ProgressChannel()
+        for done in range(5):
+            channel.emit(done, 10)
+
+        assert channel.drain() == [(4, 10)]
+        assert channel.drain() == []
+
+    def test_keyed_keeps_latest_per_stage(self):
+        channel = ProgressChannel(keyed=True)
+        channel.emit("Anonimización", 1, 4)
+        channel.emit("Conversión", 1, 4)
+        channel.emit("Anonimización", 3, 4)
+
+        assert sorted(channel.drain()) == [("Anonimización", 3, 4), ("Conversión", 1, 4)]
+        assert channel.drain() == []
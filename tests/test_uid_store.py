@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from dicom_processor import anonymize_uid, close_uid_stores, open_uid_store, shared_uid_store
+
+SALT = "sal-de-prueba"
+ORIGINAL = "1.2.826.0.1.3680043.8.498.12345"
+
+
+class TestUIDMapStore:
+    def test_reverse_recovers_original(self, tmp_path):
+        with open_uid_store(tmp_path / "uids.sqlite", SALT) as store:
+            anon = store.map_uid(ORIGINAL, "instance")
+            assert anon == anonymize_uid(ORIGINAL, SALT)
+            assert store.reverse(anon) == [ORIGINAL]
+            assert store.lookup(ORIGINAL) == anon
+            assert store.is_mapped(anon)
+            assert not store.is_mapped(ORIGINAL)
+
+    def test_original_is_not_stored_in_clear(self, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        with open_uid_store(db, SALT) as store:
+            store.map_uid(ORIGINAL)
+        assert ORIGINAL.encode() not in db.read_bytes()
+
+    def test_tampered_row_is_rejected(self, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        with open_uid_store(db, SALT) as store:
+            anon = store.map_uid(ORIGINAL)
+        with sqlite3.connect(db) as conn:
+            blob, = conn.execute("SELECT original_enc FROM uid_map").fetchone()
+            conn.execute("UPDATE uid_map SET original_enc = ?", (blob[:-1] + bytes([blob[-1] ^ 1]),))
+
+        with open_uid_store(db, SALT) as store:
+            with pytest.raises(ValueError):
+                store.reverse(anon)
+
+    def test_other_salt_cannot_decrypt(self, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        with open_uid_store(db, SALT) as store:
+            anon = store.map_uid(ORIGINAL)
+        with open_uid_store(db, "otra-sal") as store:
+            assert store.lookup(ORIGINAL) is None
+            with pytest.raises(ValueError):
+                store.reverse(anon)
+
+    def test_older_format_is_refused(self, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        with open_uid_store(db, SALT) as store:
+            store.map_uid(ORIGINAL)
+        with sqlite3.connect(db) as conn:
+            conn.execute("PRAGMA user_version = 1")
+
+        with pytest.raises(ValueError):
+            open_uid_store(db, SALT)
+
+    def test_shared_stores_are_flushed_and_closed(self, tmp_path):
+        db = tmp_path / "uids.sqlite"
+        store = shared_uid_store(db, SALT)
+        assert shared_uid_store(db, SALT) is store
+        anon = store.map_uid(ORIGINAL)
+
+        close_uid_stores()
+
+        assert store._conn is None
+        with open_uid_store(db, SALT) as reopened:
+            assert reopened.reverse(anon) == [ORIGINAL]